@@ -0,0 +1,119 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Kernel event mask benchmark, on a synthetic keyboard-like scanner (MSC_SCAN, key down/up,
+SYN_REPORT for every key, plus a LED packet after every scan). The synthetic device emulates
+the kernel event mask: events are injected one packet at a time and the reader drains the
+device after each one, as it would after every wakeup.
+
+Reports wakeups, events read and the events / wakeups filtered in the reader, with and
+without the event mask.
+
+Usage: python benchmarks/event_mask_benchmark.py [--scans 2000]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+from evdev import InputEvent, ecodes
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from config import DeviceConfig
+from readers.evdev_device_reader import EMPTY_WAKEUPS, FILTERED_EVENTS, EvdevDeviceReader
+from readers.synthetic_device import SyntheticDeviceBackend, key_events, random_code
+#pylint: enable=wrong-import-position
+
+class CountingQueue:
+    """Queue stand-in, counts the scans"""
+
+    def __init__(self):
+        self.count = 0
+
+    def put(self, _item, _block=True, _timeout=None):
+        """Count the scan"""
+        self.count += 1
+
+def packets(scans: int) -> list[list[InputEvent]]:
+    """Split the scanner events into SYN_REPORT terminated packets"""
+    rng = random.Random(1)
+    result = []
+    for _ in range(scans):
+        packet = []
+        for event in key_events(random_code(rng, 12), timestamp=0.0):
+            packet.append(event)
+            if event.type == ecodes.EV_SYN:
+                result.append(packet)
+                packet = []
+        result.append([
+            InputEvent(0, 0, ecodes.EV_LED, ecodes.LED_NUML, 1),
+            InputEvent(0, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0),
+        ])
+    return result
+
+def run(event_mask: bool, raw_events: bool, device_packets: list, scans: int) -> tuple:
+    backend = SyntheticDeviceBackend()
+    device = backend.attach("/dev/input/synthetic0", 1, 1)
+    config = DeviceConfig(id=f"mask{int(event_mask)}raw{int(raw_events)}", vid=1, pid=1)
+    queue = CountingQueue()
+    reader = EvdevDeviceReader(config, queue, discovery=backend, device_factory=backend.open,
+                               raw_events=raw_events, event_mask=event_mask)
+    reader.grab()
+
+    wakeups = 0
+    key_events_read = 0
+    for packet in device_packets:
+        device.inject(packet)
+        while True:
+            events = reader.read()
+            if events is None:
+                break
+            wakeups += 1
+            key_events_read += len(events)
+            reader.feed(events)
+    backend.stop()
+
+    assert queue.count == scans, f"{queue.count} scans decoded"
+    filtered = FILTERED_EVENTS.labels(config.id).value
+    empty = EMPTY_WAKEUPS.labels(config.id).value
+    return (wakeups, key_events_read + filtered, filtered, empty)
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--scans", type=int, default=2000)
+    args = args_parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    device_packets = packets(args.scans)
+    total = sum(len(packet) for packet in device_packets)
+    print(f"{len(device_packets)} packets, {total} events, {args.scans} scans")
+    print(f"{'path':<6} {'mask':<5} | {'wakeups':>8} {'events':>8} {'filtered':>8} "
+          f"{'empty':>7}")
+    for raw_events in (False, True):
+        for event_mask in (False, True):
+            (wakeups, events, filtered, empty) = run(
+                event_mask, raw_events, device_packets, args.scans)
+            print(f"{'raw' if raw_events else 'evdev':<6} {'on' if event_mask else 'off':<5} | "
+                  f"{wakeups:>8} {events:>8} {filtered:>8} {empty:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Throughput and latency of HttpSender against the local webhook stand-in (http_server.py),
+for different batch sizes, numbers of workers (concurrent keep-alive connections) and
+simulated server latencies. Latency is measured from the queue to the server (p50 / p99),
+with all the scans queued at once.
+
+Usage: python benchmarks/http_sender_benchmark.py [--scans 2000] [--format ndjson|json]
+                                                  [--gzip-min-bytes 0]
+"""
+
+import argparse
+import logging
+import os
+import sys
+from queue import Queue
+from statistics import quantiles
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from http_server import HttpServer
+from scan import Scan
+from senders.http_sender import HttpSender
+from senders.sender_pool import SenderPool
+#pylint: enable=wrong-import-position
+
+LATENCIES_MS = [0, 5]
+BATCH_SIZES = [1, 10, 100]
+WORKERS = [1, 4]
+DEVICES = 8
+
+def run(server: HttpServer, args, workers: int, batch_size: int) -> tuple[float, float, float]:
+    """Push the scans through the sender, returns scans/s, p50 and p99 latency (ms)"""
+    server.scans.clear()
+    queue = Queue()
+
+    def create_sender(worker_queue):
+        return HttpSender("bench", worker_queue, server.url, body_format=args.format,
+                          polling_ms=50, batch_size=batch_size, batch_linger_ms=0,
+                          gzip_min_bytes=args.gzip_min_bytes)
+
+    sender = SenderPool(queue, workers, create_sender) if workers > 1 else create_sender(queue)
+    sender.start()
+
+    # Scans are queued in a single burst: the latency includes the time waiting in the queue
+    start = perf_counter()
+    queued = {}
+    for i in range(args.scans):
+        code = f"CODE{i:08d}"
+        queued[code] = perf_counter()
+        queue.put(Scan(f"dev{i % DEVICES}", code, 0))
+    while len(server.scans) < args.scans:
+        sleep(0.001)
+    elapsed = perf_counter() - start
+    sender.stop()
+
+    latencies = [(arrival - queued[scan['code']]) * 1000.0 for (scan, arrival) in server.scans]
+    cuts = quantiles(latencies, n=100)
+    return (args.scans / elapsed, cuts[49], cuts[98])
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--scans", type=int, default=2000)
+    args_parser.add_argument("--format", default="ndjson", choices=["ndjson", "json"])
+    args_parser.add_argument("--gzip-min-bytes", type=int, default=0)
+    args = args_parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for latency_ms in LATENCIES_MS:
+        server = HttpServer(latency_s=latency_ms / 1000.0).start()
+        print(f"Server latency {latency_ms}ms")
+        print(f"{'workers':>8} | " + " | ".join(f"{f'batch {size}':>31}" for size in BATCH_SIZES))
+        for workers in WORKERS:
+            results = [run(server, args, workers, size) for size in BATCH_SIZES]
+            print(f"{workers:>8} | " + " | ".join(
+                f"{rate:>7.0f}/s p50 {p50:>6.1f} p99 {p99:>6.1f}ms" for (rate, p50, p99) in results))
+        print(f"Connections opened: {server.connections}")
+        server.stop()
+        print()
+
+if __name__ == "__main__":
+    main()
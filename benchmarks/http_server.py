@@ -0,0 +1,170 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tiny in-process HTTP webhook stand-in (HTTP/1.1 with keep-alive), accepting NDJSON
+and JSON array bodies (optionally gzipped) on any path, with fault injection:
+ - latency: added once per request
+ - statuses: reply to the next requests with a given status (and Retry-After)
+ - outages: drop every connection and refuse new ones until the outage ends
+"""
+
+import gzip
+import json
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from typing import Optional
+
+class HttpServer:
+    """In-process HTTP server, see module docstring"""
+    latency_s: float
+
+    # Received scans, as (scan, arrival perf_counter)
+    scans: list[tuple[dict, float]]
+    requests: int
+    gzipped: int
+    # Connections opened by the clients so far (1 per worker with keep-alive)
+    connections: int
+
+    _statuses: list[tuple[int, Optional[int]]]
+    _down: bool
+    _lock: Lock
+    _sockets: set
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.scans = []
+        self.requests = 0
+        self.gzipped = 0
+        self.connections = 0
+
+        self._statuses = []
+        self._down = False
+        self._lock = Lock()
+        self._sockets = set()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Serve the requests of a single client connection"""
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                server._connected(self.connection)
+
+            def finish(self):
+                super().finish()
+                with server._lock:
+                    server._sockets.discard(self.connection)
+
+            def do_POST(self):
+                #pylint: disable=invalid-name
+                server._serve(self)
+
+            def log_message(self, format, *args):
+                #pylint: disable=redefined-builtin
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        """Port the server is listening on"""
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        """Webhook url"""
+        return f"http://127.0.0.1:{self.port}/scans"
+
+    def start(self):
+        """Start serving in background"""
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and drop every connection"""
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_status(self, status: int, count: int = 1, retry_after: Optional[int] = None):
+        """Reply to the next count requests with the given status"""
+        with self._lock:
+            self._statuses.extend([(status, retry_after)] * count)
+
+    def set_down(self, down: bool):
+        """Start (True) or end (False) an outage"""
+        self._down = down
+        if down:
+            self.drop_connections()
+
+    def drop_connections(self):
+        """Close every client connection (as an idle keep-alive timeout would)"""
+        with self._lock:
+            sockets = list(self._sockets)
+        for connection in sockets:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _connected(self, connection: socket.socket):
+        if self._down:
+            connection.shutdown(socket.SHUT_RDWR)
+            return
+        with self._lock:
+            self._sockets.add(connection)
+            self.connections += 1
+
+    def _serve(self, handler: BaseHTTPRequestHandler):
+        body = handler.rfile.read(int(handler.headers.get('Content-Length', 0)))
+        arrival = perf_counter()
+        if self._down:
+            handler.close_connection = True
+            return
+
+        if self.latency_s > 0:
+            sleep(self.latency_s)
+
+        with self._lock:
+            self.requests += 1
+            (status, retry_after) = self._statuses.pop(0) if self._statuses else (200, None)
+
+        if status == 200:
+            if handler.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+                with self._lock:
+                    self.gzipped += 1
+            if handler.headers.get('Content-Type') == 'application/json':
+                scans = json.loads(body)
+            else:
+                scans = [json.loads(line) for line in body.splitlines() if line]
+            with self._lock:
+                self.scans.extend((scan, arrival) for scan in scans)
+
+        handler.send_response(status)
+        if retry_after is not None:
+            handler.send_header('Retry-After', str(retry_after))
+        handler.send_header('Content-Length', '0')
+        handler.end_headers()
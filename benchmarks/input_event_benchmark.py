@@ -0,0 +1,125 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Event decoding benchmark: evdev path (device.read() -> InputEvent objects -> key events)
+against the raw path (readinto a preallocated buffer -> memoryview decoding of the key events).
+Both paths read the same raw input_event structs from a pipe, through EvdevDeviceReader.
+
+Usage: python benchmarks/input_event_benchmark.py [--scans 20000] [--rounds 3]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+from time import perf_counter
+from evdev.eventio import EventIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from config import DeviceConfig
+from readers.evdev_device_reader import EvdevDeviceReader
+from readers.input_events import INPUT_EVENT
+from readers.synthetic_device import key_events, random_code
+#pylint: enable=wrong-import-position
+
+# Events written to the pipe at once (below the default 64 KiB pipe capacity)
+CHUNK_EVENTS = 2048
+
+class PipeDevice:
+    """Device reading raw input_event structs from a pipe, read() is evdev's own implementation"""
+
+    def __init__(self, _path: str):
+        self.fd, self.write_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+
+    def read(self):
+        """Same as evdev.InputDevice.read()"""
+        return EventIO.read(self)
+
+    def grab(self):
+        """No-op"""
+
+    def close(self):
+        """No-op"""
+
+class CountingQueue:
+    """Queue stand-in, counts the scans"""
+
+    def __init__(self):
+        self.count = 0
+
+    def put(self, _item, _block=True, _timeout=None):
+        """Count the scan"""
+        self.count += 1
+
+def run(raw_events: bool, chunks: list[bytes]) -> tuple[float, int]:
+    """Return the seconds spent reading and decoding every chunk, and the scans enqueued"""
+    queue = CountingQueue()
+    config = DeviceConfig(id="bench", vid=0, pid=0, hwid_regex="/dev/input/bench")
+    reader = EvdevDeviceReader(config, queue, device_factory=PipeDevice, raw_events=raw_events)
+    reader.grab()
+    device = reader._device #pylint: disable=protected-access
+
+    elapsed = 0.0
+    for chunk in chunks:
+        os.write(device.write_fd, chunk)
+        start = perf_counter()
+        while True:
+            raw_events = reader.read()
+            if raw_events is None:
+                break
+            reader.feed(raw_events)
+        elapsed += perf_counter() - start
+
+    os.close(device.fd)
+    os.close(device.write_fd)
+    return elapsed, queue.count
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--scans", type=int, default=20000)
+    args_parser.add_argument("--rounds", type=int, default=3)
+    args = args_parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(1)
+    events = []
+    for _ in range(args.scans):
+        events.extend(key_events(random_code(rng, 12), timestamp=0.0))
+    data = b"".join(
+        INPUT_EVENT.pack(event.sec, event.usec, event.type, event.code, event.value)
+        for event in events
+    )
+    step = CHUNK_EVENTS * INPUT_EVENT.size
+    chunks = [data[i:i + step] for i in range(0, len(data), step)]
+
+    print(f"{len(events)} events, {args.scans} scans")
+    print(f"{'path':<6} | {'events/s':>10} {'scans/s':>9} {'ns/event':>9}")
+    for (name, raw_events) in (("evdev", False), ("raw", True)):
+        best = min(run(raw_events, chunks) for _ in range(args.rounds))
+        (elapsed, scans) = best
+        assert scans == args.scans, f"{name}: {scans} scans decoded"
+        print(f"{name:<6} | {len(events) / elapsed:>10.0f} {scans / elapsed:>9.0f} "
+              f"{elapsed / len(events) * 1e9:>9.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Cost of recording metrics on the hot path (counter increment, histogram observation)
+and of rendering the registry in Prometheus text format.
+
+Usage: python benchmarks/metrics_benchmark.py
+"""
+
+import os
+import sys
+from time import perf_counter_ns
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from metrics.registry import MetricsRegistry
+#pylint: enable=wrong-import-position
+
+ITERATIONS = 1000000
+
+def bench(name: str, iterations: int, func):
+    start = perf_counter_ns()
+    func()
+    elapsed = perf_counter_ns() - start
+    print(f"  {name:<32} {elapsed / iterations:8.1f} ns/op")
+
+def main():
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "Benchmark counter", ["device"]).labels("device01")
+    histogram = registry.histogram("bench_seconds", "Benchmark histogram").labels()
+    values = [(i % 1000) / 10000.0 for i in range(ITERATIONS)]
+
+    def loop():
+        for _ in range(ITERATIONS):
+            pass
+
+    def inc():
+        for _ in range(ITERATIONS):
+            counter.inc()
+
+    def observe():
+        for value in values:
+            histogram.observe(value)
+
+    bench("empty loop (baseline)", ITERATIONS, loop)
+    bench("counter inc", ITERATIONS, inc)
+    bench("histogram observe", ITERATIONS, observe)
+
+    for i in range(100):
+        registry.counter("bench_total", "Benchmark counter", ["device"]).labels(f"device{i:02d}").inc()
+    bench("expose (100 series + histogram)", 1000, lambda: [registry.expose() for _ in range(1000)])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Latency from an assembled scan to a consumer on the same host, through the local
+publisher (Unix domain socket and TCP) and through the Redis path (RedisStreamSender,
+then a consumer blocked on XREAD), with a simulated network round trip time (RTT)
+to Redis. Scans are produced at a steady pace, as a scanner would.
+
+Without a reachable redis-server (--host / --port) the in-process stand-in is used,
+which has no XREAD: the Redis path is then measured up to the server only, a lower
+bound of what a consumer would see.
+
+Usage: python benchmarks/publisher_latency_benchmark.py [--host 127.0.0.1] [--port 6379]
+                                                        [--scans 300] [--rtt-ms 1]
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+from queue import Queue
+from statistics import quantiles
+from threading import Thread
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from redis import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from publishers.local_publisher import LocalPublisher
+from redis_sender_benchmark import DelayProxy
+from resp_server import RespServer
+from scan import Scan
+from senders.redis_stream_sender import RedisStreamSender
+#pylint: enable=wrong-import-position
+
+STREAM = "barcode-relay-latency-benchmark"
+SOCKET_PATH = "barcode-relay-benchmark.sock"
+INTERVAL_S = 0.02
+
+def produce(scans: int, put) -> dict[str, float]:
+    """Hand the scans to put at a steady pace, returns the time each code was produced"""
+    produced = {}
+    for i in range(scans):
+        code = f"CODE{i:08d}"
+        produced[code] = perf_counter()
+        put(Scan("bench", code, 0))
+        sleep(INTERVAL_S)
+    return produced
+
+def summary(produced: dict[str, float], arrivals: dict[str, float]) -> str:
+    latencies = [(arrivals[code] - start) * 1e6 for (code, start) in produced.items()
+                 if code in arrivals]
+    cuts = quantiles(latencies, n=100)
+    return (f"p50 {cuts[49]:>8.0f}us | p99 {cuts[98]:>8.0f}us | max {max(latencies):>8.0f}us"
+            f" | {len(latencies)}/{len(produced)} received")
+
+def run_publisher(scans: int, path: str = None) -> str:
+    """Scans published locally, received by a subscriber reading lines"""
+    publisher = LocalPublisher("bench", path, port=0)
+    publisher.start()
+    if path is not None:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+    else:
+        client = socket.create_connection(publisher.address)
+    while publisher.subscribers == 0:
+        sleep(0.001)
+
+    arrivals = {}
+
+    def consume():
+        buffer = b""
+        while len(arrivals) < scans:
+            data = client.recv(65536)
+            if not data:
+                return
+            now = perf_counter()
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                # {"relay":"bench","device":"bench","code":"CODE...","ts":0}
+                arrivals[line.split(b'"code":"')[1].split(b'"')[0].decode()] = now
+
+    consumer = Thread(target=consume)
+    consumer.start()
+    produced = produce(scans, publisher.publish)
+    consumer.join(5)
+    client.close()
+    publisher.stop()
+    return summary(produced, arrivals)
+
+def run_redis(scans: int, port: int, consumer_port: int = None, server: RespServer = None) -> str:
+    """
+    Scans sent by a RedisStreamSender, received by a consumer blocked on XREAD
+    (consumer_port) or timed on arrival at the in-process stand-in (server)
+    """
+    arrivals = {}
+    consumer = None
+    if consumer_port is not None:
+        redis = Redis(port=consumer_port)
+        redis.delete(STREAM)
+
+        def consume():
+            last_id = "0-0"
+            while len(arrivals) < scans:
+                for (_, entries) in redis.xread({STREAM: last_id}, block=1000) or []:
+                    now = perf_counter()
+                    for (entry_id, fields) in entries:
+                        arrivals[fields[b"code"].decode()] = now
+                        last_id = entry_id
+
+        consumer = Thread(target=consume)
+        consumer.start()
+
+    queue = Queue()
+    sender = RedisStreamSender("bench", queue, "127.0.0.1", port, "", "", STREAM, polling_ms=50)
+    sender.start()
+    produced = produce(scans, queue.put)
+    while sender.stats.scans < scans:
+        sleep(0.001)
+    sender.stop()
+
+    if consumer is not None:
+        consumer.join(5)
+        redis.delete(STREAM)
+        redis.close()
+    if server is not None:
+        arrivals = { fields["code"]: arrival for (_, fields, arrival) in server.entries(STREAM) }
+    return summary(produced, arrivals)
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--host", default="127.0.0.1")
+    args_parser.add_argument("--port", type=int, default=6379)
+    args_parser.add_argument("--scans", type=int, default=300)
+    args_parser.add_argument("--rtt-ms", type=float, default=1.0)
+    args = args_parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if hasattr(socket, "AF_UNIX"):
+        print(f"{'publisher (unix)':>26} | {run_publisher(args.scans, SOCKET_PATH)}")
+    print(f"{'publisher (tcp)':>26} | {run_publisher(args.scans)}")
+
+    server = None
+    try:
+        Redis(host=args.host, port=args.port).ping()
+        upstream = (args.host, args.port)
+    except RedisConnectionError:
+        server = RespServer().start()
+        upstream = ("127.0.0.1", server.port)
+
+    # The consumer reaches Redis through the same (simulated) network as the relay
+    proxy = DelayProxy(*upstream, args.rtt_ms / 2000.0)
+    if server is None:
+        label = f"redis, {args.rtt_ms:g}ms RTT"
+        result = run_redis(args.scans, proxy.port, consumer_port=proxy.port)
+    else:
+        label = f"redis (to server), {args.rtt_ms:g}ms RTT"
+        result = run_redis(args.scans, proxy.port, server=server)
+        server.stop()
+    proxy.close()
+    print(f"{label:>26} | {result}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Reader hot path benchmark (event read + key decoding + scan assembly),
+on synthetic devices emulating keyboard-like scanners (MSC_SCAN, key down/up, shift and
+SYN_REPORT events for every character).
+
+For 1, 10 and 100 devices reports:
+ - throughput: keystrokes/s and scans/s draining a backlog of scans on every device
+ - latency: per-scan latency (scan injected -> scan enqueued) with scans paced over time
+
+Usage: python benchmarks/reader_benchmark.py [--devices 1 10 100] [--scans 200]
+                                             [--readers polling selector]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+from time import perf_counter, perf_counter_ns, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from config import DeviceConfig
+from readers.evdev_multidevice_reader import EvdevMultiDeviceReader
+from readers.evdev_selector_multidevice_reader import EvdevSelectorMultiDeviceReader
+from readers.synthetic_device import SyntheticDeviceBackend, key_events, random_code
+#pylint: enable=wrong-import-position
+
+READERS = {
+    'polling': EvdevMultiDeviceReader,
+    'selector': EvdevSelectorMultiDeviceReader,
+}
+VENDOR_ID = 0x1234
+
+class RecordingQueue:
+    """Queue stand-in, records when every scan is enqueued"""
+
+    def __init__(self):
+        self.enqueued = {}
+
+    def put(self, item, _block=True, _timeout=None):
+        """Record the enqueue time of the scan"""
+        self.enqueued[item[1]] = perf_counter_ns()
+
+    def __len__(self):
+        return len(self.enqueued)
+
+def setup(reader_type: str, devices: int):
+    backend = SyntheticDeviceBackend()
+    configs = []
+    for i in range(devices):
+        backend.attach(f"/dev/input/synthetic{i}", VENDOR_ID, i)
+        configs.append(DeviceConfig(id=f"device{i:03d}", vid=VENDOR_ID, pid=i))
+
+    queue = RecordingQueue()
+    reader = READERS[reader_type](configs, queue, discovery=backend, device_factory=backend.open)
+    return backend, queue, reader
+
+def wait_for(queue: RecordingQueue, count: int, timeout: float = 60.0):
+    deadline = perf_counter() + timeout
+    while len(queue) < count and perf_counter() < deadline:
+        sleep(0.0005)
+
+def throughput(reader_type: str, devices: int, scans: int):
+    """Drain a backlog of scans from every device"""
+    rng = random.Random(1)
+    backend, queue, reader = setup(reader_type, devices)
+
+    keystrokes = 0
+    for index, device in enumerate(backend.devices):
+        events = []
+        for seq in range(scans):
+            code = f"{index:03d}{seq:06d}" + random_code(rng, 8)
+            keystrokes += len(code)
+            events.extend(key_events(code))
+        device.inject(events)
+
+    start = perf_counter()
+    reader.start()
+    wait_for(queue, devices * scans)
+    elapsed = perf_counter() - start
+    reader.stop()
+    backend.stop()
+
+    return keystrokes / elapsed, len(queue) / elapsed
+
+def latency(reader_type: str, devices: int, scans: int, interval_s: float = 0.002):
+    """Inject scans on random devices, one every interval_s, and measure their latency"""
+    rng = random.Random(2)
+    backend, queue, reader = setup(reader_type, devices)
+    reader.start()
+    sleep(0.1)
+
+    injected = {}
+    for seq in range(scans):
+        device = rng.choice(backend.devices)
+        code = f"{seq:06d}" + random_code(rng, 8)
+        events = key_events(code)
+        injected[code] = perf_counter_ns()
+        device.inject(events)
+        sleep(interval_s)
+
+    wait_for(queue, scans)
+    reader.stop()
+    backend.stop()
+
+    latencies = sorted(
+        (queue.enqueued[code] - start) / 1e6 for code, start in injected.items()
+        if code in queue.enqueued
+    )
+    if not latencies:
+        return (0.0, 0.0, 0.0)
+    return (
+        latencies[len(latencies) // 2],
+        latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        latencies[-1],
+    )
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--devices", type=int, nargs="+", default=[1, 10, 100])
+    args_parser.add_argument("--scans", type=int, default=200)
+    args_parser.add_argument("--readers", nargs="+", default=list(READERS), choices=list(READERS))
+    args = args_parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{'reader':<10} {'devices':>7} | {'keystrokes/s':>12} {'scans/s':>9} | "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for reader_type in args.readers:
+        for devices in args.devices:
+            (keystrokes_s, scans_s) = throughput(reader_type, devices, args.scans)
+            (p50, p99, worst) = latency(reader_type, devices, args.scans)
+            print(f"{reader_type:<10} {devices:>7} | {keystrokes_s:>12.0f} {scans_s:>9.0f} | "
+                  f"{p50:>8.2f} {p99:>8.2f} {worst:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Throughput of RedisStreamSender against a local redis-server, for different batch
+sizes and simulated network round trip times (RTT).
+The RTT is simulated by a local TCP proxy delaying every chunk by RTT/2 per direction.
+
+Usage: python benchmarks/redis_sender_benchmark.py [--host 127.0.0.1] [--port 6379] [--scans 500]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from queue import Queue
+from threading import Thread
+from time import monotonic, perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from redis import Redis
+from scan import Scan
+from senders.redis_stream_sender import RedisStreamSender
+#pylint: enable=wrong-import-position
+
+STREAM = "barcode-relay-benchmark"
+RTTS_MS = [0, 1, 5, 20]
+BATCH_SIZES = [1, 10, 100]
+
+class DelayProxy:
+    """TCP proxy adding a fixed delay to every chunk, in both directions"""
+
+    def __init__(self, upstream_host: str, upstream_port: int, delay_s: float):
+        self._upstream = (upstream_host, upstream_port)
+        self._delay_s = delay_s
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self.port = None
+        Thread(target=self._loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, client_reader, client_writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection(*self._upstream)
+        await asyncio.gather(
+            self._pipe(client_reader, upstream_writer),
+            self._pipe(upstream_reader, client_writer),
+            return_exceptions=True
+        )
+
+    async def _pipe(self, reader, writer):
+        chunks = asyncio.Queue()
+
+        async def forward():
+            while True:
+                due, data = await chunks.get()
+                if data is None:
+                    writer.close()
+                    return
+                await asyncio.sleep(max(0.0, due - monotonic()))
+                writer.write(data)
+
+        task = asyncio.ensure_future(forward())
+        while True:
+            data = await reader.read(65536)
+            await chunks.put((monotonic() + self._delay_s, data or None))
+            if not data:
+                break
+        await task
+
+    def close(self):
+        """Stop the proxy"""
+        self._loop.call_soon_threadsafe(self._server.close)
+
+def run(host: str, port: int, scans: int, batch_size: int) -> float:
+    """Push the scans through a RedisStreamSender and return the scans/s"""
+    queue = Queue()
+    for i in range(scans):
+        queue.put(Scan("bench", f"CODE{i:08d}\n", 0))
+
+    sender = RedisStreamSender("bench", queue, host, port, "", "", STREAM,
+                               polling_ms=50, batch_size=batch_size, batch_linger_ms=0)
+    start = perf_counter()
+    sender.start()
+    while sender.stats.scans < scans:
+        sleep(0.001)
+    elapsed = perf_counter() - start
+    sender.stop()
+
+    return scans / elapsed
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--host", default="127.0.0.1")
+    args_parser.add_argument("--port", type=int, default=6379)
+    args_parser.add_argument("--scans", type=int, default=500)
+    args = args_parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    redis = Redis(host=args.host, port=args.port)
+    redis.ping()
+
+    print(f"{'RTT':>6} | " + " | ".join(f"batch {size:>4}" for size in BATCH_SIZES))
+    for rtt_ms in RTTS_MS:
+        proxy = DelayProxy(args.host, args.port, rtt_ms / 2000.0)
+        results = [run("127.0.0.1", proxy.port, args.scans, size) for size in BATCH_SIZES]
+        proxy.close()
+        print(f"{rtt_ms:>4}ms | " + " | ".join(f"{result:>7.0f}/s" for result in results))
+
+    redis.delete(STREAM)
+    redis.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tiny in-process Redis stand-in (RESP2/RESP3), supporting the commands used by the relay
+(XADD, PUBLISH, PING and the connection handshake), with fault injection:
+ - latency: added once per round trip (a pipeline pays it once, as on a real network)
+ - errors: reply with an error to a given command
+ - outages: drop every connection and refuse new ones until the outage ends
+"""
+
+import socket
+import socketserver
+from threading import Lock, Thread
+from time import perf_counter, sleep, time
+from typing import Optional
+
+class RespServer:
+    """In-process RESP server, see module docstring"""
+    latency_s: float
+
+    # Stream name -> list of (id, fields, arrival perf_counter)
+    streams: dict[str, list]
+    # (channel, message) published so far
+    published: list[tuple[str, str]]
+    commands: dict[str, int]
+
+    _errors: dict[str, str]
+    _down: bool
+    _lock: Lock
+    _connections: set
+    _last_ms: int
+    _seq: int
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.streams = {}
+        self.published = []
+        self.commands = {}
+
+        self._errors = {}
+        self._down = False
+        self._lock = Lock()
+        self._connections = set()
+        self._last_ms = 0
+        self._seq = 0
+
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            """Serve a single client connection"""
+
+            def handle(self):
+                server._serve(self.request)
+
+        class Server(socketserver.ThreadingTCPServer):
+            """Threaded TCP server"""
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = Server((host, port), Handler)
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        """Port the server is listening on"""
+        return self._server.server_address[1]
+
+    def start(self):
+        """Start serving in background"""
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and drop every connection"""
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_error(self, command: str, message: Optional[str] = "ERR injected error"):
+        """Reply with an error to the given command (None to stop)"""
+        with self._lock:
+            if message is None:
+                self._errors.pop(command.upper(), None)
+            else:
+                self._errors[command.upper()] = message
+
+    def set_down(self, down: bool):
+        """Start (True) or end (False) an outage"""
+        self._down = down
+        if down:
+            self.drop_connections()
+
+    def drop_connections(self):
+        """Close every client connection"""
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def entries(self, stream: str) -> list:
+        """Entries added to the given stream"""
+        with self._lock:
+            return list(self.streams.get(stream, []))
+
+    def _serve(self, connection: socket.socket):
+        if self._down:
+            connection.close()
+            return
+
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._lock:
+            self._connections.add(connection)
+
+        buffer = b""
+        try:
+            while True:
+                data = connection.recv(65536)
+                if not data or self._down:
+                    break
+                buffer += data
+
+                (commands, buffer) = _parse_commands(buffer)
+                if not commands:
+                    continue
+
+                # Latency is paid once per round trip
+                if self.latency_s > 0:
+                    sleep(self.latency_s)
+
+                connection.sendall(b"".join(self._execute(args) for args in commands))
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._connections.discard(connection)
+            connection.close()
+
+    def _execute(self, args: list[bytes]) -> bytes:
+        command = args[0].decode().upper()
+        with self._lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+            error = self._errors.get(command)
+        if error is not None:
+            return f"-{error}\r\n".encode()
+
+        if command == "PING":
+            return b"+PONG\r\n"
+        if command == "HELLO":
+            protocol = int(args[1]) if len(args) > 1 else 2
+            if protocol == 3:
+                return b"%2\r\n+server\r\n+redis\r\n+proto\r\n:3\r\n"
+            return b"*4\r\n$6\r\nserver\r\n$5\r\nredis\r\n$5\r\nproto\r\n:2\r\n"
+        if command in ("AUTH", "SELECT", "CLIENT"):
+            return b"+OK\r\n"
+        if command == "PUBLISH":
+            with self._lock:
+                self.published.append((args[1].decode(), args[2].decode()))
+            return b":0\r\n"
+        if command == "XADD":
+            return self._xadd(args)
+
+        return f"-ERR unknown command '{command}'\r\n".encode()
+
+    def _xadd(self, args: list[bytes]) -> bytes:
+        stream = args[1].decode()
+        index = 2
+        # Skip NOMKSTREAM / MAXLEN options
+        while args[index].upper() in (b"NOMKSTREAM", b"MAXLEN", b"MINID"):
+            if args[index].upper() == b"NOMKSTREAM":
+                index += 1
+            else:
+                index += 3 if args[index + 1] in (b"=", b"~") else 2
+        index += 1
+
+        fields = {
+            args[i].decode(): args[i + 1].decode() for i in range(index, len(args) - 1, 2)
+        }
+
+        with self._lock:
+            now_ms = int(time() * 1000)
+            if now_ms <= self._last_ms:
+                self._seq += 1
+            else:
+                self._last_ms, self._seq = now_ms, 0
+            entry_id = f"{self._last_ms}-{self._seq}"
+            self.streams.setdefault(stream, []).append((entry_id, fields, perf_counter()))
+
+        return f"${len(entry_id)}\r\n{entry_id}\r\n".encode()
+
+def _parse_commands(buffer: bytes) -> tuple[list[list[bytes]], bytes]:
+    """Parse every complete command (array of bulk strings) in the buffer"""
+    commands = []
+    pos = 0
+    while True:
+        parsed = _parse_command(buffer, pos)
+        if parsed is None:
+            break
+        (args, pos) = parsed
+        commands.append(args)
+
+    return (commands, buffer[pos:])
+
+def _parse_command(buffer: bytes, pos: int):
+    end = buffer.find(b"\r\n", pos)
+    if end < 0:
+        return None
+    if buffer[pos:pos + 1] != b"*":
+        # Inline command
+        return (buffer[pos:end].split(), end + 2)
+
+    count = int(buffer[pos + 1:end])
+    pos = end + 2
+    args = []
+    for _ in range(count):
+        end = buffer.find(b"\r\n", pos)
+        if end < 0:
+            return None
+        length = int(buffer[pos + 1:end])
+        pos = end + 2
+        if len(buffer) < pos + length + 2:
+            return None
+        args.append(buffer[pos:pos + length])
+        pos += length + 2
+
+    return (args, pos)
@@ -0,0 +1,104 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Reader -> sender transport benchmark: a producer puts N (device, code, ts) scans and a
+consumer gets them, in two threads (queue.Queue, ShmRingQueue) and in two processes
+(multiprocessing.Queue, ShmRingQueue). Reports scans/s and the mean time per scan.
+
+Usage: python benchmarks/ring_buffer_benchmark.py [--scans 200000] [--slots 4096]
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+from threading import Thread
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from queues.shm_ring_buffer import ShmRingBuffer, ShmRingQueue
+from scan import Scan
+#pylint: enable=wrong-import-position
+
+DEVICES = [f"device{i:02d}" for i in range(16)]
+
+def produce(target, scans: int):
+    """Put the scans, 12 chars codes on 16 devices"""
+    for i in range(scans):
+        target.put(Scan(DEVICES[i % len(DEVICES)], f"CODE{i:08d}", 1700000000))
+
+def produce_ring(name: str, scans: int):
+    """Producer process attached to the ring buffer"""
+    target = ShmRingQueue(ShmRingBuffer(name=name), DEVICES)
+    produce(target, scans)
+    target.close()
+
+def consume(source, scans: int) -> float:
+    """Get all the scans, return the elapsed seconds from the first one"""
+    source.get()
+    start = perf_counter()
+    for _ in range(scans - 1):
+        source.get()
+    return perf_counter() - start
+
+def threads(source, scans: int) -> float:
+    producer = Thread(target=produce, args=(source, scans))
+    producer.start()
+    elapsed = consume(source, scans)
+    producer.join()
+    return elapsed
+
+def processes(source, target_args, target, scans: int) -> float:
+    producer = multiprocessing.get_context("spawn").Process(target=target, args=(*target_args, scans))
+    producer.start()
+    elapsed = consume(source, scans)
+    producer.join()
+    return elapsed
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--scans", type=int, default=200000)
+    args_parser.add_argument("--slots", type=int, default=4096)
+    args = args_parser.parse_args()
+
+    results = []
+
+    results.append(("queue.Queue (threads)", threads(queue.Queue(), args.scans)))
+
+    ring = ShmRingQueue(ShmRingBuffer(args.slots), DEVICES)
+    results.append(("ShmRingQueue (threads)", threads(ring, args.scans)))
+    ring.close()
+
+    mp_queue = multiprocessing.get_context("spawn").Queue()
+    results.append(("multiprocessing.Queue (processes)",
+                    processes(mp_queue, (mp_queue,), produce, args.scans)))
+
+    ring = ShmRingQueue(ShmRingBuffer(args.slots), DEVICES)
+    results.append(("ShmRingQueue (processes)",
+                    processes(ring, (ring.ring.name,), produce_ring, args.scans)))
+    ring.close()
+
+    print(f"{'transport':<34} | {'scans/s':>10} {'us/scan':>8}")
+    for (name, elapsed) in results:
+        print(f"{name:<34} | {args.scans / elapsed:>10.0f} {elapsed / args.scans * 1e6:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Microbenchmark of the per-keystroke cost of the scan assembly.
+Compares the previous approach (str buffer + re.match on the whole buffer after every
+keystroke) with ScanAssembler, fed one character at a time and in batches.
+
+Usage: python benchmarks/scan_assembler_benchmark.py
+"""
+
+from datetime import datetime
+import json
+import logging
+import os
+import re
+import sys
+from time import perf_counter_ns
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from config import DeviceConfig
+from readers.scan_assembler import ScanAssembler
+#pylint: enable=wrong-import-position
+
+SCANS = 2000
+
+class NullQueue:
+    """Queue stand-in, discards every item"""
+    def put(self, _item, _block=True, _timeout=None):
+        """Discard the item"""
+
+def legacy_assembly(config: DeviceConfig, chars: list[str], queue: NullQueue):
+    """Assembly loop used by the readers before ScanAssembler"""
+    logger = logging.getLogger()
+    buffer = ""
+    for char in chars:
+        buffer += char
+        if re.match(config.full_scan_regex, buffer):
+            ts = int(datetime.now().timestamp())
+            queue.put((config.id, buffer, ts))
+            logger.info(
+                "Read scan: %s", json.dumps({'code': buffer}),
+                extra={ 'component': f"READER:{config.id}" }
+            )
+            buffer = ""
+
+def bench(name: str, keystrokes: int, func):
+    start = perf_counter_ns()
+    func()
+    elapsed = perf_counter_ns() - start
+    print(f"  {name:<28} {elapsed / keystrokes:8.1f} ns/keystroke")
+
+def main():
+    queue = NullQueue()
+
+    for regex in [".*?\n", "[A-Z0-9]{10,}\n"]:
+        config = DeviceConfig(id="bench", full_scan_regex=regex)
+
+        for length in [13, 48, 128]:
+            code = ("0123456789ABCDEFGHIJ" * 7)[:length - 1] + "\n"
+            chars = list(code) * SCANS
+            keystrokes = len(chars)
+            print(f"full_scan_regex={regex!r}, code length {length}")
+
+            bench("legacy (re.match on str)", keystrokes,
+                  lambda: legacy_assembly(config, chars, queue))
+
+            assembler = ScanAssembler(config, queue)
+            def per_char():
+                for char in chars:
+                    assembler.feed(char)
+            bench("ScanAssembler, per char", keystrokes, per_char)
+
+            assembler = ScanAssembler(config, queue)
+            bench("ScanAssembler, batch", keystrokes, lambda: assembler.feed(chars))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Load test of RedisStreamSender against the in-process Redis stand-in (resp_server.py).
+Pushes N scans at a given rate and reports throughput, end-to-end latency percentiles
+(queue put -> XADD received), retries and the recovery time after an injected outage.
+
+Usage: python benchmarks/sender_load_test.py [--scans 5000] [--rate 1000] [--batch-size 10]
+           [--latency-ms 1] [--outage-after 1] [--outage-s 2] [--fault drop|error] [--workers 1]
+"""
+
+import argparse
+import logging
+import os
+import sys
+from queue import Queue
+from threading import Thread
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from resp_server import RespServer
+from senders.redis_stream_sender import RedisStreamSender, XADD_RETRIES
+from senders.retry_policy import CircuitBreaker
+from senders.sender_pool import SenderPool
+from scan import Scan
+#pylint: enable=wrong-import-position
+
+STREAM = "barcode-relay-load-test"
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def produce(queue: Queue, scans: int, rate: int, put_times: list[float]):
+    """Put the scans in the queue, at the given rate (0 = as fast as possible)"""
+    start = perf_counter()
+    for i in range(scans):
+        if rate > 0:
+            delay = start + i / rate - perf_counter()
+            if delay > 0:
+                sleep(delay)
+        put_times[i] = perf_counter()
+        queue.put(Scan(f"device{i % 16:02d}", f"CODE{i:08d}", 0))
+
+def inject_outage(server: RespServer, fault: str, after_s: float, duration_s: float, window: list):
+    """Make the server unavailable (or failing) for duration_s, after after_s"""
+    sleep(after_s)
+    window.append(perf_counter())
+    if fault == "drop":
+        server.set_down(True)
+    else:
+        server.set_error("XADD", "ERR injected error")
+    sleep(duration_s)
+    if fault == "drop":
+        server.set_down(False)
+    else:
+        server.set_error("XADD", None)
+    window.append(perf_counter())
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--scans", type=int, default=5000)
+    args_parser.add_argument("--rate", type=int, default=1000, help="scans/s, 0 = unbounded")
+    args_parser.add_argument("--batch-size", type=int, default=10)
+    args_parser.add_argument("--batch-linger-ms", type=int, default=0)
+    args_parser.add_argument("--latency-ms", type=float, default=1.0, help="per round trip")
+    args_parser.add_argument("--outage-after", type=float, default=1.0, help="seconds, <0 = none")
+    args_parser.add_argument("--outage-s", type=float, default=2.0)
+    args_parser.add_argument("--fault", default="drop", choices=["drop", "error"])
+    args_parser.add_argument("--workers", type=int, default=1)
+    args_parser.add_argument("--timeout", type=float, default=60.0)
+    args_parser.add_argument("--no-breaker", action="store_true",
+                             help="retry with backoff only, without the circuit breaker")
+    args = args_parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    server = RespServer(latency_s=args.latency_ms / 1000.0).start()
+    queue = Queue()
+    breaker = None if args.no_breaker else CircuitBreaker("load")
+
+    def create_sender(sender_queue: Queue) -> RedisStreamSender:
+        return RedisStreamSender("load", sender_queue, "127.0.0.1", server.port, "", "", STREAM,
+                                 polling_ms=50, batch_size=args.batch_size,
+                                 batch_linger_ms=args.batch_linger_ms, breaker=breaker)
+
+    if args.workers > 1:
+        sender = SenderPool(queue, args.workers, create_sender, polling_ms=50)
+    else:
+        sender = create_sender(queue)
+    retries = XADD_RETRIES.labels()
+    retries_before = retries.value
+
+    put_times = [0.0] * args.scans
+    window = []
+    threads = [Thread(target=produce, args=(queue, args.scans, args.rate, put_times), daemon=True)]
+    if args.outage_after >= 0:
+        threads.append(Thread(
+            target=inject_outage,
+            args=(server, args.fault, args.outage_after, args.outage_s, window),
+            daemon=True
+        ))
+
+    start = perf_counter()
+    sender.start()
+    for thread in threads:
+        thread.start()
+
+    while len(server.entries(STREAM)) < args.scans and perf_counter() - start < args.timeout:
+        sleep(0.01)
+    elapsed = perf_counter() - start
+    sender.stop()
+    server.stop()
+
+    entries = server.entries(STREAM)
+    latencies = sorted(
+        arrival - put_times[int(fields["code"][4:])] for (_, fields, arrival) in entries
+    )
+    codes = {fields["code"] for (_, fields, _) in entries}
+
+    # Codes of every device must arrive in order (a retried batch may be received twice)
+    last = {}
+    seen = set()
+    out_of_order = 0
+    for (_, fields, _) in entries:
+        seq = int(fields["code"][4:])
+        if seq in seen:
+            continue
+        seen.add(seq)
+        if seq < last.get(fields["device"], -1):
+            out_of_order += 1
+        last[fields["device"]] = max(seq, last.get(fields["device"], -1))
+
+    print(f"scans      : {len(codes)}/{args.scans} received, {len(entries) - len(codes)} duplicates")
+    print(f"order      : {out_of_order} scans out of order (per device)")
+    print(f"throughput : {len(entries) / elapsed:.0f} scans/s over {elapsed:.2f}s")
+    print("latency    : " + ", ".join(
+        f"p{label} {percentile(latencies, fraction) * 1000:.1f}ms"
+        for (label, fraction) in (("50", 0.5), ("99", 0.99), ("99.9", 0.999), ("100", 1.0))
+    ))
+    print(f"retries    : {retries.value - retries_before:.0f}")
+    if len(window) == 2:
+        after = [arrival for (_, _, arrival) in entries if arrival >= window[1]]
+        recovery = f"{(min(after) - window[1]) * 1000:.0f}ms" if after else "not recovered"
+        print(f"outage     : {args.fault} for {window[1] - window[0]:.2f}s, recovery {recovery}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Throughput of the persistent spool: append (readers side), consume + acknowledge
+(sender side) and replay of the unacknowledged scans after a restart.
+
+Usage: python benchmarks/spool_benchmark.py [--scans 200000] [--path /tmp/spool-benchmark]
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from queues.segment_spool import SegmentSpool
+from queues.spool_queue import SpoolQueue
+from scan import Scan
+#pylint: enable=wrong-import-position
+
+def report(name: str, count: int, elapsed: float):
+    print(f"  {name:<24} {count / elapsed:>10.0f} scans/s  ({elapsed * 1e6 / count:.2f} us/scan)")
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--scans", type=int, default=200000)
+    args_parser.add_argument("--path", default=None)
+    args = args_parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    path = args.path or tempfile.mkdtemp(prefix="spool-benchmark-")
+    scans = [Scan("device01", f"CODE{i:012d}\n", 1700000000 + i) for i in range(args.scans)]
+
+    for fsync_interval_ms in [10, 100, 1000]:
+        shutil.rmtree(path, ignore_errors=True)
+        print(f"fsync_interval_ms={fsync_interval_ms}")
+
+        queue = SpoolQueue(SegmentSpool(path, fsync_interval_ms=fsync_interval_ms))
+        start = perf_counter()
+        for scan in scans:
+            queue.put(scan)
+        report("append", len(scans), perf_counter() - start)
+
+        # Consume and acknowledge half of the scans, then "restart"
+        half = len(scans) // 2
+        start = perf_counter()
+        for _ in range(half):
+            queue.get()
+            queue.task_done()
+        report("consume + ack", half, perf_counter() - start)
+        queue.close()
+
+        start = perf_counter()
+        queue = SpoolQueue(SegmentSpool(path, fsync_interval_ms=fsync_interval_ms))
+        pending = queue.qsize()
+        for _ in range(pending):
+            queue.get()
+            queue.task_done()
+        report("replay (open + consume)", pending, perf_counter() - start)
+        queue.close()
+
+    shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Single process asyncio runtime: device readers, sender and hearthbeat all run
+in the same event loop, with an asyncio.Queue between readers and sender.
+Alternative to the default threaded runtime (Linux only).
+"""
+
+import asyncio
+import signal
+from logging import getLogger
+
+from config import AppConfig
+from metrics.registry import REGISTRY
+from hearthbeat.async_hearthbeat import AsyncHearthbeat
+from hearthbeat.health import RelayHealth
+from readers.async_evdev_multidevice_reader import AsyncEvdevMultiDeviceReader
+from senders.async_sender import AsyncSender
+from senders.retry_policy import CircuitBreaker, RetryPolicy
+
+async def _run(config: AppConfig):
+    logger = getLogger()
+    loop = asyncio.get_running_loop()
+
+    # Stop on SIGINT / SIGTERM
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    if config.spool is not None:
+        logger.warning("Persistent spool is not supported by the asyncio runtime, ignored")
+    if config.queue.capacity > 0:
+        logger.warning("Queue capacity is not supported by the asyncio runtime, ignored")
+    if config.reader.processes > 1:
+        logger.warning("Reader processes are not supported by the asyncio runtime, ignored")
+    if config.target.workers > 1:
+        logger.warning("Sender workers are not supported by the asyncio runtime, ignored")
+    if config.publisher is not None:
+        logger.warning("The local publisher is not supported by the asyncio runtime, ignored")
+    if len(config.targets) > 1:
+        logger.warning(
+            "Multiple targets are not supported by the asyncio runtime, sending to %s only",
+            config.target.id)
+
+    queue = asyncio.Queue()
+    breaker = CircuitBreaker(
+        config.target.id,
+        config.target.retry.failure_threshold,
+        config.target.retry.probe_interval_ms,
+    )
+    REGISTRY.gauge(
+        "barcode_relay_queue_depth", "Scans waiting to be sent").set_function(queue.qsize)
+
+    if config.target.type == 'redis_stream':
+        #pylint: disable=import-outside-toplevel
+        from senders.async_redis_stream_sender import AsyncRedisStreamSender
+        #pylint: enable=import-outside-toplevel
+        sender = AsyncRedisStreamSender(
+            config.id,
+            queue,
+            config.target.host,
+            config.target.port,
+            config.target.username,
+            config.target.password,
+            config.target.stream,
+            batch_size=config.target.batch_size,
+            batch_linger_ms=config.target.batch_linger_ms,
+            retry_policy=RetryPolicy(
+                config.target.retry.initial_ms,
+                config.target.retry.max_ms,
+                config.target.retry.multiplier,
+                config.target.retry.jitter,
+                config.target.retry.max_attempts,
+                config.target.retry.deadline_ms,
+            ),
+            breaker=breaker,
+            trace=config.target.trace,
+        )
+    elif config.target.type == 'dummy':
+        sender = AsyncSender(
+            config.id,
+            queue,
+            batch_size=config.target.batch_size,
+            batch_linger_ms=config.target.batch_linger_ms,
+        )
+    else:
+        logger.error(
+            "Target type %s is not supported by the asyncio runtime, exiting", config.target.type)
+        return
+
+    discovery = None
+    if config.reader.hotplug:
+        #pylint: disable=import-outside-toplevel
+        from readers.evdev_device_discovery import EvdevDeviceDiscovery
+        #pylint: enable=import-outside-toplevel
+        discovery = EvdevDeviceDiscovery(config.reader.polling_ms)
+
+    device_reader = AsyncEvdevMultiDeviceReader(
+        config.devices, queue, config.reader.polling_ms, discovery,
+        raw_events=config.reader.raw_events,
+        event_mask=config.reader.event_mask)
+
+    # Relay state sent with every hearthbeat
+    health = RelayHealth(queue, len(config.devices), breaker)
+    health.reader = device_reader
+
+    hb: AsyncHearthbeat = None
+    if config.hearthbeat is not None:
+        if config.hearthbeat.type == 'redis_pubsub':
+            #pylint: disable=import-outside-toplevel
+            from hearthbeat.async_redis_pubsub_hearthbeat import AsyncRedisPubSubHearthbeat
+            #pylint: enable=import-outside-toplevel
+            hb = AsyncRedisPubSubHearthbeat(
+                config.id,
+                config.hearthbeat.host,
+                config.hearthbeat.port,
+                config.hearthbeat.username,
+                config.hearthbeat.password,
+                config.hearthbeat.channel,
+                config.hearthbeat.interval,
+                status=health.snapshot,
+            )
+
+    if hb is not None:
+        hb.start()
+    if discovery is not None:
+        discovery.start()
+    device_reader.start()
+    sender.start()
+
+    await stop.wait()
+
+    device_reader.stop()
+    if discovery is not None:
+        await asyncio.to_thread(discovery.stop)
+    await sender.stop(config.shutdown.timeout_ms / 1000.0)
+
+    if hb is not None:
+        await hb.stop()
+
+def run(config: AppConfig):
+    """Run the relay in the asyncio runtime, until SIGINT / SIGTERM"""
+    asyncio.run(_run(config))
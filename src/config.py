@@ -16,9 +16,9 @@
 #
 
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional
 import yaml
-from pydantic import BaseModel, ValidationError, Field
+from pydantic import BaseModel, ValidationError, Field, model_validator
 
 class HearthbeatConfig(BaseModel):
     """
@@ -43,18 +43,105 @@ class DeviceConfig(BaseModel):
     vid: Optional[int] = None
     pid: Optional[int] = None
     full_scan_regex: str = Field(".*?\n")
+    layout: str = Field("us", pattern="us|it")
+    dedup_window_ms: int = Field(0, ge=0)
+    dedup_capacity: int = Field(1024, ge=1)
+
+class ReaderConfig(BaseModel):
+    """
+    Device readers configuration
+    """
+
+    type: str = Field("polling", pattern="polling|selector")
+    polling_ms: int = Field(500, ge=1)
+    hotplug: bool = Field(True)
+    raw_events: bool = Field(True)
+    event_mask: bool = Field(True)
+    processes: int = Field(1, ge=1)
+
+class RetryConfig(BaseModel):
+    """
+    Target retry policy and circuit breaker configuration
+    """
+
+    initial_ms: int = Field(100, ge=1)
+    max_ms: int = Field(5000, ge=1)
+    multiplier: float = Field(2.0, ge=1.0)
+    jitter: float = Field(0.2, ge=0.0, le=1.0)
+    max_attempts: int = Field(0, ge=0)
+    deadline_ms: int = Field(0, ge=0)
+    failure_threshold: int = Field(3, ge=1)
+    probe_interval_ms: int = Field(500, ge=1)
+
+class QueueConfig(BaseModel):
+    """
+    Queue (between readers and sender) configuration
+    """
+
+    capacity: int = Field(0, ge=0)
+    overflow: str = Field("block", pattern="block|drop_oldest|drop_newest|spill")
+    spill_path: str = Field("spill")
 
 class TargetConfig(BaseModel):
     """
     Generic - Output target configuration
     """
 
-    type: str = Field("dummy", pattern="redis_stream|dummy")
+    id: Optional[str] = None
+    type: str = Field("dummy", pattern="redis_stream|http|dummy")
     host: str = Field("127.0.0.1")
     port: int = Field(6379, ge=1, le=65535)
     username: str = Field("")
     password: str = Field("")
     stream: str = Field("")
+    url: str = Field("")
+    headers: Dict[str, str] = Field({})
+    body_format: str = Field("ndjson", pattern="ndjson|json")
+    max_body_bytes: int = Field(1024 * 1024, ge=1)
+    gzip_min_bytes: int = Field(0, ge=0)
+    timeout_ms: int = Field(5000, ge=1)
+    retry_statuses: List[int] = Field([408, 425, 429, 500, 502, 503, 504])
+    batch_size: int = Field(1, ge=1)
+    batch_linger_ms: int = Field(0, ge=0)
+    workers: int = Field(1, ge=1)
+    trace: bool = Field(False)
+    retry: Optional[RetryConfig] = RetryConfig()
+    queue: Optional[QueueConfig] = None
+
+class SpoolConfig(BaseModel):
+    """
+    Persistent spool (between readers and sender) configuration
+    """
+
+    path: str = Field("spool")
+    segment_size: int = Field(4 * 1024 * 1024, ge=1024)
+    fsync_interval_ms: int = Field(100, ge=1)
+
+class ShutdownConfig(BaseModel):
+    """
+    Graceful shutdown configuration
+    """
+
+    timeout_ms: int = Field(5000, ge=0)
+    spool_path: str = Field("shutdown")
+
+class PublisherConfig(BaseModel):
+    """
+    Local scan publisher (Unix domain socket or TCP) configuration
+    """
+
+    path: Optional[str] = None
+    host: str = Field("127.0.0.1")
+    port: int = Field(9500, ge=0, le=65535)
+    buffer: int = Field(1024, ge=1)
+
+class MetricsConfig(BaseModel):
+    """
+    Metrics HTTP endpoint (Prometheus text format) configuration
+    """
+
+    host: str = Field("127.0.0.1")
+    port: int = Field(9464, ge=1, le=65535)
 
 class SyslogConfig(BaseModel):
     """
@@ -74,16 +161,59 @@ class LoggingConfig(BaseModel):
     filepath: str = Field(None)
     syslog: Optional[SyslogConfig] = None
 
+class RedisConfig(BaseModel):
+    """
+    Redis connections configuration (shared by target and hearthbeat)
+    """
+
+    socket_timeout_ms: int = Field(5000, ge=1)
+    connect_timeout_ms: int = Field(5000, ge=1)
+    keepalive: bool = Field(True)
+    health_check_interval_ms: int = Field(30000, ge=0)
+    prewarm: bool = Field(True)
+
 class AppConfig(BaseModel):
     """
     App configuration
     """
 
     id: str = Field("barcode-relay")
+    runtime: str = Field("threads", pattern="threads|asyncio")
     devices: List[DeviceConfig]
-    target: TargetConfig
+    reader: Optional[ReaderConfig] = ReaderConfig()
+    target: Optional[TargetConfig] = None
+    targets: Optional[List[TargetConfig]] = None
     logging: Optional[LoggingConfig] = LoggingConfig()
     hearthbeat: Optional[HearthbeatConfig] = None
+    queue: Optional[QueueConfig] = QueueConfig()
+    spool: Optional[SpoolConfig] = None
+    metrics: Optional[MetricsConfig] = None
+    publisher: Optional[PublisherConfig] = None
+    redis: Optional[RedisConfig] = RedisConfig()
+    shutdown: Optional[ShutdownConfig] = ShutdownConfig()
+
+    @model_validator(mode='after')
+    def check_targets(self):
+        """Either target or targets must be set, target is the first of targets"""
+        if self.targets is None:
+            if self.target is None:
+                raise ValueError("target or targets must be set")
+            self.targets = [self.target]
+        elif self.target is not None:
+            raise ValueError("target and targets can't be both set")
+        elif len(self.targets) == 0:
+            raise ValueError("targets can't be empty")
+        else:
+            self.target = self.targets[0]
+
+        # Target id defaults to its type, ids name the metrics and the per target paths
+        for target in self.targets:
+            if target.id is None:
+                target.id = target.type
+        ids = [target.id for target in self.targets]
+        if len(set(ids)) != len(ids):
+            raise ValueError("target ids must be unique (set the id of targets of the same type)")
+        return self
 
 def load_configuration(filepath: str):
     """Load working configuration from specified file"""
@@ -0,0 +1,198 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from logging import Logger, getLogger
+from threading import Event, Lock, Thread
+from typing import Optional
+from redis import ConnectionPool, Redis
+
+from metrics.registry import REGISTRY
+
+HEALTH_CHECK_FAILURES = REGISTRY.counter(
+    "barcode_relay_redis_health_check_failures_total",
+    "Failed health checks of the idle Redis connections")
+
+# Pool key: host, port, username, password
+PoolKey = tuple[str, int, str, str]
+
+class RedisConnectionManager:
+    """
+    Owns the Redis connection pools, one for each endpoint and credentials, shared by every
+    sender and hearthbeat pointing there. Connections are created with socket timeouts and
+    TCP keepalive, can be opened in advance (prewarm) and are health checked while idle,
+    so that the first command after a quiet period doesn't pay for a reconnect.
+    """
+    _logger: Logger
+    _lock: Lock
+    _pools: dict[PoolKey, ConnectionPool]
+
+    # Clients created for each pool, connections opened by prewarm
+    _users: dict[PoolKey, int]
+
+    _socket_timeout_ms: int
+    _connect_timeout_ms: int
+    _keepalive: bool
+    _health_check_interval_ms: int
+
+    _stop: Event
+    _thread: Optional[Thread]
+
+    def __init__(
+        self,
+        socket_timeout_ms: int = 5000,
+        connect_timeout_ms: int = 5000,
+        keepalive: bool = True,
+        health_check_interval_ms: int = 30000
+    ):
+        self._logger = getLogger()
+        self._lock = Lock()
+        self._pools = {}
+        self._users = {}
+
+        self._socket_timeout_ms = socket_timeout_ms
+        self._connect_timeout_ms = connect_timeout_ms
+        self._keepalive = keepalive
+        self._health_check_interval_ms = health_check_interval_ms
+
+        self._stop = Event()
+        self._thread = None
+
+    def client(self, host: str, port: int, username: str = "", password: str = "") -> Redis:
+        """Return a client using the shared pool of the endpoint and credentials"""
+        key = (host, port, username, password)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    host=host,
+                    port=port,
+                    username=username or None,
+                    password=password or None,
+                    decode_responses=True,
+                    socket_timeout=self._socket_timeout_ms / 1000.0,
+                    socket_connect_timeout=self._connect_timeout_ms / 1000.0,
+                    socket_keepalive=self._keepalive,
+                    # Connections idle for longer are checked (PING) before being used,
+                    # the health check thread keeps them from getting there (0 = never)
+                    health_check_interval=(
+                        self._health_check_interval_ms / 1000.0
+                        if self._health_check_interval_ms else 0),
+                )
+                self._pools[key] = pool
+                self._users[key] = 0
+            self._users[key] += 1
+
+        return Redis(connection_pool=pool)
+
+    def prewarm(self):
+        """
+        Open (connect, authenticate) a connection for every client of each pool, errors are
+        only logged: the connections will be opened again on first use
+        """
+        with self._lock:
+            pools = [(key, pool, self._users[key]) for (key, pool) in self._pools.items()]
+
+        for ((host, port, _, _), pool, users) in pools:
+            connections = []
+            try:
+                for _ in range(users):
+                    connections.append(_get_connection(pool))
+                self._logger.info(
+                    "Opened %s connection(s) to %s:%s", len(connections), host, port,
+                    extra={ 'component': 'REDIS' }
+                )
+            except Exception as e:
+                self._logger.warning(
+                    "Unable to open connections to %s:%s: %s", host, port, e,
+                    extra={ 'component': 'REDIS' }
+                )
+            finally:
+                for connection in connections:
+                    pool.release(connection)
+
+    def start(self):
+        """Start health checking the idle connections"""
+        if self._health_check_interval_ms <= 0:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """
+        Health check (PING) a connection for every client of each pool (as prewarm opens
+        them), twice per interval: idle connections never go unchecked for a whole
+        interval, so the clients don't pay for the inline PING before their next command
+        """
+        while not self._stop.wait(self._health_check_interval_ms / 2000.0):
+            with self._lock:
+                pools = [(key, pool, self._users[key]) for (key, pool) in self._pools.items()]
+
+            for ((host, port, _, _), pool, users) in pools:
+                failures = self._check(pool, users)
+                if failures:
+                    HEALTH_CHECK_FAILURES.inc(failures)
+                    self._logger.warning(
+                        "Health check of %s:%s failed for %s connection(s)", host, port, failures,
+                        extra={ 'component': 'REDIS' }
+                    )
+
+    def _check(self, pool: ConnectionPool, users: int) -> int:
+        """PING users connections of the pool, returns the number of failed ones"""
+        connections = []
+        failures = 0
+        try:
+            for _ in range(users):
+                connection = _get_connection(pool)
+                connections.append(connection)
+                try:
+                    connection.send_command("PING")
+                    connection.read_response()
+                except Exception:
+                    # Reconnected on next use
+                    connection.disconnect()
+                    failures += 1
+        except Exception:
+            # Unable to connect at all
+            failures += 1
+        finally:
+            for connection in connections:
+                pool.release(connection)
+        return failures
+
+    def stop(self):
+        """Stop the health checks and close every connection"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+        with self._lock:
+            for pool in self._pools.values():
+                pool.disconnect()
+            self._pools = {}
+            self._users = {}
+
+def _get_connection(pool: ConnectionPool):
+    """Get a (connected) connection from the pool"""
+    try:
+        return pool.get_connection()
+    except TypeError:
+        # redis-py < 5.1 requires the command name
+        return pool.get_connection("PING")
+
+# Default manager, used by the senders and hearthbeats when no manager is given
+REDIS_CONNECTIONS = RedisConnectionManager()
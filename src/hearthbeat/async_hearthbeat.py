@@ -0,0 +1,75 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+from logging import Logger, getLogger
+from typing import Callable, Optional
+
+class AsyncHearthbeat:
+    """Generic hearthbeat (asyncio runtime), scheduled as a periodic task"""
+    _logger: Logger
+    _task: asyncio.Task
+
+    _relay_name: str
+    _hb_interval_ms: int
+
+    # Returns the fields describing the relay state, added to every hearthbeat
+    _status: Optional[Callable[[], dict]]
+
+    def __init__(
+        self,
+        relay_name: str,
+        hb_interval_ms: int = 10000,
+        status: Callable[[], dict] = None
+    ):
+        self._logger = getLogger()
+        self._task = None
+
+        self._relay_name = relay_name
+        self._hb_interval_ms = hb_interval_ms
+        self._status = status
+
+    def start(self):
+        """Start the working task (from the running event loop)"""
+        self._logger.info(
+            "Starting hearthbeat",
+            extra={ 'component': 'HEARTHBEAT' }
+        )
+        self._task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """Actual working coroutine"""
+        loop = asyncio.get_running_loop()
+        next_hb = loop.time()
+        while True:
+            # Schedule on absolute deadlines, so that sending time doesn't add drift
+            next_hb += self._hb_interval_ms / 1000.0
+            await asyncio.sleep(max(0.0, next_hb - loop.time()))
+            await self._send()
+
+    async def _send(self):
+        pass
+
+    async def stop(self):
+        """Stop the working task"""
+        self._logger.info(
+            "Stopping hearthbeat",
+            extra={ 'component': 'HEARTHBEAT' }
+        )
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -0,0 +1,104 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from time import monotonic, time
+from typing import Optional
+
+from senders.retry_policy import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from senders.sender import LAST_SEND, SENT_SCANS
+
+class RelayHealth:
+    """
+    Cheap snapshot of the relay state, added to every hearthbeat so that a relay
+    which is alive but stuck (devices gone, target down, queue growing) can be spotted:
+    queue depth, scans sent per second since the previous snapshot, age of the last
+    successful send, connected and configured devices, target circuit breaker state.
+    When the target pipelines are given the numbers come from them (see
+    TargetPipeline.status): with more than one target, the state of each target is
+    added as well, the relay wide numbers are the ones of the target most behind
+    (largest lag) and the worst breaker state.
+    """
+    _queue = None
+    _devices: int
+    _breaker: Optional[CircuitBreaker]
+    _targets: Optional[list]
+
+    # Multi device reader (set once started), exposing connected_devices()
+    reader = None
+
+    # Sent scans and time of the previous snapshot
+    _last_sent: float
+    _last_time: float
+
+    def __init__(
+        self,
+        queue,
+        devices: int,
+        breaker: CircuitBreaker = None,
+        targets: list = None
+    ) -> None:
+        self._queue = queue
+        self._devices = devices
+        self._breaker = breaker
+        self._targets = targets
+
+        self._last_sent = SENT_SCANS.labels().value
+        self._last_time = monotonic()
+
+    def snapshot(self) -> dict:
+        """Return the current state (and reset the scans/s window)"""
+        connected = self.reader.connected_devices() if self.reader is not None else None
+        if self._targets:
+            return self._targets_snapshot(connected)
+
+        now = monotonic()
+        sent = SENT_SCANS.labels().value
+        elapsed = now - self._last_time
+        rate = (sent - self._last_sent) / elapsed if elapsed > 0 else 0.0
+        self._last_sent = sent
+        self._last_time = now
+
+        last_send = LAST_SEND.labels().get()
+
+        data = {
+            'queue_depth': self._queue.qsize(),
+            'scans_per_s': round(rate, 2),
+            'last_send_age_s': round(time() - last_send, 3) if last_send else None,
+            'devices_connected': connected,
+            'devices_configured': self._devices,
+        }
+        if self._breaker is not None:
+            data['target_state'] = self._breaker.state
+        return data
+
+    def _targets_snapshot(self, connected: Optional[int]) -> dict:
+        statuses = { target.name: target.status() for target in self._targets }
+        behind = max(statuses.values(), key=lambda status: status['queue_depth'])
+        states = [status['state'] for status in statuses.values()]
+
+        data = {
+            'queue_depth': behind['queue_depth'],
+            'scans_per_s': behind['scans_per_s'],
+            'last_send_age_s': behind['last_send_age_s'],
+            'devices_connected': connected,
+            'devices_configured': self._devices,
+            'target_state': next(
+                (state for state in (OPEN, HALF_OPEN) if state in states), CLOSED),
+        }
+        if len(self._targets) > 1:
+            data['targets'] = statuses
+        return data
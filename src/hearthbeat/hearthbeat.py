@@ -15,28 +15,47 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-from threading import Thread
+from threading import Event, Thread
 from logging import Logger, getLogger
-from time import sleep, time
+from time import monotonic
+from typing import Callable, Optional
+
+from metrics.registry import REGISTRY
+
+HEARTHBEATS = REGISTRY.counter("barcode_relay_hearthbeats_total", "Hearthbeats sent")
+HEARTHBEAT_FAILURES = REGISTRY.counter(
+    "barcode_relay_hearthbeat_failures_total", "Hearthbeats that could not be sent")
 
 class Hearthbeat:
-    """Generic hearthbeat"""
+    """
+    Generic hearthbeat, sent every hb_interval_ms. The thread sleeps until the next
+    deadline (no polling) and wakes up right away when stopped.
+    """
     _logger: Logger
     _run: bool
     _thread: Thread
+    _stop_event: Event
 
     _relay_name: str
-    _polling_ms: int
     _hb_interval_ms: int
 
-    def __init__(self, relay_name: str, hb_interval_ms: int = 10000, polling_ms: int = 1000):
+    # Returns the fields describing the relay state, added to every hearthbeat
+    _status: Optional[Callable[[], dict]]
+
+    def __init__(
+        self,
+        relay_name: str,
+        hb_interval_ms: int = 10000,
+        status: Callable[[], dict] = None
+    ):
         self._logger = getLogger()
         self._run = False
         self._thread = None
+        self._stop_event = Event()
 
         self._relay_name = relay_name
-        self._polling_ms = polling_ms
         self._hb_interval_ms = hb_interval_ms
+        self._status = status
 
     def start(self):
         """Start the working thread"""
@@ -45,17 +64,21 @@ class Hearthbeat:
             extra={ 'component': 'HEARTHBEAT' }
         )
         self._run = True
+        self._stop_event.clear()
         self._thread = Thread(target=self.run)
         self._thread.start()
 
     def run(self):
         """Actual working function"""
-        last_hb = time()
-        while self._run:
-            if time() - last_hb >= (self._hb_interval_ms / 1000.0):
-                self._send()
-                last_hb = time()
-            sleep(self._polling_ms / 1000.0)
+        interval = self._hb_interval_ms / 1000.0
+        next_hb = monotonic() + interval
+        while not self._stop_event.wait(max(0.0, next_hb - monotonic())):
+            self._send()
+            # Schedule on absolute deadlines, so that sending time doesn't add drift
+            # (skip the missed ones if sending took longer than the interval)
+            next_hb += interval
+            if next_hb < monotonic():
+                next_hb = monotonic() + interval
 
     def _send(self):
         pass
@@ -67,5 +90,6 @@ class Hearthbeat:
             extra={ 'component': 'HEARTHBEAT' }
         )
         self._run = False
+        self._stop_event.set()
         if self._thread:
             self._thread.join()
@@ -17,8 +17,10 @@
 
 from datetime import datetime
 import json
+from typing import Callable
 from redis import Redis
-from .hearthbeat import Hearthbeat
+from connections.redis_connections import REDIS_CONNECTIONS, RedisConnectionManager
+from .hearthbeat import HEARTHBEAT_FAILURES, HEARTHBEATS, Hearthbeat
 
 class RedisPubSubHearthbeat(Hearthbeat):
     """Redis PubSub hearthbeat"""
@@ -34,26 +36,29 @@ class RedisPubSubHearthbeat(Hearthbeat):
         redis_password: str,
         redis_channel: str,
         hb_interval_ms: int = 10000,
-        polling_ms: int = 1000
+        connections: RedisConnectionManager = None,
+        status: Callable[[], dict] = None
     ):
-        super().__init__(relay_name, hb_interval_ms, polling_ms)
-        self._redis = Redis(
-            host=redis_host,
-            port=redis_port,
-            username=redis_username,
-            password=redis_password,
-            decode_responses=True
-        )
+        super().__init__(relay_name, hb_interval_ms, status)
+        # Connections are pooled by endpoint and credentials, shared with the other components
+        self._redis = (connections or REDIS_CONNECTIONS).client(
+            redis_host, redis_port, redis_username, redis_password)
         self._channel_name = redis_channel
 
     def _send(self):
         data = { 'relay': self._relay_name, 'ts': int(datetime.now().timestamp()) }
+        if self._status is not None:
+            data.update(self._status())
 
         try:
             self._redis.publish(self._channel_name, json.dumps(data))
+            HEARTHBEATS.inc()
         except Exception as e:
-            print(e)
-            pass
+            HEARTHBEAT_FAILURES.inc()
+            self._logger.warning(
+                "Error while sending hearthbeat: %s", e,
+                extra={ 'component': 'HEARTHBEAT' }
+            )
 
     def stop(self):
         super().stop()
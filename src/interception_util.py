@@ -68,3 +68,28 @@ def get_device_handle(regex: str):
             return i
 
     return -1
+
+# Longest single wait, so that a stopping reader notices it quickly
+STOP_CHECK_MS = 50
+WAIT_TIMEOUT = 0x102
+
+def wait_stroke(_interception: interception.interception, timeout_ms: int, running) -> int:
+    """
+    Wait up to timeout_ms for a device with pending strokes and return it (-1 if none),
+    in slices of STOP_CHECK_MS so that it returns as soon as running() is False
+    """
+    k32 = windll.LoadLibrary('kernel32')
+
+    remaining = timeout_ms
+    while running() and remaining > 0:
+        # Same as interception.wait, which can't tell device 0 apart from a timeout
+        result = k32.WaitForMultipleObjects(
+            interception.MAX_DEVICES, _interception._c_events, #pylint: disable=protected-access
+            0, min(STOP_CHECK_MS, remaining))
+        if result == WAIT_TIMEOUT:
+            remaining -= STOP_CHECK_MS
+            continue
+        if 0 <= result < interception.MAX_DEVICES:
+            return result
+        return -1
+    return -1
@@ -18,7 +18,8 @@
 import logging
 import logging.handlers
 import argparse
-from time import sleep
+from functools import partial
+from time import monotonic_ns
 from queue import Queue
 import sys
 import json
@@ -26,9 +27,17 @@ from datetime import datetime
 import os
 from syslog_rfc5424_formatter import RFC5424Formatter
 from _version import __version__
-from config import LoggingConfig, load_configuration
+from config import AppConfig, LoggingConfig, RetryConfig, TargetConfig, load_configuration
+from connections.redis_connections import RedisConnectionManager
+from hearthbeat.health import RelayHealth
 from hearthbeat.redis_pubsub_hearthbeat import RedisPubSubHearthbeat
+from metrics.http_exporter import MetricsHttpExporter
+from metrics.registry import REGISTRY
+from scan import Scan
+from senders.retry_policy import CircuitBreaker, RetryPolicy
 from senders.sender import Sender
+from senders.target_pipeline import TargetPipeline
+from shutdown import ShutdownCoordinator
 
 CONFIG_FILEPATH = "config/config.yml"
 LOG_FORMATTER = logging.Formatter(
@@ -87,6 +96,142 @@ def setup_logger(config: LoggingConfig):
 
     return logger
 
+def create_retry_policy(config: RetryConfig) -> RetryPolicy:
+    """Create the retry policy described by the configuration"""
+    return RetryPolicy(
+        config.initial_ms,
+        config.max_ms,
+        config.multiplier,
+        config.jitter,
+        config.max_attempts,
+        config.deadline_ms,
+    )
+
+def create_sender(
+    relay_id: str,
+    target: TargetConfig,
+    connections: RedisConnectionManager,
+    breaker: CircuitBreaker,
+    queue
+) -> Sender:
+    """Create the sender for the target, consuming the given queue"""
+    if target.type == 'redis_stream':
+        #pylint: disable=import-outside-toplevel
+        from senders.redis_stream_sender import RedisStreamSender
+        #pylint: enable=import-outside-toplevel
+        return RedisStreamSender(
+            relay_id,
+            queue,
+            target.host,
+            target.port,
+            target.username,
+            target.password,
+            target.stream,
+            batch_size=target.batch_size,
+            batch_linger_ms=target.batch_linger_ms,
+            connections=connections,
+            retry_policy=create_retry_policy(target.retry),
+            breaker=breaker,
+            trace=target.trace,
+        )
+
+    if target.type == 'http':
+        #pylint: disable=import-outside-toplevel
+        from senders.http_sender import HttpSender
+        #pylint: enable=import-outside-toplevel
+        return HttpSender(
+            relay_id,
+            queue,
+            target.url,
+            target.headers,
+            target.body_format,
+            batch_size=target.batch_size,
+            batch_linger_ms=target.batch_linger_ms,
+            max_body_bytes=target.max_body_bytes,
+            gzip_min_bytes=target.gzip_min_bytes,
+            timeout_ms=target.timeout_ms,
+            retry_statuses=tuple(target.retry_statuses),
+            retry_policy=create_retry_policy(target.retry),
+            breaker=breaker,
+            trace=target.trace,
+        )
+
+    return Sender(
+        relay_id,
+        queue,
+        batch_size=target.batch_size,
+        batch_linger_ms=target.batch_linger_ms,
+    )
+
+def target_path(path: str, target: TargetConfig, targets: int) -> str:
+    """Path of the target files: with more targets, each one gets a subdirectory named by id"""
+    return path if targets == 1 else os.path.join(path, target.id)
+
+def create_queue(config: AppConfig, target: TargetConfig):
+    """Create the queue between the readers and the target sender"""
+    logger = logging.getLogger()
+    targets = len(config.targets)
+    queue_config = target.queue if target.queue is not None else config.queue
+
+    if config.spool is not None:
+        #pylint: disable=import-outside-toplevel
+        from queues.segment_spool import SegmentSpool
+        from queues.spool_queue import SpoolQueue
+        #pylint: enable=import-outside-toplevel
+        queue = SpoolQueue(SegmentSpool(
+            target_path(config.spool.path, target, targets),
+            config.spool.segment_size,
+            config.spool.fsync_interval_ms,
+        ))
+        if queue.qsize() > 0:
+            logger.info(
+                "Replaying %s unacknowledged scans from the spool of target %s",
+                queue.qsize(), target.id)
+        if queue_config.capacity > 0:
+            logger.warning("Queue capacity is ignored when the persistent spool is enabled")
+    elif queue_config.capacity > 0:
+        #pylint: disable=import-outside-toplevel
+        from queues.bounded_queue import BoundedQueue, SPILL
+        from queues.segment_spool import SegmentSpool
+        #pylint: enable=import-outside-toplevel
+        spill = None
+        if queue_config.overflow == SPILL:
+            spill = SegmentSpool(target_path(queue_config.spill_path, target, targets))
+        queue = BoundedQueue(queue_config.capacity, queue_config.overflow, spill)
+    else:
+        queue = Queue()
+
+    return queue
+
+def create_pipeline(
+    config: AppConfig,
+    target: TargetConfig,
+    connections: RedisConnectionManager
+) -> TargetPipeline:
+    """Create queue, circuit breaker and sender (or sender pool) of the target"""
+    queue = create_queue(config, target)
+
+    # Shared by all the workers sending to the target
+    breaker = CircuitBreaker(
+        target.id,
+        target.retry.failure_threshold,
+        target.retry.probe_interval_ms,
+    )
+
+    if target.workers > 1:
+        #pylint: disable=import-outside-toplevel
+        from senders.sender_pool import SenderPool
+        #pylint: enable=import-outside-toplevel
+        sender = SenderPool(
+            queue, target.workers,
+            partial(create_sender, config.id, target, connections, breaker))
+    else:
+        sender = create_sender(config.id, target, connections, breaker, queue)
+
+    return TargetPipeline(
+        target.id, queue, sender, breaker,
+        target_path(config.shutdown.spool_path, target, len(config.targets)))
+
 def list_devices():
     """
     List attached USB keyboard devices
@@ -141,6 +286,75 @@ def main():
 
     logger = setup_logger(config.logging)
 
+    exporter = None
+    if config.metrics is not None and not args.test:
+        exporter = MetricsHttpExporter(config.metrics.host, config.metrics.port)
+        exporter.start()
+
+    if config.runtime == 'asyncio' and not args.test:
+        if os.name == 'nt':
+            logger.warning("The asyncio runtime is not supported on Windows, using threads")
+        else:
+            #pylint: disable=import-outside-toplevel
+            import async_runtime
+            #pylint: enable=import-outside-toplevel
+            async_runtime.run(config)
+            if exporter is not None:
+                exporter.stop()
+            sys.exit(0)
+
+    # Redis connections, pooled by endpoint and credentials and shared by target and hearthbeat
+    connections = RedisConnectionManager(
+        config.redis.socket_timeout_ms,
+        config.redis.connect_timeout_ms,
+        config.redis.keepalive,
+        config.redis.health_check_interval_ms,
+    )
+
+    for target in config.targets:
+        if target.type not in ('redis_stream', 'http', 'dummy'):
+            logger.error("Invalid target type %s, exiting", target.type)
+            sys.exit(-1)
+
+    # Every target has its own queue, sender and retry state: a slow target doesn't
+    # hold back the others, readers put each scan once in all the queues
+    targets = [create_pipeline(config, target, connections) for target in config.targets]
+
+    # Scans streamed to the local subscribers as soon as assembled, besides the targets
+    publisher = None
+    if config.publisher is not None and not args.test:
+        #pylint: disable=import-outside-toplevel
+        from publishers.local_publisher import LocalPublisher
+        #pylint: enable=import-outside-toplevel
+        publisher = LocalPublisher(
+            config.id,
+            config.publisher.path,
+            config.publisher.host,
+            config.publisher.port,
+            config.publisher.buffer,
+        )
+
+    if len(targets) == 1 and publisher is None:
+        queue = targets[0].queue
+    else:
+        #pylint: disable=import-outside-toplevel
+        from queues.broadcast_queue import BroadcastQueue
+        #pylint: enable=import-outside-toplevel
+        queue = BroadcastQueue(
+            [target.queue for target in targets],
+            [publisher] if publisher is not None else None)
+
+    REGISTRY.gauge(
+        "barcode_relay_queue_depth", "Scans waiting to be sent").set_function(queue.qsize)
+
+    # Scans saved by the previous shutdown come first
+    shutdown = ShutdownCoordinator(config.shutdown.timeout_ms)
+    for target in targets:
+        shutdown.replay(target.queue, target.shutdown_path)
+
+    # Relay state sent with every hearthbeat
+    health = RelayHealth(queue, len(config.devices), targets=targets)
+
     hb = None
     if config.hearthbeat is not None:
         if config.hearthbeat.type == 'redis_pubsub':
@@ -152,69 +366,93 @@ def main():
                 config.hearthbeat.password,
                 config.hearthbeat.channel,
                 config.hearthbeat.interval,
+                connections=connections,
+                status=health.snapshot,
             )
 
-    if hb is not None:
-        hb.start()
-
-    queue = Queue()
-
-    if config.target.type == 'redis_stream':
-        #pylint: disable=import-outside-toplevel
-        from senders.redis_stream_sender import RedisStreamSender
-        #pylint: enable=import-outside-toplevel
-        sender = RedisStreamSender(
-            config.id,
-            queue,
-            config.target.host,
-            config.target.port,
-            config.target.username,
-            config.target.password,
-            config.target.stream,
-        )
-    elif config.target.type == 'dummy':
-        sender = Sender(config.id, queue)
-    else:
-        logger.error("Invalid target type %s, exiting", config.target.type)
-        sys.exit(-1)
+    if config.redis.prewarm:
+        connections.prewarm()
+    connections.start()
 
     if args.test:
-        sender.start()
+        for target in targets:
+            target.sender.start()
         ts = int(datetime.now().timestamp())
-        queue.put((config.devices[0].id, args.test, ts))
+        now = monotonic_ns()
+        queue.put(Scan(config.devices[0].id, args.test, ts, decoded_ns=now, enqueued_ns=now))
         logger.info(
             "Simulate scan: %s", json.dumps({'code': args.test}),
             extra={ 'component': f"READER:{config.devices[0].id}" }
         )
-        sleep(1)
-        sender.stop()
+        # Wait for the scan to be sent (up to 1s)
+        for target in targets:
+            target.sender.stop(1.0)
+            if hasattr(target.queue, 'close'):
+                target.queue.close()
+        connections.stop()
         sys.exit(0)
 
+    discovery = None
+
     #pylint: disable=import-outside-toplevel
     if os.name == 'nt':
         from readers.interception_multidevice_reader import InterceptionMultiDeviceReader
         device_reader = InterceptionMultiDeviceReader(config.devices, queue)
+    elif config.reader.processes > 1:
+        from readers.sharded_multidevice_reader import ShardedMultiDeviceReader
+        device_reader = ShardedMultiDeviceReader(
+            config.devices, queue, config.reader, config.reader.processes,
+            partial(setup_logger, config.logging))
     else:
-        from readers.evdev_multidevice_reader import EvdevMultiDeviceReader
-        device_reader = EvdevMultiDeviceReader(config.devices, queue)
+        if config.reader.hotplug:
+            from readers.evdev_device_discovery import EvdevDeviceDiscovery
+            discovery = EvdevDeviceDiscovery(config.reader.polling_ms)
+
+        if config.reader.type == 'selector':
+            from readers.evdev_selector_multidevice_reader import EvdevSelectorMultiDeviceReader
+            device_reader = EvdevSelectorMultiDeviceReader(
+                config.devices, queue, config.reader.polling_ms, discovery,
+                raw_events=config.reader.raw_events,
+                event_mask=config.reader.event_mask)
+        else:
+            from readers.evdev_multidevice_reader import EvdevMultiDeviceReader
+            device_reader = EvdevMultiDeviceReader(
+                config.devices, queue, config.reader.polling_ms, discovery,
+                raw_events=config.reader.raw_events,
+                event_mask=config.reader.event_mask)
     #pylint: enable=import-outside-toplevel
 
+    health.reader = device_reader
+    if hb is not None:
+        hb.start()
+    if publisher is not None:
+        publisher.start()
+    if discovery is not None:
+        discovery.start()
     device_reader.start()
-    sender.start()
+    for target in targets:
+        target.sender.start()
 
-    # Run loop
-    run = True
-    while run:
-        try:
-            sleep(1)
-        except KeyboardInterrupt:
-            run = False
+    # Run until SIGTERM / SIGINT, then stop reading and drain the queue
+    shutdown.install()
+    shutdown.wait()
 
     device_reader.stop()
-    sender.stop()
+    if discovery is not None:
+        discovery.stop()
+    if publisher is not None:
+        publisher.stop()
+    shutdown.drain(targets)
+    for target in targets:
+        if hasattr(target.queue, 'close'):
+            target.queue.close()
 
     if hb is not None:
         hb.stop()
+    connections.stop()
+
+    if exporter is not None:
+        exporter.stop()
 
 
 if __name__ == "__main__":
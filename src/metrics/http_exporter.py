@@ -0,0 +1,88 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger, getLogger
+from threading import Thread
+
+from .registry import REGISTRY, MetricsRegistry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class MetricsHttpExporter:
+    """Expose a metrics registry over HTTP (GET /metrics), in Prometheus text format"""
+    _logger: Logger
+    _thread: Thread
+    _server: ThreadingHTTPServer
+
+    _registry: MetricsRegistry
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9464, registry: MetricsRegistry = REGISTRY):
+        self._logger = getLogger()
+        self._thread = None
+        self._registry = registry
+
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            """Serve the registry on /metrics"""
+
+            def do_GET(self):
+                """Handle GET requests"""
+                #pylint: disable=invalid-name
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = registry_.expose().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                #pylint: disable=redefined-builtin
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        """Port the exporter is listening on"""
+        return self._server.server_address[1]
+
+    def start(self):
+        """Start serving in the working thread"""
+        self._logger.info(
+            "Starting metrics endpoint on port %s", self.port,
+            extra={ 'component': 'METRICS' }
+        )
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving"""
+        self._logger.info(
+            "Stopping metrics endpoint",
+            extra={ 'component': 'METRICS' }
+        )
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,272 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Optional, Sequence
+
+# Default histogram buckets (seconds), from 100us to 10s
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0
+)
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class CounterValue:
+    """Single counter series. Lock-free: every series is meant to have a single writer."""
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        """Increment the counter"""
+        self.value += amount
+
+class GaugeValue:
+    """Single gauge series, either set explicitly or read from a function on collection"""
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value: float):
+        """Set the gauge value"""
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        """Increment the gauge value"""
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        """Decrement the gauge value"""
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the gauge value from the given function on every collection"""
+        self.function = function
+
+    def get(self) -> float:
+        """Current gauge value"""
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+class HistogramValue:
+    """
+    Single histogram series with fixed buckets. Lock-free: every series is meant to
+    have a single writer.
+    """
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # One more slot for +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Record a value"""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Metric:
+    """Metric family: name, help, type and one series for each set of label values"""
+    name: str
+    help: str
+    type: str
+    labelnames: tuple
+
+    _series: dict
+    _lock: Lock
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+        self._series = {}
+        self._lock = Lock()
+
+    def _init_series(self):
+        # Unlabelled metrics are exposed (as zero) even before the first record
+        if not self.labelnames:
+            self.labels()
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *labelvalues: str):
+        """
+        Return the series for the given label values (created on first use).
+        Keep a reference to the returned series to record on the hot path.
+        """
+        series = self._series.get(labelvalues)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(labelvalues, self._new_value())
+        return series
+
+    def collect(self) -> list[str]:
+        """Return the series lines, in Prometheus text format"""
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        """Return the metric family, in Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.collect())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing counter"""
+    type = "counter"
+
+    def _new_value(self):
+        return CounterValue()
+
+    def inc(self, amount: int = 1):
+        """Increment the (unlabelled) counter"""
+        self.labels().inc(amount)
+
+    def collect(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(series.value)}"
+            for labelvalues, series in list(self._series.items())
+        ]
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+    type = "gauge"
+
+    def _new_value(self):
+        return GaugeValue()
+
+    def set(self, value: float):
+        """Set the (unlabelled) gauge value"""
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the (unlabelled) gauge value from the given function on every collection"""
+        self.labels().set_function(function)
+
+    def collect(self) -> list[str]:
+        lines = []
+        for labelvalues, series in list(self._series.items()):
+            try:
+                value = series.get()
+            except Exception:
+                continue
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+            )
+        return lines
+
+class Histogram(Metric):
+    """Distribution of values, over fixed buckets"""
+    type = "histogram"
+    bounds: tuple
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_value(self):
+        return HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        """Record a value in the (unlabelled) histogram"""
+        self.labels().observe(value)
+
+    def collect(self) -> list[str]:
+        lines = []
+        for labelvalues, series in list(self._series.items()):
+            cumulative = 0
+            counts = list(series.counts)
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Collection of metrics, exposed together"""
+    _metrics: dict[str, Metric]
+    _lock: Lock
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} already registered as {existing.type}")
+                return existing
+            metric._init_series()
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Register (or return the already registered) counter"""
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Register (or return the already registered) gauge"""
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Register (or return the already registered) histogram"""
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        """Return the metric with the given name, if registered"""
+        return self._metrics.get(name)
+
+    def expose(self) -> str:
+        """Return all the metrics, in Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+# Default registry, used by all the components
+REGISTRY = MetricsRegistry()
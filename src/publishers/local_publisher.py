@@ -0,0 +1,310 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from collections import deque
+import json
+from logging import Logger, getLogger
+import os
+import selectors
+import socket
+import stat
+from threading import Lock, Thread
+from typing import Optional
+
+from metrics.registry import REGISTRY
+from scan import Scan
+
+PUBLISHER_SUBSCRIBERS = REGISTRY.gauge(
+    "barcode_relay_publisher_subscribers", "Clients connected to the local publisher")
+PUBLISHED_SCANS = REGISTRY.counter(
+    "barcode_relay_publisher_scans_total", "Scans published to the local subscribers")
+PUBLISHER_DROPS = REGISTRY.counter(
+    "barcode_relay_publisher_dropped_total",
+    "Records dropped because the buffer of a slow subscriber was full")
+
+class _Subscriber:
+    """A connected client, with the records not written to its socket yet"""
+    connection: socket.socket
+    # Encoded records, the first one may have been partially written (offset)
+    buffer: deque
+    offset: int
+    closed: bool
+
+    def __init__(self, connection: socket.socket) -> None:
+        self.connection = connection
+        self.buffer = deque()
+        self.offset = 0
+        self.closed = False
+
+class LocalPublisher:
+    """
+    Stream every scan to the clients connected to a local Unix domain socket (path)
+    or TCP port, as newline delimited JSON records, besides the normal target.
+    Meant for consumers on the same host, which get the scans without a round trip
+    through the target: publish() writes the record to the subscriber sockets right
+    away from the calling (reader) thread, without blocking. What a subscriber
+    can't take yet is kept in its buffer (up to buffer records, then the oldest are
+    dropped, so a slow client can't stall the readers) and written by the publisher
+    thread as soon as the socket is writable.
+    Delivery is best effort: scans published while a client is not connected are lost.
+    """
+    _logger: Logger
+    _run: bool
+    _thread: Thread
+
+    _relay_name: str
+    _path: Optional[str]
+    _server: socket.socket
+    _buffer: int
+
+    _selector: selectors.BaseSelector
+    # Socket pair used to wake up the selector (Windows can only select sockets)
+    _wakeup_r: socket.socket
+    _wakeup_w: socket.socket
+
+    _subscribers: list[_Subscriber]
+    _lock: Lock
+
+    def __init__(
+        self,
+        relay_name: str,
+        path: Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: int = 9500,
+        buffer: int = 1024
+    ) -> None:
+        self._logger = getLogger()
+        self._run = False
+        self._thread = None
+
+        self._relay_name = relay_name
+        self._path = path
+        self._buffer = buffer
+
+        if path is not None:
+            if not hasattr(socket, 'AF_UNIX'):
+                raise ValueError("Unix domain sockets are not supported on this platform")
+            # Left behind by a previous run that didn't stop cleanly, anything else
+            # at the path is not ours to remove
+            if os.path.exists(path):
+                if not stat.S_ISSOCK(os.stat(path).st_mode):
+                    raise ValueError(f"{path} exists and is not a socket")
+                os.unlink(path)
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(path)
+        else:
+            self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._server.bind((host, port))
+        self._server.listen()
+        self._server.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self._selector.register(self._server, selectors.EVENT_READ, self._server)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+        self._subscribers = []
+        self._lock = Lock()
+
+    @property
+    def address(self):
+        """Address the publisher is listening on (path or (host, port))"""
+        return self._server.getsockname()
+
+    @property
+    def subscribers(self) -> int:
+        """Number of connected clients"""
+        with self._lock:
+            return len(self._subscribers)
+
+    def start(self):
+        """Start accepting clients in the working thread"""
+        self._logger.info(
+            "Starting local publisher on %s", self._path or f"port {self.address[1]}",
+            extra={ 'component': 'PUBLISHER' }
+        )
+        self._run = True
+        self._thread = Thread(target=self.run)
+        self._thread.start()
+
+    def publish(self, scan: Scan):
+        """Write the scan to every subscriber (never blocks, see class docstring)"""
+        record = json.dumps({
+            'relay': self._relay_name, 'device': scan.device, 'code': scan.code, 'ts': scan.ts
+        }, separators=(',', ':')).encode() + b"\n"
+
+        wakeup = False
+        with self._lock:
+            for subscriber in self._subscribers:
+                if subscriber.closed:
+                    continue
+                if not subscriber.buffer:
+                    # Nothing queued before it, try to write it right away
+                    written = self._write(subscriber, record)
+                    if written == len(record) or subscriber.closed:
+                        continue
+                    subscriber.offset = written
+                    wakeup = True
+                elif len(subscriber.buffer) >= self._buffer:
+                    # Drop the oldest record, unless it's partially written already
+                    PUBLISHER_DROPS.inc()
+                    oldest = 1 if subscriber.offset else 0
+                    if oldest == len(subscriber.buffer):
+                        continue
+                    del subscriber.buffer[oldest]
+                subscriber.buffer.append(record)
+            PUBLISHED_SCANS.inc()
+
+        if wakeup:
+            self._wakeup()
+
+    def _write(self, subscriber: _Subscriber, data: bytes) -> int:
+        """Write without blocking, returns the bytes written (the subscriber is closed on error)"""
+        try:
+            return subscriber.connection.send(data)
+        except BlockingIOError:
+            return 0
+        except OSError:
+            subscriber.closed = True
+            self._wakeup()
+            return 0
+
+    def _flush(self, subscriber: _Subscriber):
+        """Write the buffered records, until done or the socket is full"""
+        while subscriber.buffer and not subscriber.closed:
+            record = subscriber.buffer[0]
+            written = self._write(subscriber, record[subscriber.offset:])
+            if written == 0:
+                return
+            subscriber.offset += written
+            if subscriber.offset < len(record):
+                return
+            subscriber.buffer.popleft()
+            subscriber.offset = 0
+
+    def _wakeup(self):
+        """Wake up the selector, if it is currently blocked"""
+        try:
+            self._wakeup_w.send(b"\0")
+        except OSError:
+            # The socket is full (the selector will wake up anyway) or already closed
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _accept(self):
+        try:
+            (connection, _) = self._server.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(False)
+        if connection.family != getattr(socket, 'AF_UNIX', None):
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        subscriber = _Subscriber(connection)
+        with self._lock:
+            self._subscribers.append(subscriber)
+            PUBLISHER_SUBSCRIBERS.set(len(self._subscribers))
+        self._selector.register(connection, selectors.EVENT_READ, subscriber)
+        self._logger.info(
+            "Subscriber connected (%s connected)", len(self._subscribers),
+            extra={ 'component': 'PUBLISHER' }
+        )
+
+    def _close(self, subscriber: _Subscriber):
+        with self._lock:
+            subscriber.closed = True
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+            PUBLISHER_SUBSCRIBERS.set(len(self._subscribers))
+        try:
+            self._selector.unregister(subscriber.connection)
+        except (KeyError, ValueError):
+            pass
+        subscriber.connection.close()
+
+    def _update(self):
+        """Close the subscribers gone away, watch the ones with buffered records for writing"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.closed:
+                self._close(subscriber)
+                self._logger.info(
+                    "Subscriber disconnected (%s connected)", len(self._subscribers),
+                    extra={ 'component': 'PUBLISHER' }
+                )
+                continue
+            events = selectors.EVENT_READ
+            if subscriber.buffer:
+                events |= selectors.EVENT_WRITE
+            if self._selector.get_key(subscriber.connection).events != events:
+                self._selector.modify(subscriber.connection, events, subscriber)
+
+    def run(self):
+        """Actual working function"""
+        while self._run:
+            for key, mask in self._selector.select():
+                if key.data is None:
+                    self._drain_wakeup()
+                elif key.data is self._server:
+                    self._accept()
+                else:
+                    subscriber = key.data
+                    if mask & selectors.EVENT_READ:
+                        # Subscribers aren't expected to send anything, just detect them leaving
+                        try:
+                            if not subscriber.connection.recv(4096):
+                                subscriber.closed = True
+                        except BlockingIOError:
+                            pass
+                        except OSError:
+                            subscriber.closed = True
+                    if mask & selectors.EVENT_WRITE:
+                        with self._lock:
+                            self._flush(subscriber)
+            self._update()
+
+    def stop(self):
+        """Disconnect every subscriber and stop listening"""
+        self._logger.info(
+            "Stopping local publisher",
+            extra={ 'component': 'PUBLISHER' }
+        )
+        self._run = False
+        self._wakeup()
+        if self._thread:
+            self._thread.join()
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            self._close(subscriber)
+        self._selector.close()
+        self._server.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        if self._path is not None and os.path.exists(self._path):
+            os.unlink(self._path)
@@ -0,0 +1,175 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from collections import deque
+from logging import Logger, getLogger
+from queue import Queue
+from time import monotonic
+from typing import Optional
+
+from metrics.registry import REGISTRY
+from .segment_spool import SegmentSpool
+
+QUEUE_OVERFLOWS = REGISTRY.counter(
+    "barcode_relay_queue_overflows_total", "Scans that found the queue full, by policy", ["policy"])
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+SPILL = "spill"
+
+class BoundedQueue(Queue):
+    """
+    Queue with a fixed capacity and an explicit policy for when it's full:
+     - block: the reader waits for a free slot
+     - drop_oldest: the oldest queued scan is discarded to make room
+     - drop_newest: the new scan is discarded
+     - spill: the scan is appended to a SegmentSpool on disk, scans are returned
+       in order (memory first, then the spool) and acknowledged on task_done()
+    Overflow events are counted and logged at most once every log_interval_s.
+    """
+    _logger: Logger
+    _policy: str
+    _spool: Optional[SegmentSpool]
+
+    # Number of scans currently in the spool
+    _spilled: int
+
+    # Spool position of the scans returned by get() (None for scans from memory)
+    _positions: deque
+
+    _overflows: int
+    _unlogged_overflows: int
+    _last_log: float
+    _log_interval_s: float
+
+    def __init__(
+        self,
+        maxsize: int,
+        policy: str = BLOCK,
+        spool: SegmentSpool = None,
+        log_interval_s: float = 10.0
+    ):
+        if policy not in (BLOCK, DROP_OLDEST, DROP_NEWEST, SPILL):
+            raise ValueError(f"Invalid overflow policy {policy}")
+        if policy == SPILL and spool is None:
+            raise ValueError("The spill overflow policy needs a spool")
+
+        super().__init__(maxsize)
+        self._logger = getLogger()
+        self._policy = policy
+        self._spool = spool
+
+        # Scans left in the spool by the previous run are returned after the ones in memory
+        self._spilled = spool.pending if spool is not None else 0
+        self._positions = deque()
+
+        self._overflows = 0
+        self._unlogged_overflows = 0
+        self._last_log = 0.0
+        self._log_interval_s = log_interval_s
+
+    @property
+    def policy(self) -> str:
+        """Overflow policy"""
+        return self._policy
+
+    @property
+    def overflows(self) -> int:
+        """Number of scans that found the queue full"""
+        return self._overflows
+
+    @property
+    def spilled(self) -> int:
+        """Number of scans currently spilled to disk"""
+        return self._spilled
+
+    def put(self, item, block: bool = True, timeout: Optional[float] = None):
+        if self._policy == BLOCK:
+            if self.maxsize > 0 and len(self.queue) >= self.maxsize:
+                self._overflow()
+            super().put(item, block, timeout)
+            return
+
+        with self.not_full:
+            if self._spilled == 0 and len(self.queue) < self.maxsize:
+                self._put(item)
+            elif self._policy == DROP_NEWEST:
+                self._overflow()
+                return
+            elif self._policy == DROP_OLDEST:
+                self.queue.popleft()
+                self.unfinished_tasks -= 1
+                self._put(item)
+                self._overflow()
+            else:
+                # Keep spilling until the spool is empty, so that the order is preserved
+                self._spool.append(item)
+                self._spilled += 1
+                self._overflow()
+
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _qsize(self):
+        return len(self.queue) + self._spilled
+
+    def _get(self):
+        if self._policy != SPILL:
+            return self.queue.popleft()
+
+        if self.queue:
+            self._positions.append(None)
+            return self.queue.popleft()
+
+        (item, position) = self._spool.read(False)
+        self._spilled -= 1
+        self._positions.append(position)
+        return item
+
+    def task_done(self):
+        if self._policy == SPILL:
+            with self.mutex:
+                position = self._positions.popleft() if self._positions else None
+            if position is not None:
+                self._spool.ack(position)
+
+        super().task_done()
+
+    def _overflow(self):
+        """Count an overflow event, logging (rate limited) the overflows so far"""
+        self._overflows += 1
+        self._unlogged_overflows += 1
+        QUEUE_OVERFLOWS.labels(self._policy).inc()
+
+        now = monotonic()
+        if now - self._last_log < self._log_interval_s:
+            return
+
+        self._logger.warning(
+            "Queue full (capacity %s, policy %s): %s overflows since last report, "
+            "%s total, depth %s", self.maxsize, self._policy, self._unlogged_overflows,
+            self._overflows, self._qsize(),
+            extra={ 'component': 'QUEUE' }
+        )
+        self._unlogged_overflows = 0
+        self._last_log = now
+
+    def close(self):
+        """Sync and close the spool, if any"""
+        if self._spool is not None:
+            self._spool.close()
@@ -0,0 +1,55 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from typing import Optional
+
+class BroadcastQueue:
+    """
+    Write-only queue handing every scan to the queue of each target: readers put a scan
+    once and the same (immutable) Scan instance is shared by all the targets, no copy is made.
+    Every target consumes, acknowledges and persists its own queue independently, so a slow
+    target only grows its own queue. The overflow policy of a bounded target queue still
+    applies: with block, a full target queue holds back the readers (and so every target).
+    Listeners (e.g. the local publisher) get every scan through publish() before the
+    targets, they must never block and are not counted in qsize().
+    """
+    _queues: list
+    _listeners: list
+
+    def __init__(self, queues: list, listeners: list = None):
+        self._queues = queues
+        self._listeners = listeners or []
+
+    @property
+    def queues(self) -> list:
+        """The target queues, in target order"""
+        return self._queues
+
+    def put(self, item: tuple, block: bool = True, timeout: Optional[float] = None):
+        """Hand the scan to every listener, then put it in every target queue"""
+        for listener in self._listeners:
+            listener.publish(item)
+        for queue in self._queues:
+            queue.put(item, block, timeout)
+
+    def put_nowait(self, item: tuple):
+        """Put the scan in every target queue, without waiting"""
+        self.put(item, False)
+
+    def qsize(self) -> int:
+        """Number of scans not sent to every target yet (the size of the longest queue)"""
+        return max(queue.qsize() for queue in self._queues)
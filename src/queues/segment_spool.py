@@ -0,0 +1,339 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import struct
+import zlib
+from logging import Logger, getLogger
+from queue import Empty
+from threading import Condition, Event, Thread
+from time import monotonic, monotonic_ns, time_ns
+from typing import Optional
+
+from scan import Scan
+
+# Every record is prefixed by its payload length and crc32
+RECORD_HEADER = struct.Struct("<II")
+
+# Scan payload: ts, device length, code length (followed by device and code, utf-8)
+SCAN_HEADER = struct.Struct("<qHI")
+# Then the keystroke timestamps (µs) and the decoded and enqueued checkpoints (ns),
+# missing in the records written by older versions
+SCAN_TRAILER = struct.Struct("<qqqq")
+# Then the id of the monotonic clock the checkpoints were taken with (missing in the
+# records written by older versions)
+SCAN_CLOCK = struct.Struct("<q")
+
+SEGMENT_SUFFIX = ".seg"
+OFFSET_FILENAME = "offset"
+OFFSET = struct.Struct("<QQ")
+
+def monotonic_clock_id() -> int:
+    """
+    Return an id of the current monotonic clock, which only changes when the host reboots:
+    the kernel boot id if available, the (rounded) boot time otherwise
+    """
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r", encoding="ascii") as boot_id:
+            return int(boot_id.read().strip().replace("-", ""), 16) >> 65
+    except (OSError, ValueError):
+        return round((time_ns() - monotonic_ns()) / 1000000000)
+
+CLOCK_ID = monotonic_clock_id()
+
+def encode_scan(item: Scan) -> bytes:
+    """Serialize a scan"""
+    device_bytes = item.device.encode()
+    code_bytes = item.code.encode()
+    return (
+        SCAN_HEADER.pack(int(item.ts), len(device_bytes), len(code_bytes))
+        + device_bytes + code_bytes
+        + SCAN_TRAILER.pack(item.first_us, item.last_us, item.decoded_ns, item.enqueued_ns)
+        + SCAN_CLOCK.pack(CLOCK_ID)
+    )
+
+def decode_scan(payload: bytes) -> Scan:
+    """
+    Deserialize a scan, the monotonic checkpoints are dropped if they were taken
+    before a reboot (they can't be compared with the current clock)
+    """
+    (ts, device_length, code_length) = SCAN_HEADER.unpack_from(payload)
+    start = SCAN_HEADER.size
+    device = payload[start:start + device_length].decode()
+    code = payload[start + device_length:start + device_length + code_length].decode()
+
+    end = start + device_length + code_length
+    if len(payload) < end + SCAN_TRAILER.size:
+        return Scan(device, code, ts)
+
+    (first_us, last_us, decoded_ns, enqueued_ns) = SCAN_TRAILER.unpack_from(payload, end)
+    end += SCAN_TRAILER.size
+    if len(payload) < end + SCAN_CLOCK.size or SCAN_CLOCK.unpack_from(payload, end)[0] != CLOCK_ID:
+        return Scan(device, code, ts, first_us, last_us)
+    return Scan(device, code, ts, first_us, last_us, decoded_ns, enqueued_ns)
+
+class SegmentSpool:
+    """
+    Durable, append-only log of scans, split in fixed size segments.
+    Records are appended by the readers and consumed in order by the sender, which
+    acknowledges them once sent. The acknowledged position (read offset) is persisted,
+    so that after a crash or restart only the unacknowledged scans are replayed.
+    Writes and the read offset are synced to disk every fsync_interval_ms (in batch),
+    segments are deleted as soon as all their records have been acknowledged.
+    """
+    _logger: Logger
+
+    _path: str
+    _segment_size: int
+    _fsync_interval_ms: int
+
+    _cond: Condition
+
+    # Writer state: current segment id, file and size
+    _write_segment: int
+    _write_file = None
+    _write_pos: int
+
+    # Reader state: position of the next record to read
+    _read_segment: int
+    _read_file = None
+    _read_pos: int
+
+    # Acknowledged position (everything before it has been sent)
+    _ack_segment: int
+    _ack_pos: int
+
+    # Number of records appended but not read yet
+    _pending: int
+
+    _dirty: bool
+    _offset_dirty: bool
+    _stop: Event
+    _sync_thread: Thread
+
+    def __init__(self, path: str, segment_size: int = 4 * 1024 * 1024, fsync_interval_ms: int = 100):
+        self._logger = getLogger()
+
+        self._path = path
+        self._segment_size = segment_size
+        self._fsync_interval_ms = fsync_interval_ms
+
+        self._cond = Condition()
+        self._dirty = False
+        self._offset_dirty = False
+        self._stop = Event()
+
+        os.makedirs(path, exist_ok=True)
+        self._open()
+
+        self._sync_thread = Thread(target=self._sync_loop, daemon=True)
+        self._sync_thread.start()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self._path, f"{segment:020d}{SEGMENT_SUFFIX}")
+
+    def _segments(self) -> list[int]:
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self._path)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _open(self):
+        """Restore the read offset and the segments, counting the records to replay"""
+        segments = self._segments()
+
+        self._ack_segment, self._ack_pos = segments[0] if segments else 0, 0
+        try:
+            with open(os.path.join(self._path, OFFSET_FILENAME), 'rb') as file:
+                self._ack_segment, self._ack_pos = OFFSET.unpack(file.read(OFFSET.size))
+        except (FileNotFoundError, struct.error):
+            pass
+
+        # Segments older than the read offset have already been sent
+        for segment in segments:
+            if segment < self._ack_segment:
+                os.remove(self._segment_path(segment))
+        segments = [segment for segment in segments if segment >= self._ack_segment]
+
+        if not segments or segments[0] != self._ack_segment:
+            # The acknowledged segment has been already compacted
+            self._ack_segment = segments[0] if segments else self._ack_segment
+            self._ack_pos = 0
+
+        self._pending = 0
+        for segment in segments:
+            start = self._ack_pos if segment == self._ack_segment else 0
+            (count, end) = self._scan_segment(segment, start)
+            self._pending += count
+
+            # Drop a partially written record at the end of the segment (crash while appending)
+            if end < os.path.getsize(self._segment_path(segment)):
+                self._logger.warning(
+                    "Truncating corrupted spool segment %s at %s", segment, end,
+                    extra={ 'component': 'SPOOL' }
+                )
+                os.truncate(self._segment_path(segment), end)
+
+        self._write_segment = segments[-1] if segments else self._ack_segment
+        self._write_file = open(self._segment_path(self._write_segment), 'ab')
+        self._write_pos = self._write_file.tell()
+
+        self._read_segment = self._ack_segment
+        self._read_pos = self._ack_pos
+        self._read_file = open(self._segment_path(self._read_segment), 'rb')
+        self._read_file.seek(self._read_pos)
+
+    def _scan_segment(self, segment: int, start: int) -> tuple[int, int]:
+        """
+        Count the valid records in a segment, starting from the given position.
+        Returns the count and the position after the last valid record.
+        """
+        count = 0
+        pos = start
+        with open(self._segment_path(segment), 'rb', buffering=1024 * 1024) as file:
+            file.seek(start)
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                (length, crc) = RECORD_HEADER.unpack(header)
+                payload = file.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                count += 1
+                pos += RECORD_HEADER.size + length
+
+        return (count, pos)
+
+    @property
+    def pending(self) -> int:
+        """Number of records appended and not read yet"""
+        return self._pending
+
+    def append(self, item: Scan):
+        """Append a scan to the log"""
+        payload = encode_scan(item)
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._cond:
+            if self._write_pos > 0 and self._write_pos + len(record) > self._segment_size:
+                self._roll_segment()
+
+            self._write_file.write(record)
+            # Make the record visible to the reader (and safe from a process crash),
+            # the fsync is done in background
+            self._write_file.flush()
+            self._write_pos += len(record)
+            self._pending += 1
+            self._dirty = True
+            self._cond.notify_all()
+
+    def _roll_segment(self):
+        os.fsync(self._write_file.fileno())
+        self._write_file.close()
+        self._write_segment += 1
+        self._write_file = open(self._segment_path(self._write_segment), 'ab')
+        self._write_pos = 0
+
+    def read(self, block: bool = True, timeout: Optional[float] = None) -> tuple[Scan, tuple]:
+        """
+        Read the next scan, returns the scan and its end position (to be acknowledged
+        once the scan has been sent). Raises Empty if there are no scans to read.
+        """
+        with self._cond:
+            deadline = None if timeout is None else monotonic() + timeout
+            while self._pending == 0:
+                if not block:
+                    raise Empty
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise Empty
+                self._cond.wait(remaining)
+
+            self._pending -= 1
+            write_segment = self._write_segment
+
+        header = self._read_file.read(RECORD_HEADER.size)
+        while len(header) < RECORD_HEADER.size and self._read_segment < write_segment:
+            # End of segment, move to the next one
+            self._read_file.close()
+            self._read_segment += 1
+            self._read_pos = 0
+            self._read_file = open(self._segment_path(self._read_segment), 'rb')
+            header = self._read_file.read(RECORD_HEADER.size)
+
+        (length, _) = RECORD_HEADER.unpack(header)
+        payload = self._read_file.read(length)
+        self._read_pos += RECORD_HEADER.size + length
+
+        return (decode_scan(payload), (self._read_segment, self._read_pos))
+
+    def ack(self, position: tuple):
+        """Acknowledge every record up to the given position (as returned by read)"""
+        with self._cond:
+            (segment, pos) = position
+            compact = segment > self._ack_segment
+            old_segment = self._ack_segment
+
+            self._ack_segment, self._ack_pos = segment, pos
+            self._offset_dirty = True
+
+        if compact:
+            # Every record of the previous segments has been acknowledged
+            for old in range(old_segment, segment):
+                try:
+                    os.remove(self._segment_path(old))
+                except FileNotFoundError:
+                    pass
+
+    def sync(self):
+        """Flush appended records and the read offset to disk"""
+        with self._cond:
+            dirty, self._dirty = self._dirty, False
+            offset_dirty, self._offset_dirty = self._offset_dirty, False
+            ack = (self._ack_segment, self._ack_pos)
+            write_file = self._write_file
+
+        if dirty:
+            try:
+                os.fsync(write_file.fileno())
+            except (ValueError, OSError):
+                # Segment closed (rolled) meanwhile, already synced
+                pass
+
+        if offset_dirty:
+            tmp_path = os.path.join(self._path, OFFSET_FILENAME + ".tmp")
+            with open(tmp_path, 'wb') as file:
+                file.write(OFFSET.pack(*ack))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, os.path.join(self._path, OFFSET_FILENAME))
+
+    def _sync_loop(self):
+        while not self._stop.wait(self._fsync_interval_ms / 1000.0):
+            if self._dirty or self._offset_dirty:
+                self.sync()
+
+    def close(self):
+        """Sync everything to disk and close the log"""
+        self._stop.set()
+        self._sync_thread.join()
+        self.sync()
+
+        with self._cond:
+            self._write_file.close()
+            self._read_file.close()
@@ -0,0 +1,274 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from logging import getLogger
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+import os
+from queue import Empty, Full
+import struct
+from time import monotonic, sleep
+from typing import Optional, Sequence
+
+from scan import Scan
+
+# Header: format (slots, record size), then the head (written by the producer only) and
+# the tail (written by the consumer only) on different cache lines
+LAYOUT = struct.Struct("<II")
+INDEX = struct.Struct("<Q")
+HEAD_OFFSET = 64
+TAIL_OFFSET = 128
+DATA_OFFSET = 192
+
+# Record: device index, code length, timestamp (ns), keystroke timestamps (µs),
+# decoded and enqueued checkpoints (ns), then the code
+RECORD_HEADER = struct.Struct("<HHqqqqq")
+
+DEFAULT_SLOTS = 4096
+DEFAULT_RECORD_SIZE = 1024
+
+# Waiting for data / free slots: yield a few times, then sleep doubling up to the max
+SPIN_ATTEMPTS = 64
+MIN_SLEEP_S = 0.00001
+MAX_SLEEP_S = 0.001
+
+def backoff(attempt: int):
+    """Wait before the next attempt of a busy polling loop"""
+    if attempt < SPIN_ATTEMPTS:
+        sleep(0)
+    else:
+        sleep(min(MIN_SLEEP_S * (1 << min(attempt - SPIN_ATTEMPTS, 10)), MAX_SLEEP_S))
+
+class ShmRingBuffer:
+    """
+    Single-producer / single-consumer ring buffer of fixed size records, on shared memory.
+    The producer and the consumer can live in different processes, the consumer process
+    creates the buffer and the producer attaches to it by name.
+    A record is published by advancing the head after it has been written, and released by
+    advancing the tail after it has been read, so no lock is needed.
+    """
+    _shm: shared_memory.SharedMemory
+    _owner: bool
+
+    slots: int
+    record_size: int
+
+    # Local copies of the indexes, the other side's index is only read when needed
+    _head: int
+    _tail: int
+
+    def __init__(
+        self,
+        slots: int = DEFAULT_SLOTS,
+        record_size: int = DEFAULT_RECORD_SIZE,
+        name: Optional[str] = None
+    ):
+        if name is None:
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=DATA_OFFSET + slots * record_size)
+            self._owner = True
+            LAYOUT.pack_into(self._shm.buf, 0, slots, record_size)
+            INDEX.pack_into(self._shm.buf, HEAD_OFFSET, 0)
+            INDEX.pack_into(self._shm.buf, TAIL_OFFSET, 0)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+
+        self._buf = self._shm.buf
+        (self.slots, self.record_size) = LAYOUT.unpack_from(self._buf, 0)
+        self._head = INDEX.unpack_from(self._buf, HEAD_OFFSET)[0]
+        self._tail = INDEX.unpack_from(self._buf, TAIL_OFFSET)[0]
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory block, to attach from another process"""
+        return self._shm.name
+
+    @property
+    def max_code_length(self) -> int:
+        """Max length of an encoded code"""
+        return min(self.record_size - RECORD_HEADER.size, 0xFFFF)
+
+    def __len__(self) -> int:
+        head = INDEX.unpack_from(self._buf, HEAD_OFFSET)[0]
+        return head - INDEX.unpack_from(self._buf, TAIL_OFFSET)[0]
+
+    def push(
+        self,
+        device_index: int,
+        code: bytes,
+        ts_ns: int,
+        first_us: int = 0,
+        last_us: int = 0,
+        decoded_ns: int = 0,
+        enqueued_ns: int = 0
+    ) -> bool:
+        """Append a record (producer side), returns False if the buffer is full"""
+        if len(code) > self.max_code_length:
+            raise ValueError(f"Code too long for the ring buffer ({len(code)} bytes)")
+
+        head = self._head
+        if head - self._tail >= self.slots:
+            self._tail = INDEX.unpack_from(self._buf, TAIL_OFFSET)[0]
+            if head - self._tail >= self.slots:
+                return False
+
+        offset = DATA_OFFSET + (head % self.slots) * self.record_size
+        RECORD_HEADER.pack_into(
+            self._buf, offset, device_index, len(code), ts_ns,
+            first_us, last_us, decoded_ns, enqueued_ns)
+        start = offset + RECORD_HEADER.size
+        self._buf[start:start + len(code)] = code
+
+        # Publish the record
+        self._head = head + 1
+        INDEX.pack_into(self._buf, HEAD_OFFSET, self._head)
+        return True
+
+    def pop(self) -> Optional[tuple]:
+        """
+        Remove and return the oldest (device index, code, ts ns, first us, last us,
+        decoded ns, enqueued ns) record, None if empty
+        """
+        tail = self._tail
+        if tail >= self._head:
+            self._head = INDEX.unpack_from(self._buf, HEAD_OFFSET)[0]
+            if tail >= self._head:
+                return None
+
+        offset = DATA_OFFSET + (tail % self.slots) * self.record_size
+        (device_index, length, *stamps) = RECORD_HEADER.unpack_from(self._buf, offset)
+        start = offset + RECORD_HEADER.size
+        code = bytes(self._buf[start:start + length])
+
+        # Release the slot
+        self._tail = tail + 1
+        INDEX.pack_into(self._buf, TAIL_OFFSET, self._tail)
+        return (device_index, code, *stamps)
+
+    def close(self):
+        """Detach from the shared memory (and release it, if created by this instance)"""
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+class ShmRingQueue:
+    """
+    Queue-compatible facade of a ShmRingBuffer, can replace the queue between a single reader
+    (thread or process) and the sender. The devices of the scans must be known in advance
+    (same list and order on both sides).
+    The producer can ring a doorbell (the write end of a pipe) after every push, so that the
+    consumer can block on the read end instead of polling while idle. Ringing only on an
+    empty buffer would race with the consumer reading the last record; a full pipe just
+    means a wake up is pending already. The doorbell write (a system call) also orders the
+    record and head stores before the consumer wakes up and reads them.
+    """
+    _ring: ShmRingBuffer
+    _devices: list[str]
+    _indexes: dict[str, int]
+    _doorbell: Optional[Connection]
+
+    def __init__(
+        self,
+        ring: ShmRingBuffer,
+        devices: Sequence[str],
+        doorbell: Optional[Connection] = None
+    ):
+        self._logger = getLogger()
+        self._ring = ring
+        self._devices = list(devices)
+        self._indexes = { device: index for (index, device) in enumerate(self._devices) }
+        self._doorbell = doorbell
+        if doorbell is not None:
+            # Never wait for the consumer: a full pipe already means a pending wake up
+            os.set_blocking(doorbell.fileno(), False)
+
+    @property
+    def ring(self) -> ShmRingBuffer:
+        """The underlying ring buffer"""
+        return self._ring
+
+    def put(self, item: Scan, block: bool = True, timeout: Optional[float] = None):
+        """Append the scan, waiting for a free slot if full (raise Full if not available)"""
+        code_bytes = item.code.encode()
+        if len(code_bytes) > self._ring.max_code_length:
+            self._logger.error(
+                "Scan dropped, code too long (%s bytes)", len(code_bytes),
+                extra={ 'component': 'QUEUE' }
+            )
+            return
+
+        deadline = None if timeout is None else monotonic() + timeout
+        attempt = 0
+        while not self._ring.push(
+                self._indexes[item.device], code_bytes, int(item.ts * 1000000000),
+                item.first_us, item.last_us, item.decoded_ns, item.enqueued_ns):
+            if not block or (deadline is not None and monotonic() >= deadline):
+                raise Full
+            backoff(attempt)
+            attempt += 1
+
+        if self._doorbell is not None:
+            self._ring_doorbell()
+
+    def _ring_doorbell(self):
+        try:
+            self._doorbell.send_bytes(b"\0")
+        except (BlockingIOError, BrokenPipeError):
+            # Pending wake up already (or the consumer is gone)
+            pass
+
+    def put_nowait(self, item: Scan):
+        """Append the scan, raise Full if the buffer is full"""
+        self.put(item, False)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Scan:
+        """Return the next scan, raise Empty if not available"""
+        deadline = None if timeout is None else monotonic() + timeout
+        attempt = 0
+        while True:
+            record = self._ring.pop()
+            if record is not None:
+                (device_index, code, ts_ns, *stamps) = record
+                return Scan(self._devices[device_index], code.decode(), ts_ns // 1000000000, *stamps)
+
+            if not block or (deadline is not None and monotonic() >= deadline):
+                raise Empty
+            backoff(attempt)
+            attempt += 1
+
+    def get_nowait(self) -> Scan:
+        """Return the next scan, raise Empty if not available"""
+        return self.get(False)
+
+    def task_done(self):
+        """No-op, slots are released as soon as the scans are read"""
+
+    def qsize(self) -> int:
+        """Number of scans waiting to be read"""
+        return len(self._ring)
+
+    def empty(self) -> bool:
+        """True if there are no scans waiting to be read"""
+        return len(self._ring) == 0
+
+    def close(self):
+        """Detach from (or release) the ring buffer"""
+        self._ring.close()
+        if self._doorbell is not None:
+            self._doorbell.close()
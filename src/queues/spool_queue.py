@@ -0,0 +1,89 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from collections import deque
+from queue import Empty
+from threading import Lock
+from typing import Optional
+
+from .segment_spool import SegmentSpool
+
+class SpoolQueue:
+    """
+    Queue-compatible facade of a SegmentSpool, can replace the queue between
+    readers and sender.
+    Every scan returned by get() is acknowledged (and won't be replayed after a restart)
+    only when task_done() is called for it, in order.
+    """
+    _spool: SegmentSpool
+
+    # Scans not acknowledged survive a restart, nothing to save on shutdown
+    persistent = True
+
+    # Positions of the scans returned by get() and not acknowledged yet
+    _unacked: deque
+    _lock: Lock
+
+    def __init__(self, spool: SegmentSpool):
+        self._spool = spool
+        self._unacked = deque()
+        self._lock = Lock()
+
+    @property
+    def spool(self) -> SegmentSpool:
+        """The underlying spool"""
+        return self._spool
+
+    def put(self, item: tuple, block: bool = True, timeout: Optional[float] = None):
+        """Append the scan to the spool (never blocks)"""
+        #pylint: disable=unused-argument
+        self._spool.append(item)
+
+    def put_nowait(self, item: tuple):
+        """Append the scan to the spool"""
+        self.put(item, False)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> tuple:
+        """Return the next scan from the spool, raise Empty if not available"""
+        (item, position) = self._spool.read(block, timeout)
+        with self._lock:
+            self._unacked.append(position)
+        return item
+
+    def get_nowait(self) -> tuple:
+        """Return the next scan from the spool, raise Empty if not available"""
+        return self.get(False)
+
+    def task_done(self):
+        """Acknowledge the oldest scan returned by get()"""
+        with self._lock:
+            if not self._unacked:
+                raise ValueError('task_done() called too many times')
+            position = self._unacked.popleft()
+        self._spool.ack(position)
+
+    def qsize(self) -> int:
+        """Number of scans waiting to be read"""
+        return self._spool.pending
+
+    def empty(self) -> bool:
+        """True if there are no scans waiting to be read"""
+        return self._spool.pending == 0
+
+    def close(self):
+        """Sync and close the underlying spool"""
+        self._spool.close()
@@ -0,0 +1,171 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+from logging import Logger, getLogger
+from typing import Callable, List
+import evdev
+from readers.evdev_device_discovery import ATTACH, EvdevDeviceDiscovery, InputNode
+from readers.evdev_device_reader import EvdevDeviceReader
+from config import DeviceConfig
+
+class AsyncQueueWriter:
+    """
+    Minimal Queue-like writer for an asyncio.Queue, so that the scan assemblers
+    can enqueue scans from the event loop callbacks
+    """
+    _queue: asyncio.Queue
+
+    def __init__(self, queue: asyncio.Queue):
+        self._queue = queue
+
+    def put(self, item, block: bool = True, timeout: float = None):
+        """Enqueue the item (must be called from the event loop thread)"""
+        #pylint: disable=unused-argument
+        self._queue.put_nowait(item)
+
+class AsyncEvdevMultiDeviceReader:
+    """
+    Multi device reader using the evdev (Linux), asyncio runtime.
+    Every grabbed device is registered in the event loop (add_reader), its events
+    are read and parsed as soon as they are available.
+    """
+    _logger: Logger
+    _loop: asyncio.AbstractEventLoop
+    _retry_task: asyncio.Task
+
+    _configs: List[DeviceConfig]
+    _polling_ms: int
+    _discovery: EvdevDeviceDiscovery
+
+    _readers: list[EvdevDeviceReader]
+
+    # File descriptor registered in the event loop for each device (None if not registered)
+    _registered: list[int]
+
+    def __init__(
+        self,
+        configs: List[DeviceConfig],
+        queue: asyncio.Queue,
+        polling_ms: int = 500,
+        discovery: EvdevDeviceDiscovery = None,
+        device_factory: Callable[[str], evdev.InputDevice] = None,
+        raw_events: bool = True,
+        event_mask: bool = True
+    ) -> None:
+        self._logger = getLogger()
+        self._loop = None
+        self._retry_task = None
+
+        self._configs = configs
+        self._polling_ms = polling_ms
+        self._discovery = discovery
+
+        writer = AsyncQueueWriter(queue)
+        self._readers = [
+            EvdevDeviceReader(
+                config, writer, polling_ms, discovery, device_factory, raw_events, event_mask)
+            for config in configs
+        ]
+        self._registered = [None for _ in configs]
+
+    def start(self):
+        """Register the devices in the running event loop"""
+        self._logger.info(
+            "Starting receiver",
+            extra={ 'component': 'READER:multiple' }
+        )
+        self._loop = asyncio.get_running_loop()
+
+        if self._discovery is not None:
+            self._discovery.subscribe(self._on_hotplug)
+
+        self._grab_all()
+
+        # Without hotplug notifications, missing devices are checked every polling_ms
+        if self._discovery is None or not self._discovery.watching:
+            self._retry_task = asyncio.create_task(self._retry())
+
+    def connected_devices(self) -> int:
+        """Number of devices currently connected (grabbed)"""
+        return sum(1 for reader in self._readers if reader.grabbed)
+
+    def _on_hotplug(self, event: str, _node: InputNode):
+        # Called from the discovery thread
+        if event == ATTACH and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._grab_all)
+
+    async def _retry(self):
+        """Periodically try to grab the missing devices"""
+        while True:
+            await asyncio.sleep(self._polling_ms / 1000.0)
+            if None in self._registered:
+                self._grab_all()
+
+    def _grab_all(self) -> bool:
+        """
+        Try to grab every device which is not registered yet and register it in the event loop.
+        Returns True if all the devices are grabbed, False otherwise.
+        """
+        all_grabbed = True
+
+        for i, reader in enumerate(self._readers):
+            if self._registered[i] is not None and reader.grabbed:
+                continue
+
+            if not reader.grab():
+                all_grabbed = False
+                continue
+
+            self._registered[i] = reader.fileno()
+            self._loop.add_reader(self._registered[i], self._on_readable, i)
+
+        return all_grabbed
+
+    def _on_readable(self, index: int):
+        reader = self._readers[index]
+
+        # Drain every pending event, read() returns None when there are no more
+        # events available or when the device has disconnected
+        while True:
+            raw_events = reader.read()
+            if raw_events is None:
+                break
+            reader.feed(raw_events)
+
+        if not reader.grabbed:
+            self._unregister(index)
+
+    def _unregister(self, index: int):
+        if self._registered[index] is None:
+            return
+
+        self._loop.remove_reader(self._registered[index])
+        self._registered[index] = None
+
+    def stop(self):
+        """Unregister the devices from the event loop"""
+        self._logger.info(
+            "Stopping receiver",
+            extra={ 'component': 'READER:multiple' }
+        )
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+
+        for i in range(len(self._readers)):
+            self._unregister(i)
+        self._loop = None
@@ -0,0 +1,69 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Hashable, Optional
+
+class DedupCache:
+    """
+    Bounded cache of the keys seen in the last window_ms milliseconds.
+    Every key gets the same time to live, so insertion order is also expiry order:
+    expired keys are popped from the front and, once full, the oldest key is evicted.
+    Lookups, insertions and evictions are all O(1) (amortized).
+    """
+    _window_s: float
+    _capacity: int
+
+    # key -> expiry (monotonic seconds), oldest first
+    _entries: OrderedDict
+
+    def __init__(self, window_ms: int, capacity: int = 1024) -> None:
+        self._window_s = window_ms / 1000
+        self._capacity = capacity
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def seen(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """
+        Return True if the key was already seen within the window, otherwise remember it
+        and return False. The window starts from the first occurrence and is not extended by duplicates.
+        """
+        if now is None:
+            now = monotonic()
+
+        entries = self._entries
+        while entries:
+            oldest, expiry = next(iter(entries.items()))
+            if expiry > now:
+                break
+            del entries[oldest]
+
+        if key in entries:
+            return True
+
+        if len(entries) >= self._capacity:
+            entries.popitem(last=False)
+
+        entries[key] = now + self._window_s
+        return False
+
+    def clear(self):
+        """Forget every key"""
+        self._entries.clear()
@@ -17,15 +17,23 @@
 
 from logging import Logger, getLogger
 from queue import Queue
-from threading import Thread
+from threading import Event, Thread
 
 from config import DeviceConfig
+from metrics.registry import REGISTRY
+
+DEVICE_CONNECTS = REGISTRY.counter(
+    "barcode_relay_device_connects_total", "Device (re)connections, by device", ["device"])
+DEVICE_DISCONNECTS = REGISTRY.counter(
+    "barcode_relay_device_disconnects_total", "Device disconnections, by device", ["device"])
 
 class DeviceReader:
     """Generic device reader"""
     _logger: Logger
     _run: bool
     _thread: Thread
+    # Set when stopping, idle waits use it to wake up immediately
+    _stop_event: Event
     _queue: Queue
 
     _config: DeviceConfig
@@ -35,6 +43,7 @@ class DeviceReader:
         self._logger = getLogger()
         self._run = False
         self._thread = None
+        self._stop_event = Event()
 
         self._config = config
         self._queue = queue
@@ -47,6 +56,7 @@ class DeviceReader:
             extra={ 'component': f"READER:{self._config.id}" }
         )
         self._run = True
+        self._stop_event.clear()
         self._thread = Thread(target=self.run)
         self._thread.start()
 
@@ -60,5 +70,6 @@ class DeviceReader:
             extra={ 'component': f"READER:{self._config.id}" }
         )
         self._run = False
+        self._stop_event.set()
         if self._thread:
             self._thread.join()
@@ -0,0 +1,317 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from logging import Logger, getLogger
+from threading import Lock, Thread
+from typing import Callable, NamedTuple, Optional
+
+SYSFS_INPUT_DIR = "/sys/class/input"
+DEV_INPUT_DIR = "/dev/input"
+
+# inotify constants (from <sys/inotify.h>)
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+ATTACH = "attach"
+DETACH = "detach"
+
+class InputNode(NamedTuple):
+    """Evdev input node, as described by sysfs"""
+    path: str
+    vid: int
+    pid: int
+    name: str
+    phys: str
+
+def _read_sysfs_attr(path: str) -> str:
+    try:
+        with open(path, 'r', encoding="utf-8") as file:
+            return file.read().strip()
+    except OSError:
+        return ""
+
+def read_input_node(event_name: str, sysfs_root: str = SYSFS_INPUT_DIR,
+                    dev_root: str = DEV_INPUT_DIR) -> Optional[InputNode]:
+    """
+    Describe the eventN node using only sysfs attributes (the device is never opened).
+    Returns None if the node is not an evdev node or has already gone away.
+    """
+    if not event_name.startswith("event"):
+        return None
+
+    device_dir = os.path.join(sysfs_root, event_name, "device")
+    if not os.path.isdir(device_dir):
+        return None
+
+    try:
+        vid = int(_read_sysfs_attr(os.path.join(device_dir, "id", "vendor")) or "0", 16)
+        pid = int(_read_sysfs_attr(os.path.join(device_dir, "id", "product")) or "0", 16)
+    except ValueError:
+        return None
+
+    return InputNode(
+        os.path.join(dev_root, event_name),
+        vid,
+        pid,
+        _read_sysfs_attr(os.path.join(device_dir, "name")),
+        _read_sysfs_attr(os.path.join(device_dir, "phys")),
+    )
+
+def scan_input_nodes(sysfs_root: str = SYSFS_INPUT_DIR,
+                     dev_root: str = DEV_INPUT_DIR) -> dict[str, InputNode]:
+    """Build an index (path -> node) of every evdev node currently attached"""
+    try:
+        names = os.listdir(sysfs_root)
+    except OSError:
+        return {}
+
+    nodes = {}
+    for name in names:
+        node = read_input_node(name, sysfs_root, dev_root)
+        if node is not None:
+            nodes[node.path] = node
+
+    return nodes
+
+def find_input_node(nodes: dict[str, InputNode], vid: int = None, pid: int = None,
+                    name: str = None, phys: str = None) -> Optional[InputNode]:
+    """Return the first node matching all the given (not None) attributes"""
+    for node in nodes.values():
+        if vid is not None and node.vid != vid:
+            continue
+        if pid is not None and node.pid != pid:
+            continue
+        if name is not None and node.name != name:
+            continue
+        if phys is not None and node.phys != phys:
+            continue
+        return node
+
+    return None
+
+class EvdevDeviceDiscovery:
+    """
+    Hotplug aware discovery of evdev input nodes.
+    Keeps an index of the attached nodes (built from sysfs, without opening the devices)
+    and watches /dev/input with inotify to notify the listeners about attached and
+    detached devices as soon as it happens.
+    If inotify is not available, sysfs is rescanned every polling_ms instead.
+    """
+    _logger: Logger
+    _run: bool
+    _thread: Thread
+
+    _sysfs_root: str
+    _dev_root: str
+    _polling_ms: int
+
+    # Index of the attached nodes, replaced (never modified) on every change
+    _nodes: dict[str, InputNode]
+    _listeners: list[Callable[[str, InputNode], None]]
+    _lock: Lock
+
+    _inotify_fd: int
+    _wakeup_r: int
+    _wakeup_w: int
+
+    def __init__(self, polling_ms: int = 500, sysfs_root: str = SYSFS_INPUT_DIR,
+                 dev_root: str = DEV_INPUT_DIR) -> None:
+        self._logger = getLogger()
+        self._run = False
+        self._thread = None
+
+        self._sysfs_root = sysfs_root
+        self._dev_root = dev_root
+        self._polling_ms = polling_ms
+
+        self._nodes = scan_input_nodes(sysfs_root, dev_root)
+        self._listeners = []
+        self._lock = Lock()
+
+        self._inotify_fd = -1
+        self._wakeup_r, self._wakeup_w = os.pipe()
+
+    @property
+    def nodes(self) -> dict[str, InputNode]:
+        """Current index of the attached nodes (path -> node)"""
+        return self._nodes
+
+    @property
+    def watching(self) -> bool:
+        """True if changes are notified by inotify, False if sysfs is polled"""
+        return self._inotify_fd >= 0
+
+    def find(self, vid: int = None, pid: int = None, name: str = None,
+             phys: str = None) -> Optional[InputNode]:
+        """Return the first attached node matching all the given (not None) attributes"""
+        return find_input_node(self._nodes, vid, pid, name, phys)
+
+    def subscribe(self, listener: Callable[[str, InputNode], None]):
+        """
+        Register a listener, called with (ATTACH|DETACH, node) from the discovery thread
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def start(self):
+        """Start the discovery thread"""
+        self._logger.info(
+            "Starting device discovery",
+            extra={ 'component': 'DISCOVERY' }
+        )
+        self._inotify_fd = self._inotify_init()
+        if self._inotify_fd < 0:
+            self._logger.warning(
+                "inotify not available, polling %s every %sms", self._sysfs_root, self._polling_ms,
+                extra={ 'component': 'DISCOVERY' }
+            )
+
+        self._run = True
+        self._thread = Thread(target=self.run)
+        self._thread.start()
+
+    def _inotify_init(self) -> int:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return -1
+
+            mask = IN_CREATE | IN_DELETE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO
+            if libc.inotify_add_watch(fd, os.fsencode(self._dev_root), mask) < 0:
+                os.close(fd)
+                return -1
+
+            return fd
+        except (OSError, AttributeError):
+            return -1
+
+    def run(self):
+        """Actual working function"""
+        while self._run:
+            if self._inotify_fd < 0:
+                select.select([self._wakeup_r], [], [], self._polling_ms / 1000.0)
+                self.rescan()
+                continue
+
+            readable, _, _ = select.select([self._inotify_fd, self._wakeup_r], [], [])
+            if self._inotify_fd in readable:
+                self._read_inotify()
+
+    def _read_inotify(self):
+        try:
+            data = os.read(self._inotify_fd, 4096)
+        except BlockingIOError:
+            return
+
+        changed = set()
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Some events have been lost, rebuild the whole index
+                self.rescan()
+                return
+
+            if name.startswith("event"):
+                changed.add(name)
+
+        for name in changed:
+            self._update(name)
+
+    def _update(self, event_name: str):
+        """Refresh a single node of the index and notify the listeners"""
+        path = os.path.join(self._dev_root, event_name)
+        node = None
+        if os.path.exists(path):
+            node = read_input_node(event_name, self._sysfs_root, self._dev_root)
+
+        nodes = dict(self._nodes)
+        old = nodes.pop(path, None)
+        if node is not None:
+            nodes[path] = node
+        self._nodes = nodes
+
+        if node is not None:
+            # Also notify attribute changes (e.g. permissions fixed by udev after creation)
+            self._notify(ATTACH, node)
+        elif old is not None:
+            self._notify(DETACH, old)
+
+    def rescan(self):
+        """Rebuild the whole index from sysfs and notify the listeners about the changes"""
+        nodes = scan_input_nodes(self._sysfs_root, self._dev_root)
+        old_nodes = self._nodes
+        self._nodes = nodes
+
+        for path, node in old_nodes.items():
+            if nodes.get(path) != node:
+                self._notify(DETACH, node)
+        for path, node in nodes.items():
+            if old_nodes.get(path) != node:
+                self._notify(ATTACH, node)
+
+    def _notify(self, event: str, node: InputNode):
+        self._logger.debug(
+            "Device %s: %s (%s, VID %s, PID %s)", event, node.path, node.name, node.vid, node.pid,
+            extra={ 'component': 'DISCOVERY' }
+        )
+        with self._lock:
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                listener(event, node)
+            except Exception as e:
+                self._logger.error(
+                    "Device discovery listener failed: %s", e,
+                    extra={ 'component': 'DISCOVERY' }
+                )
+
+    def stop(self):
+        """Stop the discovery thread"""
+        self._logger.info(
+            "Stopping device discovery",
+            extra={ 'component': 'DISCOVERY' }
+        )
+        self._run = False
+        os.write(self._wakeup_w, b"\0")
+        if self._thread:
+            self._thread.join()
+
+        if self._inotify_fd >= 0:
+            os.close(self._inotify_fd)
+            self._inotify_fd = -1
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
@@ -15,17 +15,29 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-from datetime import datetime
-import json
 from queue import Queue
-import re
-from time import sleep
+from typing import Callable
 import evdev
-import evdev.events
 
-from readers.keycodes import code_to_char
+from readers.evdev_device_discovery import EvdevDeviceDiscovery, find_input_node, scan_input_nodes
+from readers.input_events import EV_KEY, EV_SYN, RawEventReader, set_event_mask
+from readers.keycodes import KeyDecoder
+from readers.scan_assembler import ScanAssembler
 from config import DeviceConfig
-from .device_reader import DeviceReader
+from metrics.registry import REGISTRY
+from .device_reader import DEVICE_CONNECTS, DEVICE_DISCONNECTS, DeviceReader
+
+# The events (and wakeups) filtered in the reader are the ones the kernel event mask avoids,
+# with the mask installed only the SYN_REPORT events are left
+EVENT_MASK = REGISTRY.gauge(
+    "barcode_relay_event_mask",
+    "1 if the kernel event mask (only key events) is installed on the device", ["device"])
+FILTERED_EVENTS = REGISTRY.counter(
+    "barcode_relay_filtered_events_total",
+    "Events read and discarded by the reader (not key events), by device", ["device"])
+EMPTY_WAKEUPS = REGISTRY.counter(
+    "barcode_relay_empty_wakeups_total",
+    "Reads returning events but no key event, by device", ["device"])
 
 class EvdevDeviceReader(DeviceReader):
     """Device reader using the evdev (Linux)"""
@@ -34,25 +46,73 @@ class EvdevDeviceReader(DeviceReader):
     # (also keep track if the device disconnects)
     _grabbed = False
 
-    # Keep a buffer of the device data
-    _buffer = ""
+    # Decode the key events into chars (tracks the modifiers state of the device)
+    _decoder: KeyDecoder
+
+    # Assemble the device data into full scans
+    _assembler: ScanAssembler
 
     _device: evdev.InputDevice = None
 
-    def __init__(self, config: DeviceConfig, queue: Queue, polling_ms: int = 500) -> None:
+    # Index of the attached input nodes, kept up to date on hotplug events
+    # (if None, sysfs is scanned on every attempt)
+    _discovery: EvdevDeviceDiscovery = None
+
+    # Open the device at the given path (evdev.InputDevice, or a synthetic device)
+    _device_factory: Callable[[str], evdev.InputDevice]
+
+    # Decode raw input_event structs read from the device fd (fast path),
+    # instead of evdev InputEvent objects
+    _raw_events: bool
+    _raw_reader: RawEventReader = None
+
+    # Install the kernel event mask on grab, so that only key events wake the reader up
+    # (filtered in the reader if not supported)
+    _event_mask: bool
+
+    def __init__(
+        self,
+        config: DeviceConfig,
+        queue: Queue,
+        polling_ms: int = 500,
+        discovery: EvdevDeviceDiscovery = None,
+        device_factory: Callable[[str], evdev.InputDevice] = None,
+        raw_events: bool = True,
+        event_mask: bool = True
+    ) -> None:
         super().__init__(config, queue, polling_ms)
+        self._discovery = discovery
+        self._device_factory = device_factory or evdev.InputDevice
+        self._raw_events = raw_events
+        self._event_mask = event_mask
+        self._filtered_events = FILTERED_EVENTS.labels(config.id)
+        self._empty_wakeups = EMPTY_WAKEUPS.labels(config.id)
+        self._decoder = KeyDecoder(config.layout, config.id)
+        self._assembler = ScanAssembler(config, queue)
+
+    @property
+    def grabbed(self) -> bool:
+        """True if the device is currently grabbed by this reader"""
+        return self._grabbed and self._device is not None
+
+    def fileno(self) -> int:
+        """
+        Return the file descriptor of the grabbed device, so that the reader
+        can be registered directly in a selector
+        """
+        return self._device.fd
 
     def _findDevicePath(self):
         if self._config.hwid_regex is not None:
             return self._config.hwid_regex
 
-        devices = [evdev.InputDevice(path) for path in evdev.list_devices()]
-        for device in devices:
-            if device.info.vendor == self._config.vid and device.info.product == self._config.pid:
-                return device.path
+        # Look the device up by sysfs attributes, without opening every input node
+        nodes = self._discovery.nodes if self._discovery is not None else scan_input_nodes()
+        node = find_input_node(nodes, self._config.vid, self._config.pid)
+        if node is None:
+            return None
 
-        print("Not found")
-        return None
+        return node.path
 
     def grab(self):
         """
@@ -69,38 +129,68 @@ class EvdevDeviceReader(DeviceReader):
                 self._device = None
                 return False
 
-            self._device = evdev.InputDevice(path)
+            self._device = self._device_factory(path)
             self._device.grab()
+            if self._event_mask:
+                self._install_event_mask()
+            if self._raw_events:
+                self._raw_reader = RawEventReader(self._device)
 
             self._grabbed = True
-            self._buffer = ""
+            self._decoder.reset()
+            self._assembler.reset()
 
             self._logger.info(
                 "Device re/connected",
                 extra={ 'component': f"READER:{self._config.id}" }
             )
+            DEVICE_CONNECTS.labels(self._config.id).inc()
             return True
-        except FileNotFoundError:
-            self._device = None
-        except PermissionError:
-            self._device = None
+        except (FileNotFoundError, PermissionError):
+            self._close()
+        except OSError as e:
+            # e.g. device already grabbed by someone else
+            self._logger.warning(
+                "Unable to grab device: %s", e,
+                extra={ 'component': f"READER:{self._config.id}" }
+            )
+            self._close()
 
         return False
 
+    def _install_event_mask(self):
+        """Install the kernel event mask on the device, only key events are delivered"""
+        installed = set_event_mask(self._device, (EV_SYN, EV_KEY))
+        EVENT_MASK.labels(self._config.id).set(1 if installed else 0)
+        if not installed:
+            self._logger.info(
+                "Event mask not supported, filtering events in the reader",
+                extra={ 'component': f"READER:{self._config.id}" }
+            )
+
     def read(self):
         """
-        Read and return the list of pending events for the device
+        Read and return the list of pending key events for the device: (keycode, value, us)
+        tuples on the raw events path, InputEvents otherwise
         """
         if self._device is None:
             return None
 
         # Try to read pending events from the device
         try:
-            events: list[evdev.events.InputEvent] = []
-            raw_events: list[evdev.events.InputEvent] = self._device.read()
-            for raw_event in raw_events:
-                events.append(raw_event)
-            return events
+            if self._raw_reader is not None:
+                key_events = self._raw_reader.read_key_events()
+                events = self._raw_reader.events
+            else:
+                raw_events = list(self._device.read())
+                key_events = [raw_event for raw_event in raw_events if raw_event.type == EV_KEY]
+                events = len(raw_events)
+
+            if len(key_events) < events:
+                self._filtered_events.inc(events - len(key_events))
+                if not key_events:
+                    self._empty_wakeups.inc()
+            return key_events
         except BlockingIOError:
             # No pending event for this device, wait and retry
             return None
@@ -110,58 +200,47 @@ class EvdevDeviceReader(DeviceReader):
                 "Device disconnected",
                 extra={ 'component': f"READER:{self._config.id}" }
             )
+            DEVICE_DISCONNECTS.labels(self._config.id).inc()
             self._grabbed = False
+            self._close()
             return None
 
-    def parse_event_as_char(self, raw_event: evdev.InputEvent):
-        """
-        Try to parse the InputEvent as a char. Only parse keydown events, ignore others.
-        Returns the character represented by the keydown event or None for other events.
-        """
-        if not isinstance(raw_event, evdev.events.InputEvent):
-            self._logger.error(
-                "Received invalid event",
-                extra={ 'component': f"READER:{self._config.id}" }
-            )
-            return None
-
-        event = evdev.categorize(raw_event)
-        if not isinstance(event, evdev.events.KeyEvent):
-            # Not interested
-            return None
+    def _close(self):
+        """Release the device handle, if any"""
+        if self._device is None:
+            return
 
-        if event.keystate != evdev.events.KeyEvent.key_down:
-            # Not interested
-            return None
+        try:
+            self._device.close()
+        except OSError:
+            pass
+        self._device = None
+        self._raw_reader = None
 
-        return code_to_char(event.scancode)
+    def feed(self, raw_events) -> int:
+        """
+        Parse a batch of events (as returned by read) as chars and append them to the
+        current scan, enqueueing every full scan. Returns the number of valid (keydown) characters.
+        """
+        stamps = []
+        if self._raw_events:
+            return self._assembler.feed(self._decoder.decode(raw_events, stamps), stamps)
+        return self._assembler.feed(self._decoder.decode((
+            (raw_event.code, raw_event.value, raw_event.sec * 1000000 + raw_event.usec)
+            for raw_event in raw_events
+        ), stamps), stamps)
 
     def run(self):
         while self._run:
             if not self.grab():
                 # If device is still not grabbed, wait and retry
-                sleep(self._polling_ms / 1000.0)
+                self._stop_event.wait(self._polling_ms / 1000.0)
                 continue
 
             raw_events = self.read()
             if raw_events is None:
                 # If no events or device has disconnected wait and retry
-                sleep(self._polling_ms / 1000.0)
+                self._stop_event.wait(self._polling_ms / 1000.0)
                 continue
 
-            for raw_event in raw_events:
-                event_char = self.parse_event_as_char(raw_event)
-                if event_char is None:
-                    continue
-
-                self._buffer += event_char
-
-                # Check if the string is a full scan
-                if re.match(self._config.full_scan_regex, self._buffer):
-                    ts = int(datetime.now().timestamp())
-                    self._queue.put((self._config.id, self._buffer, ts))
-                    self._logger.info(
-                        "Read scan: %s", json.dumps({'code': self._buffer}),
-                        extra={ 'component': f"READER:{self._config.id}" }
-                    )
-                    self._buffer = ""
+            self.feed(raw_events)
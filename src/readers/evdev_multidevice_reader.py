@@ -15,30 +15,52 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-from datetime import datetime
-import json
 from queue import Queue
-import re
-from time import sleep
+from typing import Callable
+import evdev
+from readers.evdev_device_discovery import EvdevDeviceDiscovery
 from readers.evdev_device_reader import EvdevDeviceReader
 from readers.multidevice_reader import MultiDeviceReader
 from config import DeviceConfig
 
 class EvdevMultiDeviceReader(MultiDeviceReader):
     """Multi device reader using the evdev (Linux)"""
-    _readers: list[EvdevDeviceReader] = []
+    _readers: list[EvdevDeviceReader]
 
-    def __init__(self, configs: DeviceConfig, queue: Queue, polling_ms: int = 500) -> None:
+    # Hotplug aware index of the input nodes, shared by all the readers (optional)
+    _discovery: EvdevDeviceDiscovery
+
+    def __init__(
+        self,
+        configs: DeviceConfig,
+        queue: Queue,
+        polling_ms: int = 500,
+        discovery: EvdevDeviceDiscovery = None,
+        device_factory: Callable[[str], evdev.InputDevice] = None,
+        raw_events: bool = True,
+        event_mask: bool = True
+    ) -> None:
         super().__init__(configs, queue, polling_ms)
+        self._discovery = discovery
 
         # Create a single device evdev reader for each configuration
+        self._readers = []
         for config in self._configs:
-            self._readers.append(EvdevDeviceReader(config, queue, polling_ms))
+            self._readers.append(
+                EvdevDeviceReader(
+                    config, queue, polling_ms, discovery, device_factory, raw_events, event_mask))
 
-    def run(self):
-        # Keep a buffer of the device data
-        buffers = ["" for _ in self._configs]
+    def connected_devices(self) -> int:
+        return sum(1 for reader in self._readers if reader.grabbed)
+
+    def _handle_events(self, index: int, raw_events) -> int:
+        """
+        Parse the events read from the device at the given index and enqueue
+        every full scan. Returns the number of valid (keydown) characters.
+        """
+        return self._readers[index].feed(raw_events)
 
+    def run(self):
         while self._run:
             # Keep track of valid events,
             # if no valid event has occurred wait before looping again
@@ -55,23 +77,7 @@ class EvdevMultiDeviceReader(MultiDeviceReader):
                     # If no events or device has disconnected wait and retry
                     continue
 
-                for raw_event in raw_events:
-                    event_char = reader.parse_event_as_char(raw_event)
-                    if event_char is None:
-                        continue
-
-                    buffers[i] += event_char
-                    valid_events_count += 1
-
-                    # Check if the string is a full scan
-                    if re.match(self._configs[i].full_scan_regex, buffers[i]):
-                        ts = int(datetime.now().timestamp())
-                        self._queue.put((self._configs[i].id, buffers[i], ts))
-                        self._logger.info(
-                            "Read scan: %s", json.dumps({'code': buffers[i]}),
-                            extra={ 'component': f"READER:{self._configs[i].id}" }
-                        )
-                        buffers[i] = ""
+                valid_events_count += self._handle_events(i, raw_events)
 
             if valid_events_count == 0:
-                sleep(self._polling_ms / 1000.0)
+                self._stop_event.wait(self._polling_ms / 1000.0)
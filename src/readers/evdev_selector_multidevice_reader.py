@@ -0,0 +1,156 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+from queue import Queue
+import selectors
+from typing import Callable, List
+import evdev
+from readers.evdev_device_discovery import ATTACH, EvdevDeviceDiscovery, InputNode
+from readers.evdev_multidevice_reader import EvdevMultiDeviceReader
+from config import DeviceConfig
+
+class EvdevSelectorMultiDeviceReader(EvdevMultiDeviceReader):
+    """
+    Multi device reader using the evdev (Linux), event driven.
+    Instead of polling every device, block on a selector (epoll) over all the
+    grabbed devices and wake up only when some input is actually available.
+    """
+    _selector: selectors.BaseSelector
+
+    # Pipe used to wake up the selector when the reader is stopped (-1 once closed)
+    _wakeup_r: int
+    _wakeup_w: int
+
+    # File descriptor registered in the selector for each device (None if not registered)
+    _registered: list[int]
+
+    def __init__(
+        self,
+        configs: List[DeviceConfig],
+        queue: Queue,
+        polling_ms: int = 500,
+        discovery: EvdevDeviceDiscovery = None,
+        device_factory: Callable[[str], evdev.InputDevice] = None,
+        raw_events: bool = True,
+        event_mask: bool = True
+    ) -> None:
+        super().__init__(
+            configs, queue, polling_ms, discovery, device_factory, raw_events, event_mask)
+
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+        self._registered = [None for _ in self._configs]
+
+        if self._discovery is not None:
+            self._discovery.subscribe(self._on_hotplug)
+
+    def _on_hotplug(self, event: str, _node: InputNode):
+        # A device has been attached, wake up and try to grab the missing devices
+        if event == ATTACH:
+            self._wakeup()
+
+    def _wakeup(self):
+        """Wake up the selector, if it is currently blocked"""
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except OSError:
+            # The pipe is full (the selector will wake up anyway) or already closed
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _unregister(self, index: int):
+        if self._registered[index] is None:
+            return
+
+        try:
+            self._selector.unregister(self._registered[index])
+        except (KeyError, ValueError):
+            pass
+        self._registered[index] = None
+
+    def _grab_all(self) -> bool:
+        """
+        Try to grab every device which is not grabbed yet and register it in the selector.
+        Returns True if all the devices are grabbed, False otherwise.
+        """
+        all_grabbed = True
+
+        for i, reader in enumerate(self._readers):
+            if not reader.grab():
+                self._unregister(i)
+                all_grabbed = False
+                continue
+
+            fd = reader.fileno()
+            if self._registered[i] != fd:
+                self._unregister(i)
+                self._selector.register(fd, selectors.EVENT_READ, i)
+                self._registered[i] = fd
+
+        return all_grabbed
+
+    def run(self):
+        while self._run:
+            # Block until some device has data available, if some device is still
+            # missing and there's no hotplug notification wake up every polling_ms
+            # to try and grab it again
+            timeout = None
+            if not self._grab_all() and (self._discovery is None or not self._discovery.watching):
+                timeout = self._polling_ms / 1000.0
+
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    self._drain_wakeup()
+                    continue
+
+                index = key.data
+                reader = self._readers[index]
+
+                # Drain every pending event, read() returns None when there are no more
+                # events available or when the device has disconnected
+                while True:
+                    raw_events = reader.read()
+                    if raw_events is None:
+                        break
+                    self._handle_events(index, raw_events)
+
+                if not reader.grabbed:
+                    self._unregister(index)
+
+    def stop(self):
+        self._run = False
+        self._wakeup()
+        super().stop()
+
+        self._selector.close()
+        # stop() may be called again (signal handler and normal shutdown), and a closed
+        # fd number may be reused by the time a late hotplug event wakes us up
+        if self._wakeup_w >= 0:
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_r = self._wakeup_w = -1
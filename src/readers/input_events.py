@@ -0,0 +1,133 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Raw struct input_event decoding: events are read from the device fd straight into a
+preallocated buffer and decoded through strided memoryviews, without building an
+InputEvent (or KeyEvent) object per event.
+The kernel side event mask (EVIOCSMASK) keeps the events not needed by the readers
+from reaching userspace at all.
+"""
+
+import ctypes
+import fcntl
+import os
+import struct
+from typing import Callable, Iterable
+
+# struct input_event { struct timeval time; __u16 type; __u16 code; __s32 value; }
+INPUT_EVENT = struct.Struct("llHHi")
+
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_CNT = 0x20
+
+# struct input_mask { __u32 type; __u32 codes_size; __u64 codes_ptr; }
+INPUT_MASK = struct.Struct("IIQ")
+# _IOW('E', 0x93, struct input_mask)
+EVIOCSMASK = (1 << 30) | (INPUT_MASK.size << 16) | (ord('E') << 8) | 0x93
+
+# Events read at most by a single read (same as evdev)
+READ_BATCH = 64
+
+# Positions of type, code (16 bits words) and value (32 bits words) inside the buffer,
+# the timeval (sec, usec) is made of the first two longs
+_TYPE_INDEX = struct.calcsize("ll") // 2
+_VALUE_INDEX = struct.calcsize("llHH") // 4
+_WORDS = INPUT_EVENT.size // 2
+_DWORDS = INPUT_EVENT.size // 4
+_LONGS = INPUT_EVENT.size // struct.calcsize("l")
+
+def set_event_mask(device, event_types: Iterable[int]) -> bool:
+    """
+    Install the kernel event mask on the device, so that only the given event types
+    are delivered to this client (EV_SYN is never filtered by the kernel, empty
+    SYN_REPORT packets are dropped). The device must expose either
+    set_event_mask(event_types) or an evdev fd.
+    Returns False if not supported (kernel < 4.4, or not an evdev device).
+    """
+    method = getattr(device, "set_event_mask", None)
+    if method is not None:
+        return method(event_types)
+
+    bits = bytearray(EV_CNT // 8)
+    for event_type in event_types:
+        bits[event_type // 8] |= 1 << (event_type % 8)
+    codes = ctypes.create_string_buffer(bytes(bits), len(bits))
+
+    try:
+        # Type 0 selects the mask of the event types
+        fcntl.ioctl(device.fd, EVIOCSMASK, INPUT_MASK.pack(EV_SYN, len(bits), ctypes.addressof(codes)))
+    except OSError:
+        return False
+    return True
+
+class RawEventReader:
+    """
+    Read raw input events from a device and return the (keycode, value, us) of the key events.
+    The device must expose either readinto(buffer) or a non-blocking fd.
+    """
+    _buffer: bytearray
+    _view: memoryview
+    _readinto: Callable[[memoryview], int]
+
+    # Number of events (of any type) returned by the last read
+    events: int
+
+    def __init__(self, device, capacity: int = READ_BATCH):
+        self._buffer = bytearray(INPUT_EVENT.size * capacity)
+        self._view = memoryview(self._buffer)
+
+        readinto = getattr(device, "readinto", None)
+        if readinto is None:
+            fd = device.fd
+
+            def readinto(buffer: memoryview) -> int:
+                return os.readv(fd, [buffer])
+        self._readinto = readinto
+        self.events = 0
+
+    def read_key_events(self) -> list[tuple[int, int, int]]:
+        """
+        Read the pending events and return the (keycode, value, us) of the key events, in order.
+        Raises BlockingIOError if there are no pending events, OSError if the device
+        has disconnected (same as evdev).
+        """
+        size = self._readinto(self._view)
+        if size <= 0:
+            # EOF, the device is gone
+            raise OSError("Device closed")
+
+        self.events = size // INPUT_EVENT.size
+        return decode_key_events(self._view[:self.events * INPUT_EVENT.size])
+
+def decode_key_events(data: memoryview) -> list[tuple[int, int, int]]:
+    """
+    Return the (keycode, value, us) of the key events in a buffer of raw input events,
+    us is the kernel timestamp of the event (µs since the epoch)
+    """
+    words = data.cast("H")
+    dwords = data.cast("i")
+    longs = data.cast("l")
+
+    return [
+        (code, value, sec * 1000000 + usec) for (event_type, code, value, sec, usec) in zip(
+            words[_TYPE_INDEX::_WORDS], words[_TYPE_INDEX + 1::_WORDS], dwords[_VALUE_INDEX::_DWORDS],
+            longs[0::_LONGS], longs[1::_LONGS]
+        )
+        if event_type == EV_KEY
+    ]
@@ -15,13 +15,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-from datetime import datetime
-import json
-import re
 from interception_py import interception
-from interception_util import get_device_handle, regex_device_filter
-from .device_reader import DeviceReader
-from .keycodes import code_to_char
+from interception_util import get_device_handle, regex_device_filter, wait_stroke
+from .device_reader import DEVICE_CONNECTS, DEVICE_DISCONNECTS, DeviceReader
+from .keycodes import KeyDecoder, scancode_to_key_event
+from .scan_assembler import ScanAssembler
 
 class InterceptionDeviceReader(DeviceReader):
     """Device reader using the interception driver (Windows only)"""
@@ -34,8 +32,9 @@ class InterceptionDeviceReader(DeviceReader):
         # disconnected and reconnected again
         handle = None
 
-        # Keep a buffer of the device data
-        buffer = ""
+        # Decode the key strokes into chars and assemble them into full scans
+        decoder = KeyDecoder(self._config.layout, self._config.id)
+        assembler = ScanAssembler(self._config, self._queue)
 
         while self._run:
             # Get the current device handle and check if its different from
@@ -49,11 +48,14 @@ class InterceptionDeviceReader(DeviceReader):
                         "Device disconnected",
                         extra={ 'component': 'READER' }
                     )
+                    DEVICE_DISCONNECTS.labels(self._config.id).inc()
                 else:
                     self._logger.info(
                         "Device re/connected",
                         extra={ 'component': 'READER' }
                     )
+                    DEVICE_CONNECTS.labels(self._config.id).inc()
+                    decoder.reset()
 
                     # Add a filter to capture data from the new device
                     c.set_filter(
@@ -62,7 +64,7 @@ class InterceptionDeviceReader(DeviceReader):
                     )
 
             # Try to get data from the intercepted device
-            device = c.wait(self._polling_ms)
+            device = wait_stroke(c, self._polling_ms, lambda: self._run)
             if device < 0:
                 # No data, poll again
                 continue
@@ -70,20 +72,8 @@ class InterceptionDeviceReader(DeviceReader):
             stroke = c.receive(device)
 
             # Every event is intercepted from the target device, only interesting
-            # one is the KEY_DOWN event
+            # ones are the key strokes (key up events update the modifiers state)
             if not isinstance(stroke, interception.key_stroke):
                 continue
-            if stroke.state != interception.interception_key_state.INTERCEPTION_KEY_DOWN.value:
-                continue
-
-            buffer += code_to_char(stroke.code)
 
-            # Check if the string is a full scan
-            if re.match(self._config.full_scan_regex, buffer):
-                ts = int(datetime.now().timestamp())
-                self._queue.put((self._config.id, buffer, ts))
-                self._logger.info(
-                    "Read scan: %s", json.dumps({'code': buffer}),
-                    extra={ 'component': f"READER:{self._config.id}" }
-                )
-                buffer = ""
+            assembler.feed(decoder.decode((scancode_to_key_event(stroke.code, stroke.state),)))
@@ -15,13 +15,13 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-from datetime import datetime
-import json
 import re
 from interception_py import interception
-from interception_util import get_device_handle, regex_device_filter
-from .keycodes import code_to_char
+from interception_util import get_device_handle, regex_device_filter, wait_stroke
+from .device_reader import DEVICE_CONNECTS, DEVICE_DISCONNECTS
+from .keycodes import KeyDecoder, scancode_to_key_event
 from .multidevice_reader import MultiDeviceReader
+from .scan_assembler import ScanAssembler
 
 class InterceptionMultiDeviceReader(MultiDeviceReader):
     def device_handle_to_device_index(self, _interception: interception.interception, handle: int):
@@ -39,8 +39,9 @@ class InterceptionMultiDeviceReader(MultiDeviceReader):
         # disconnected and reconnected again
         handles = [None for _ in self._configs]
 
-        # Keep a buffer of the device data
-        buffers = ["" for _ in self._configs]
+        # Decode the key strokes of each device into chars and assemble them into full scans
+        decoders = [KeyDecoder(config.layout, config.id) for config in self._configs]
+        assemblers = [ScanAssembler(config, self._queue) for config in self._configs]
 
         while self._run:
             for i, config in enumerate(self._configs):
@@ -57,11 +58,14 @@ class InterceptionMultiDeviceReader(MultiDeviceReader):
                         "Device disconnected",
                         extra={ 'component': f"READER:{config.id}" }
                     )
+                    DEVICE_DISCONNECTS.labels(config.id).inc()
                 else:
                     self._logger.info(
                         "Device re/connected",
                         extra={ 'component': f"READER:{config.id}" }
                     )
+                    DEVICE_CONNECTS.labels(config.id).inc()
+                    decoders[i].reset()
 
                     # Add a filter to capture data from the new device
                     c.set_filter(
@@ -70,7 +74,7 @@ class InterceptionMultiDeviceReader(MultiDeviceReader):
                     )
 
             # Try to get data from the intercepted device
-            device = c.wait(self._polling_ms)
+            device = wait_stroke(c, self._polling_ms, lambda: self._run)
             if device < 0:
                 # No data, poll again
                 continue
@@ -78,24 +82,13 @@ class InterceptionMultiDeviceReader(MultiDeviceReader):
             stroke = c.receive(device)
 
             # Every event is intercepted from the target device, only interesting
-            # one is the KEY_DOWN event
+            # ones are the key strokes (key up events update the modifiers state)
             if not isinstance(stroke, interception.key_stroke):
                 continue
-            if stroke.state != interception.interception_key_state.INTERCEPTION_KEY_DOWN.value:
-                continue
 
             index = self.device_handle_to_device_index(c, device)
             if index < 0:
                 continue
 
-            buffers[index] += code_to_char(stroke.code)
-
-            # Check if the string is a full scan
-            if re.match(self._configs[index].full_scan_regex, buffers[index]):
-                ts = int(datetime.now().timestamp())
-                self._queue.put((self._configs[index].id, buffers[index], ts))
-                self._logger.info(
-                    "Read scan: %s", json.dumps({'code': buffers[index]}),
-                    extra={ 'component': f"READER:{self._configs[index].id}" }
-                )
-                buffers[index] = ""
+            key_event = scancode_to_key_event(stroke.code, stroke.state)
+            assemblers[index].feed(decoders[index].decode((key_event,)))
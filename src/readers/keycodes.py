@@ -15,10 +15,19 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-# This is a mapping from keyboard keycodes to the corresponding characters
-# This map can be expanded with other characters if needed.
-# Also no distinction between lower case and upper case characters has been
-# implemented, because not needed for my usage.
+from logging import getLogger
+from typing import Iterable, Optional
+
+from metrics.registry import REGISTRY
+
+UNMAPPED_KEYS = REGISTRY.counter(
+    "barcode_relay_unmapped_keys_total", "Key presses without a character in the layout, by device",
+    ["device"])
+
+# This is the original mapping from keyboard keycodes to upper case characters,
+# still used by code_to_char.
+# The readers decode the keys with KeyDecoder (below) instead, which has a table
+# for every layout and modifiers state (Shift, CapsLock, AltGr).
 
 charMap = {
     2: "1",
@@ -68,3 +77,232 @@ def code_to_char(code):
         return charMap[code]
 
     return ""
+
+# Linux input keycodes (the interception scan codes are translated to these)
+KEY_RESERVED = 0
+KEY_TAB = 15
+KEY_ENTER = 28
+KEY_LEFTCTRL = 29
+KEY_LEFTSHIFT = 42
+KEY_RIGHTSHIFT = 54
+KEY_LEFTALT = 56
+KEY_SPACE = 57
+KEY_CAPSLOCK = 58
+KEY_NUMLOCK = 69
+KEY_SCROLLLOCK = 70
+KEY_KPENTER = 96
+KEY_RIGHTCTRL = 97
+KEY_KPSLASH = 98
+KEY_RIGHTALT = 100
+KEY_LEFTMETA = 125
+KEY_RIGHTMETA = 126
+
+# Size of the decoding tables, keyboards do not send higher keycodes for printable keys
+TABLE_SIZE = 256
+
+# Key values of the input events
+KEY_UP = 0
+KEY_DOWN = 1
+
+# Modifier state bits, also the index of the decoding table for the state
+SHIFT = 1
+CAPSLOCK = 2
+ALTGR = 4
+
+# Kind of every key, modifiers update the state, ignored keys are not decoded (nor counted)
+_KEY_CHAR = 0
+_KEY_SHIFT = 1
+_KEY_ALTGR = 2
+_KEY_CAPSLOCK = 3
+_KEY_IGNORED = 4
+
+_KEY_KINDS = [_KEY_CHAR] * TABLE_SIZE
+_KEY_KINDS[KEY_RESERVED] = _KEY_IGNORED
+_KEY_KINDS[KEY_LEFTSHIFT] = _KEY_SHIFT
+_KEY_KINDS[KEY_RIGHTSHIFT] = _KEY_SHIFT
+_KEY_KINDS[KEY_RIGHTALT] = _KEY_ALTGR
+_KEY_KINDS[KEY_CAPSLOCK] = _KEY_CAPSLOCK
+for _code in (KEY_LEFTCTRL, KEY_RIGHTCTRL, KEY_LEFTALT, KEY_LEFTMETA, KEY_RIGHTMETA,
+              KEY_NUMLOCK, KEY_SCROLLLOCK):
+    _KEY_KINDS[_code] = _KEY_IGNORED
+
+# Letters, by keycode, in the QWERTY rows
+_LETTER_ROWS = ((16, "qwertyuiop"), (30, "asdfghjkl"), (44, "zxcvbnm"))
+
+# Keys producing the same character in every layout and modifiers state
+# (numpad keys assume NumLock on, as scanners send them)
+_COMMON_KEYS = {
+    KEY_TAB: "\t", KEY_ENTER: "\n", KEY_SPACE: " ", KEY_KPENTER: "\n", KEY_KPSLASH: "/",
+    55: "*", 74: "-", 78: "+", 83: ".",
+    71: "7", 72: "8", 73: "9", 75: "4", 76: "5", 77: "6", 79: "1", 80: "2", 81: "3", 82: "0",
+}
+
+# Keyboard layouts: keycode -> (base, shift) characters, and keycode -> (altgr, altgr + shift)
+# characters ("" if the key has no character in that layer). Letters are added to every layout.
+LAYOUTS = {
+    'us': (
+        {
+            2: "1!", 3: "2@", 4: "3#", 5: "4$", 6: "5%", 7: "6^", 8: "7&", 9: "8*", 10: "9(",
+            11: "0)", 12: "-_", 13: "=+", 26: "[{", 27: "]}", 39: ";:", 40: "'\"", 41: "`~",
+            43: "\\|", 51: ",<", 52: ".>", 53: "/?", 86: "\\|",
+        },
+        {},
+    ),
+    'it': (
+        {
+            2: "1!", 3: "2\"", 4: "3£", 5: "4$", 6: "5%", 7: "6&", 8: "7/", 9: "8(", 10: "9)",
+            11: "0=", 12: "'?", 13: "ì^", 26: "èé", 27: "+*", 39: "òç", 40: "à°", 41: "\\|",
+            43: "ù§", 51: ",;", 52: ".:", 53: "-_", 86: "<>",
+        },
+        {
+            18: "€", 26: "[{", 27: "]}", 39: "@", 40: "#",
+        },
+    ),
+}
+
+def _build_tables(layout: str) -> list[list[Optional[str]]]:
+    """
+    Return the decoding tables of the layout, one for each modifiers state
+    (SHIFT | CAPSLOCK | ALTGR bits), indexed by keycode
+    """
+    (keys, altgr_keys) = LAYOUTS[layout]
+    keys = dict(keys)
+    for (first_code, letters) in _LETTER_ROWS:
+        for (offset, letter) in enumerate(letters):
+            keys[first_code + offset] = letter + letter.upper()
+
+    tables = [[None] * TABLE_SIZE for _ in range(8)]
+    for (code, chars) in keys.items():
+        (base, shifted) = chars
+        # CapsLock only affects the keys with a lower / upper case pair
+        caps = base.upper() == shifted and base != shifted
+        tables[0][code] = base
+        tables[SHIFT][code] = shifted
+        tables[CAPSLOCK][code] = shifted if caps else base
+        tables[SHIFT | CAPSLOCK][code] = base if caps else shifted
+
+    for (code, chars) in altgr_keys.items():
+        (base, shifted) = (chars[0], chars[1:] or None)
+        for state in (ALTGR, ALTGR | CAPSLOCK):
+            tables[state][code] = base
+            tables[state | SHIFT][code] = shifted
+
+    if not altgr_keys:
+        # Right Alt is just Alt in the layout, it doesn't change the characters
+        for state in (0, SHIFT, CAPSLOCK, SHIFT | CAPSLOCK):
+            tables[state | ALTGR] = list(tables[state])
+
+    for table in tables:
+        for (code, char) in _COMMON_KEYS.items():
+            table[code] = char
+
+    return tables
+
+_TABLES = { layout: _build_tables(layout) for layout in LAYOUTS }
+
+# Interception key stroke state bits
+INTERCEPTION_KEY_UP = 0x01
+INTERCEPTION_KEY_E0 = 0x02
+
+# Extended (E0 prefixed) scan codes -> keycodes, other extended keys (navigation keys,
+# fake shifts) are not needed to decode the scans
+_E0_KEYCODES = {
+    28: KEY_KPENTER, 29: KEY_RIGHTCTRL, 53: KEY_KPSLASH, 56: KEY_RIGHTALT,
+    91: KEY_LEFTMETA, 92: KEY_RIGHTMETA,
+}
+
+def scancode_to_key_event(code: int, state: int, us: int = 0) -> tuple[int, int, int]:
+    """
+    Convert an interception key stroke (set 1 scan code and state) to a (keycode, value, us)
+    key event. Set 1 scan codes are the same as the Linux keycodes, except the extended ones.
+    """
+    if state & INTERCEPTION_KEY_E0:
+        code = _E0_KEYCODES.get(code, KEY_RESERVED)
+
+    return (code, KEY_UP if state & INTERCEPTION_KEY_UP else KEY_DOWN, us)
+
+class KeyDecoder:
+    """
+    Decode key events into characters, with a flat table (indexed by keycode) for each
+    modifiers state of the layout. Tracks Shift / CapsLock / AltGr state, one instance per device.
+    """
+    _device: str
+    _tables: list[list[Optional[str]]]
+    _table: list[Optional[str]]
+
+    # Pressed shift keys (left and right are tracked separately)
+    _shift: set[int]
+    _capslock: bool
+    _altgr: bool
+
+    def __init__(self, layout: str = "us", device: str = ""):
+        self._logger = getLogger()
+        self._device = device
+        self._tables = _TABLES[layout]
+        self._unmapped = UNMAPPED_KEYS.labels(device)
+        self.reset()
+
+    def reset(self):
+        """Release every modifier (e.g. after the device reconnects)"""
+        self._shift = set()
+        self._capslock = False
+        self._altgr = False
+        self._table = self._tables[0]
+
+    @property
+    def state(self) -> int:
+        """Current modifiers state (SHIFT | CAPSLOCK | ALTGR bits)"""
+        return (SHIFT if self._shift else 0) | (CAPSLOCK if self._capslock else 0) \
+            | (ALTGR if self._altgr else 0)
+
+    def decode(
+        self,
+        key_events: Iterable[tuple[int, int, int]],
+        stamps: Optional[list[int]] = None
+    ) -> list[str]:
+        """
+        Decode a batch of (keycode, value, us) key events, value is KEY_DOWN, KEY_UP or
+        autorepeat (ignored), us the kernel timestamp of the event (0 if not available).
+        Returns the characters of the key down events, in order; if stamps is given the
+        timestamp of every returned character is appended to it.
+        """
+        chars = []
+        table = self._table
+        kinds = _KEY_KINDS
+        unmapped = 0
+
+        for (code, value, us) in key_events:
+            kind = kinds[code] if code < TABLE_SIZE else _KEY_CHAR
+            if kind == _KEY_CHAR:
+                if value != KEY_DOWN:
+                    continue
+                char = table[code] if code < TABLE_SIZE else None
+                if char:
+                    chars.append(char)
+                    if stamps is not None:
+                        stamps.append(us)
+                else:
+                    unmapped += 1
+                    self._logger.debug(
+                        "Unmapped key %d (modifiers %d)", code, self.state,
+                        extra={ 'component': f"READER:{self._device}" }
+                    )
+                continue
+
+            if kind == _KEY_IGNORED or value not in (KEY_DOWN, KEY_UP):
+                continue
+            if kind == _KEY_SHIFT:
+                if value == KEY_DOWN:
+                    self._shift.add(code)
+                else:
+                    self._shift.discard(code)
+            elif kind == _KEY_ALTGR:
+                self._altgr = value == KEY_DOWN
+            elif value == KEY_DOWN:
+                self._capslock = not self._capslock
+            table = self._table = self._tables[self.state]
+
+        if unmapped:
+            self._unmapped.inc(unmapped)
+
+        return chars
@@ -17,8 +17,8 @@
 
 from logging import Logger, getLogger
 from queue import Queue
-from threading import Thread
-from typing import List
+from threading import Event, Thread
+from typing import List, Optional
 
 from config import DeviceConfig
 
@@ -28,6 +28,8 @@ class MultiDeviceReader:
     _logger: Logger
     _run: bool
     _thread: Thread
+    # Set when stopping, idle waits use it to wake up immediately
+    _stop_event: Event
     _queue: Queue
 
     _configs: List[DeviceConfig]
@@ -37,6 +39,7 @@ class MultiDeviceReader:
         self._logger = getLogger()
         self._run = False
         self._thread = None
+        self._stop_event = Event()
 
         self._configs = configs
         self._queue = queue
@@ -49,12 +52,21 @@ class MultiDeviceReader:
             extra={ 'component': 'READER:multiple' }
         )
         self._run = True
+        self._stop_event.clear()
         self._thread = Thread(target=self.run)
         self._thread.start()
 
     def run(self):
         """Actual reader working function"""
 
+    def connected_devices(self) -> Optional[int]:
+        """Number of devices currently connected (grabbed), None if not known"""
+        return None
+
+    def is_alive(self) -> bool:
+        """True if the reader thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
     def stop(self):
         """Stop the reader thread"""
         self._logger.info(
@@ -62,5 +74,6 @@ class MultiDeviceReader:
             extra={ 'component': 'READER:multiple' }
         )
         self._run = False
+        self._stop_event.set()
         if self._thread:
             self._thread.join()
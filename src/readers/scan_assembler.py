@@ -0,0 +1,223 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from datetime import datetime
+from itertools import repeat
+import json
+from logging import Logger, getLogger
+from queue import Queue
+import re
+from time import monotonic_ns
+from typing import Iterable, Optional, Sequence
+
+from config import DeviceConfig
+from metrics.registry import REGISTRY, CounterValue
+from scan import Scan
+from .dedup_cache import DedupCache
+
+KEYSTROKES = REGISTRY.counter(
+    "barcode_relay_keystrokes_total", "Keystrokes decoded, by device", ["device"])
+SCANS = REGISTRY.counter(
+    "barcode_relay_scans_total", "Scans assembled, by device", ["device"])
+SUPPRESSED_SCANS = REGISTRY.counter(
+    "barcode_relay_suppressed_scans_total",
+    "Duplicate scans dropped within the device dedup window, by device", ["device"])
+
+# Matches the patterns that just wait for a terminator character, like the default ".*?\n"
+TERMINATOR_REGEX = re.compile(r"^\.\*\??(?:\\(?P<escaped>.)|(?P<literal>[^\\.^$*+?()\[\]{}|]))$", re.S)
+ESCAPES = { 'n': "\n", 'r': "\r", 't': "\t" }
+
+def terminator_of(full_scan_regex: str) -> Optional[str]:
+    """
+    Return the terminator character if the pattern is a plain ".*?<char>" (or ".*<char>"),
+    None otherwise.
+    """
+    match = TERMINATOR_REGEX.match(full_scan_regex)
+    if match is None:
+        return None
+
+    if match.group('literal') is not None:
+        return match.group('literal')
+
+    escaped = match.group('escaped')
+    if escaped in ESCAPES:
+        return ESCAPES[escaped]
+    if escaped.isalnum():
+        # Character classes (\d, \w, ...) and other special sequences
+        return None
+    return escaped
+
+class ScanAssembler:
+    """
+    Assemble the characters read from a device into full scans, enqueueing every scan
+    that matches the device full_scan_regex.
+    The pattern is compiled once and, if it just waits for a terminator character
+    (like the default ".*?\\n"), only the last character is checked instead of
+    matching the whole buffer after every keystroke.
+    Scans carry the kernel timestamps of their first keystroke and of their terminator
+    keystroke and the monotonic time they were decoded and enqueued.
+    When the device has a dedup window, repeated scans of the same code within the
+    window are counted and dropped instead of being enqueued.
+    """
+    _logger: Logger
+    _config: DeviceConfig
+    _queue: Queue
+
+    _pattern: re.Pattern
+    _terminator: Optional[str]
+
+    # Characters of the scan currently being read
+    # (kept as text for generic patterns, which need to match the whole scan anyway)
+    _buffer: list[str]
+    _text: str
+
+    # Keep track of newlines in the buffer, '.' does not match them so the
+    # fast path can't be used for other terminators
+    _has_newline: bool
+
+    # Kernel timestamps of the first and last (terminator) keystroke of the current scan,
+    # decoding time (monotonic) of the current batch
+    _first_us: int
+    _last_us: int
+    _decoded_ns: int
+
+    _dedup: Optional[DedupCache]
+
+    _keystrokes: CounterValue
+    _scans: CounterValue
+    _suppressed: CounterValue
+
+    def __init__(self, config: DeviceConfig, queue: Queue) -> None:
+        self._logger = getLogger()
+        self._config = config
+        self._queue = queue
+
+        self._pattern = re.compile(config.full_scan_regex)
+        self._terminator = terminator_of(config.full_scan_regex)
+
+        self._buffer = []
+        self._text = ""
+        self._has_newline = False
+
+        self._first_us = 0
+        self._last_us = 0
+        self._decoded_ns = 0
+
+        self._dedup = None
+        if config.dedup_window_ms > 0:
+            self._dedup = DedupCache(config.dedup_window_ms, config.dedup_capacity)
+
+        self._keystrokes = KEYSTROKES.labels(config.id)
+        self._scans = SCANS.labels(config.id)
+        self._suppressed = SUPPRESSED_SCANS.labels(config.id)
+
+    @property
+    def pending(self) -> str:
+        """Characters read since the last full scan"""
+        return "".join(self._buffer) if self._terminator is not None else self._text
+
+    def reset(self):
+        """Discard the characters read since the last full scan"""
+        self._buffer.clear()
+        self._text = ""
+        self._has_newline = False
+
+    def feed(self, chars: Iterable[str], stamps: Optional[Sequence[int]] = None) -> int:
+        """
+        Append a batch of decoded characters (None or empty values are skipped),
+        enqueueing every full scan. stamps are the kernel timestamps (µs since the epoch)
+        of every character, if available.
+        Returns the number of characters appended.
+        """
+        self._decoded_ns = monotonic_ns()
+        events = zip(chars, stamps if stamps else repeat(0))
+
+        if self._terminator is None:
+            return self._feed_pattern(events)
+
+        buffer = self._buffer
+        terminator = self._terminator
+        count = 0
+
+        for (char, us) in events:
+            if not char:
+                continue
+
+            if not buffer:
+                self._first_us = us
+            buffer.append(char)
+            count += 1
+
+            if char == "\n":
+                self._has_newline = True
+
+            if char != terminator:
+                continue
+
+            self._last_us = us
+            if terminator == "\n" or not self._has_newline:
+                self._emit("".join(buffer))
+            elif self._pattern.match("".join(buffer)):
+                self._emit("".join(buffer))
+
+        self._keystrokes.inc(count)
+        return count
+
+    def _feed_pattern(self, events: Iterable[tuple[str, int]]) -> int:
+        """Generic path, match the whole pending text against the pattern after every character"""
+        pattern = self._pattern
+        text = self._text
+        count = 0
+
+        for (char, us) in events:
+            if not char:
+                continue
+
+            if not text:
+                self._first_us = us
+            text += char
+            count += 1
+
+            if pattern.match(text):
+                self._last_us = us
+                self._emit(text)
+                text = ""
+
+        self._text = text
+        self._keystrokes.inc(count)
+        return count
+
+    def _emit(self, code: str):
+        self.reset()
+        self._scans.inc()
+
+        if self._dedup is not None and self._dedup.seen(code):
+            self._suppressed.inc()
+            self._logger.info(
+                "Suppressed duplicate scan: %s", json.dumps({'code': code}),
+                extra={ 'component': f"READER:{self._config.id}" }
+            )
+            return
+
+        ts = int(datetime.now().timestamp())
+        self._queue.put(Scan(
+            self._config.id, code, ts,
+            self._first_us, self._last_us, self._decoded_ns, monotonic_ns()))
+        self._logger.info(
+            "Read scan: %s", json.dumps({'code': code}),
+            extra={ 'component': f"READER:{self._config.id}" }
+        )
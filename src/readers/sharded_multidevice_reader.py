@@ -0,0 +1,300 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import multiprocessing
+import os
+from multiprocessing.connection import Connection, wait
+from queue import Empty
+import signal
+from time import monotonic
+from typing import Callable, List, Optional
+
+from config import DeviceConfig, ReaderConfig
+from metrics.registry import REGISTRY
+from queues.shm_ring_buffer import ShmRingBuffer, ShmRingQueue
+from .multidevice_reader import MultiDeviceReader
+
+WORKER_RESTARTS = REGISTRY.counter(
+    "barcode_relay_reader_worker_restarts_total", "Reader worker processes restarted, by worker",
+    ["worker"])
+
+# Restart delay of a crashed worker, doubled on every crash up to the max,
+# reset once the worker has been running for STABLE_S
+RESTART_DELAY_S = 1.0
+MAX_RESTART_DELAY_S = 30.0
+STABLE_S = 30.0
+
+# Time given to the workers to stop before killing them
+STOP_TIMEOUT_S = 5.0
+
+def run_worker(
+    configs: List[DeviceConfig],
+    reader_config: ReaderConfig,
+    ring_name: str,
+    control: Connection,
+    initializer: Optional[Callable[[], None]],
+    connected=None,
+    doorbell: Optional[Connection] = None
+):
+    """
+    Worker process: run a reader for the given devices, writing the scans in the ring buffer
+    (and ringing the doorbell when the buffer was empty), until the control pipe is closed
+    (or written to) by the parent.
+    The number of connected devices is published in the shared connected value, if any.
+    """
+    #pylint: disable=import-outside-toplevel
+    from readers.evdev_device_discovery import EvdevDeviceDiscovery
+    from readers.evdev_multidevice_reader import EvdevMultiDeviceReader
+    from readers.evdev_selector_multidevice_reader import EvdevSelectorMultiDeviceReader
+    #pylint: enable=import-outside-toplevel
+
+    # The parent process handles the interrupt / termination and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if initializer is not None:
+        initializer()
+
+    queue = ShmRingQueue(
+        ShmRingBuffer(name=ring_name), [config.id for config in configs], doorbell)
+
+    discovery = None
+    if reader_config.hotplug:
+        discovery = EvdevDeviceDiscovery(reader_config.polling_ms)
+
+    reader_class = EvdevMultiDeviceReader
+    if reader_config.type == 'selector':
+        reader_class = EvdevSelectorMultiDeviceReader
+    reader = reader_class(
+        configs, queue, reader_config.polling_ms, discovery,
+        raw_events=reader_config.raw_events, event_mask=reader_config.event_mask)
+
+    if discovery is not None:
+        discovery.start()
+    reader.start()
+
+    # Exit when asked to (or the parent is gone) and if the reader dies (restarted by the parent)
+    while not control.poll(1.0):
+        if not reader.is_alive():
+            break
+        if connected is not None:
+            connected.value = reader.connected_devices()
+
+    reader.stop()
+    if discovery is not None:
+        discovery.stop()
+    queue.close()
+    control.close()
+
+class ReaderWorker:
+    """State of a worker process, as seen by the parent"""
+    index: int
+    configs: List[DeviceConfig]
+    # Scans written by the worker, kept across restarts
+    queue: ShmRingQueue
+    process: Optional[multiprocessing.Process]
+    control: Optional[Connection]
+    # Readable when the worker pushes into its empty ring buffer
+    doorbell: Optional[Connection]
+    # Devices connected in the worker (shared memory, updated every second)
+    connected = None
+    started_at: float
+    restart_at: float
+    restart_delay_s: float
+
+    def __init__(self, index: int, configs: List[DeviceConfig], connected):
+        self.index = index
+        self.configs = configs
+        self.queue = ShmRingQueue(ShmRingBuffer(), [config.id for config in configs])
+        self.connected = connected
+        self.process = None
+        self.control = None
+        self.doorbell = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.restart_delay_s = RESTART_DELAY_S
+
+class ShardedMultiDeviceReader(MultiDeviceReader):
+    """
+    Multi device reader splitting the devices across worker processes (Linux).
+    Every worker runs its own evdev reader and writes the scans in a shared memory ring buffer,
+    this process moves them to the queue of the sender. Crashed workers are restarted.
+    """
+    _reader_config: ReaderConfig
+    _initializer: Optional[Callable[[], None]]
+    _workers: List[ReaderWorker]
+
+    def __init__(
+        self,
+        configs: List[DeviceConfig],
+        queue,
+        reader_config: ReaderConfig,
+        processes: int,
+        initializer: Optional[Callable[[], None]] = None
+    ) -> None:
+        super().__init__(configs, queue, reader_config.polling_ms)
+        self._reader_config = reader_config
+        self._initializer = initializer
+
+        # Spawn (instead of fork) the workers, this process already runs other threads
+        self._context = multiprocessing.get_context("spawn")
+
+        # Round robin split of the devices, never start empty workers
+        processes = max(1, min(processes, len(configs)))
+        self._workers = [
+            ReaderWorker(index, configs[index::processes], self._context.RawValue('i', 0))
+            for index in range(processes)
+        ]
+
+    def start(self):
+        for worker in self._workers:
+            self._start_worker(worker)
+        super().start()
+
+    def _start_worker(self, worker: ReaderWorker):
+        (control_receiver, control_sender) = self._context.Pipe(duplex=False)
+        (doorbell_receiver, doorbell_sender) = self._context.Pipe(duplex=False)
+        worker.process = self._context.Process(
+            target=run_worker,
+            args=(
+                worker.configs, self._reader_config, worker.queue.ring.name, control_receiver,
+                self._initializer, worker.connected, doorbell_sender
+            ),
+            name=f"reader-{worker.index}",
+            daemon=True
+        )
+        worker.process.start()
+        # Only used by the worker
+        control_receiver.close()
+        doorbell_sender.close()
+
+        worker.control = control_sender
+        worker.doorbell = doorbell_receiver
+        worker.started_at = monotonic()
+        self._logger.info(
+            "Started worker %s (pid %s) for devices %s",
+            worker.index, worker.process.pid, ", ".join(config.id for config in worker.configs),
+            extra={ 'component': 'READER:multiple' }
+        )
+
+    def _forward(self, worker: ReaderWorker) -> int:
+        """Move the pending scans of the worker to the queue, returns their number"""
+        count = 0
+        while True:
+            try:
+                item = worker.queue.get_nowait()
+            except Empty:
+                return count
+            self._queue.put(item)
+            count += 1
+
+    def _drain_doorbell(self, worker: ReaderWorker):
+        """Consume the pending rings, before forwarding (a later push rings again)"""
+        try:
+            # The rings carry no data, read them in bulk instead of message by message
+            while worker.doorbell.poll():
+                if not os.read(worker.doorbell.fileno(), 65536):
+                    break
+        except (EOFError, OSError):
+            # The worker is gone, its sentinel is ready as well
+            pass
+
+    def _on_exit(self, worker: ReaderWorker):
+        """The worker has exited, collect its last scans and schedule the restart"""
+        worker.process.join()
+        self._forward(worker)
+        worker.control.close()
+        worker.control = None
+        worker.doorbell.close()
+        worker.doorbell = None
+        worker.connected.value = 0
+
+        self._logger.error(
+            "Worker %s exited (code %s), restarting in %ss",
+            worker.index, worker.process.exitcode, worker.restart_delay_s,
+            extra={ 'component': 'READER:multiple' }
+        )
+        if monotonic() - worker.started_at >= STABLE_S:
+            worker.restart_delay_s = RESTART_DELAY_S
+        worker.restart_at = monotonic() + worker.restart_delay_s
+        worker.restart_delay_s = min(worker.restart_delay_s * 2, MAX_RESTART_DELAY_S)
+        worker.process = None
+
+    def connected_devices(self) -> int:
+        return sum(worker.connected.value for worker in self._workers)
+
+    def run(self):
+        # Block until a worker rings its doorbell (it pushed a scan) or exits.
+        # Every polling_ms all the buffers are checked anyway, even while other
+        # workers keep waking the supervisor up
+        last_sweep = monotonic()
+        while self._run:
+            timeout = self._polling_ms / 1000.0
+            restarts = [worker.restart_at for worker in self._workers if worker.process is None]
+            if restarts:
+                timeout = max(0.0, min(timeout, min(restarts) - monotonic()))
+
+            waiting = {}
+            for worker in self._workers:
+                if worker.process is not None:
+                    waiting[worker.doorbell] = worker
+                    waiting[worker.process.sentinel] = worker
+
+            ready = wait(list(waiting), timeout)
+            if not ready or monotonic() - last_sweep >= self._polling_ms / 1000.0:
+                last_sweep = monotonic()
+                for worker in self._workers:
+                    self._forward(worker)
+            for key in ready:
+                worker = waiting[key]
+                if key is worker.doorbell:
+                    self._drain_doorbell(worker)
+                    self._forward(worker)
+            for key in ready:
+                worker = waiting[key]
+                if worker.process is not None and key == worker.process.sentinel:
+                    self._on_exit(worker)
+
+            for worker in self._workers:
+                if self._run and worker.process is None and monotonic() >= worker.restart_at:
+                    WORKER_RESTARTS.labels(str(worker.index)).inc()
+                    self._start_worker(worker)
+
+    def stop(self):
+        # Stop supervising first, so that the stopping workers are not restarted
+        super().stop()
+        for worker in self._workers:
+            if worker.control is not None:
+                worker.control.close()
+                worker.control = None
+
+        # Keep forwarding the scans while the workers stop, they may be waiting on a full buffer
+        deadline = monotonic() + STOP_TIMEOUT_S
+        for worker in self._workers:
+            if worker.process is not None:
+                while worker.process.is_alive() and monotonic() < deadline:
+                    self._forward(worker)
+                    worker.process.join(0.01)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+                worker.process = None
+            if worker.doorbell is not None:
+                worker.doorbell.close()
+                worker.doorbell = None
+
+            self._forward(worker)
+            worker.queue.close()
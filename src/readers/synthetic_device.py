@@ -0,0 +1,311 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Synthetic evdev devices, to feed scripted or randomized event streams into the
+evdev readers without physical scanners (benchmarks, load tests).
+"""
+
+from collections import deque
+import errno
+import os
+import random
+from threading import Lock
+from time import time
+from typing import Callable, Iterable, Optional
+from evdev import InputEvent, ecodes
+from evdev.device import DeviceInfo
+
+from readers.evdev_device_discovery import ATTACH, DETACH, InputNode, find_input_node
+from readers.input_events import INPUT_EVENT
+from readers.keycodes import charMap
+
+# Events returned by a single read(), as evdev does
+READ_BATCH = 64
+
+# Character -> keycode, reversed keycodes map
+KEYCODES = { char: code for code, char in charMap.items() if char }
+
+def key_events(code: str, shift_letters: bool = True, msc_scan: bool = True,
+               timestamp: Optional[float] = None) -> list[InputEvent]:
+    """
+    Return the events a keyboard-like scanner sends to type the given code:
+    (optional) MSC_SCAN, key down, SYN_REPORT and the same for key up, with
+    left shift pressed around the letters.
+    """
+    now = time() if timestamp is None else timestamp
+    sec = int(now)
+    usec = int((now - sec) * 1000000)
+    events = []
+
+    def key(keycode: int, value: int):
+        if msc_scan:
+            events.append(InputEvent(sec, usec, ecodes.EV_MSC, ecodes.MSC_SCAN, keycode))
+        events.append(InputEvent(sec, usec, ecodes.EV_KEY, keycode, value))
+        events.append(InputEvent(sec, usec, ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    for char in code:
+        keycode = KEYCODES[char]
+        shift = shift_letters and char.isalpha()
+        if shift:
+            key(ecodes.KEY_LEFTSHIFT, 1)
+        key(keycode, 1)
+        key(keycode, 0)
+        if shift:
+            key(ecodes.KEY_LEFTSHIFT, 0)
+
+    return events
+
+def random_code(rng: random.Random, length: int = 12, alphabet: str = "0123456789ABCDEFGHIJ") -> str:
+    """Return a random code of the given length, terminated by a newline"""
+    return "".join(rng.choice(alphabet) for _ in range(length)) + "\n"
+
+class SyntheticInputDevice:
+    """
+    Stand-in for evdev.InputDevice. Injected events are returned by read(),
+    the fd becomes readable while there are pending events, so the device
+    can be used with selectors and event loops.
+    """
+    path: str
+    name: str
+    phys: str
+    info: DeviceInfo
+    fd: int
+
+    _events: deque
+    _lock: Lock
+    _signalled: bool
+    _connected: bool
+    _write_fd: int
+
+    # Event types delivered (None = all), and if an event has been queued since the
+    # last SYN_REPORT, to emulate the kernel event mask
+    _event_types: Optional[frozenset]
+    _packet: bool
+
+    def __init__(self, path: str, vid: int = 0, pid: int = 0, name: str = "Synthetic scanner"):
+        self.path = path
+        self.name = name
+        self.phys = f"synthetic/{os.path.basename(path)}"
+        self.info = DeviceInfo(0x03, vid, pid, 1)
+
+        self._events = deque()
+        self._lock = Lock()
+        self._signalled = False
+        self._connected = True
+        self._event_types = None
+        self._packet = False
+
+        self.fd, self._write_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+
+    def fileno(self) -> int:
+        """File descriptor, readable while there are pending events"""
+        return self.fd
+
+    def grab(self):
+        """No-op, as if the device was grabbed"""
+
+    def ungrab(self):
+        """No-op"""
+
+    def close(self):
+        """No-op, the pipe is kept open so that the device can be reopened"""
+
+    def set_event_mask(self, event_types: Iterable[int]) -> bool:
+        """Deliver only the given event types from now on, same as the kernel event mask"""
+        self._event_types = frozenset(event_types)
+        return True
+
+    def inject(self, events: Iterable[InputEvent]):
+        """Queue events to be returned by read()"""
+        with self._lock:
+            if self._event_types is not None:
+                events = self._mask(events)
+                if not events:
+                    # Nothing delivered, no wakeup
+                    return
+
+            self._events.extend(events)
+            if not self._signalled:
+                os.write(self._write_fd, b"\0")
+                self._signalled = True
+
+    def _mask(self, events: Iterable[InputEvent]) -> list[InputEvent]:
+        """
+        Filter the events as the kernel does with an event mask: EV_SYN events are never
+        filtered, but SYN_REPORT closing an empty packet is dropped
+        """
+        delivered = []
+        for event in events:
+            if event.type == ecodes.EV_SYN:
+                if event.code == ecodes.SYN_REPORT:
+                    if not self._packet:
+                        continue
+                    self._packet = False
+                delivered.append(event)
+            elif event.type in self._event_types:
+                delivered.append(event)
+                self._packet = True
+
+        return delivered
+
+    def disconnect(self):
+        """Simulate the device unplug, every following read() fails"""
+        with self._lock:
+            self._connected = False
+            if not self._signalled:
+                os.write(self._write_fd, b"\0")
+                self._signalled = True
+
+    @property
+    def pending(self) -> int:
+        """Number of events injected and not read yet"""
+        return len(self._events)
+
+    def read(self):
+        """
+        Read up to 64 pending events, raises BlockingIOError if there are no pending events
+        and OSError if the device has been disconnected (same as evdev)
+        """
+        with self._lock:
+            if not self._connected:
+                raise OSError(errno.ENODEV, "No such device")
+
+            count = min(READ_BATCH, len(self._events))
+            if count == 0:
+                raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+
+            events = [self._events.popleft() for _ in range(count)]
+            if not self._events:
+                os.read(self.fd, 16)
+                self._signalled = False
+
+        # evdev returns a generator
+        yield from events
+
+    def readinto(self, buffer: memoryview) -> int:
+        """
+        Write up to len(buffer) bytes of pending events in the buffer, as raw input_event
+        structs (same as reading the device node). Returns the number of bytes written,
+        raises the same errors as read()
+        """
+        with self._lock:
+            if not self._connected:
+                raise OSError(errno.ENODEV, "No such device")
+
+            count = min(len(buffer) // INPUT_EVENT.size, len(self._events))
+            if count == 0:
+                raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+
+            for offset in range(0, count * INPUT_EVENT.size, INPUT_EVENT.size):
+                event = self._events.popleft()
+                INPUT_EVENT.pack_into(
+                    buffer, offset, event.sec, event.usec, event.type, event.code, event.value)
+            if not self._events:
+                os.read(self.fd, 16)
+                self._signalled = False
+
+        return count * INPUT_EVENT.size
+
+    def destroy(self):
+        """Release the pipe"""
+        os.close(self.fd)
+        os.close(self._write_fd)
+
+class SyntheticDeviceBackend:
+    """
+    Set of synthetic devices. Provides the device factory for the evdev readers
+    (open) and the same lookup / hotplug interface as EvdevDeviceDiscovery,
+    so that the readers can find devices by vid / pid.
+    """
+    _devices: dict[str, SyntheticInputDevice]
+    _detached: list[SyntheticInputDevice]
+    _nodes: dict[str, InputNode]
+    _listeners: list[Callable[[str, InputNode], None]]
+
+    def __init__(self):
+        self._devices = {}
+        self._detached = []
+        self._nodes = {}
+        self._listeners = []
+
+    @property
+    def nodes(self) -> dict[str, InputNode]:
+        """Current index of the attached devices (path -> node)"""
+        return self._nodes
+
+    @property
+    def watching(self) -> bool:
+        """Attach / detach events are always notified"""
+        return True
+
+    @property
+    def devices(self) -> list[SyntheticInputDevice]:
+        """Attached devices"""
+        return list(self._devices.values())
+
+    def find(self, vid: int = None, pid: int = None, name: str = None,
+             phys: str = None) -> Optional[InputNode]:
+        """Return the first attached device matching all the given (not None) attributes"""
+        return find_input_node(self._nodes, vid, pid, name, phys)
+
+    def subscribe(self, listener: Callable[[str, InputNode], None]):
+        """Register a listener, called with (ATTACH|DETACH, node)"""
+        self._listeners.append(listener)
+
+    def start(self):
+        """No-op, same interface as EvdevDeviceDiscovery"""
+
+    def stop(self):
+        """Release every device"""
+        for device in list(self._devices.values()) + self._detached:
+            device.destroy()
+        self._devices = {}
+        self._detached = []
+        self._nodes = {}
+
+    def attach(self, path: str, vid: int = 0, pid: int = 0,
+               name: str = "Synthetic scanner") -> SyntheticInputDevice:
+        """Create (plug) a synthetic device"""
+        device = SyntheticInputDevice(path, vid, pid, name)
+        node = InputNode(path, vid, pid, name, device.phys)
+
+        self._devices[path] = device
+        self._nodes = {**self._nodes, path: node}
+        for listener in self._listeners:
+            listener(ATTACH, node)
+
+        return device
+
+    def detach(self, path: str):
+        """Disconnect (unplug) a synthetic device"""
+        device = self._devices.pop(path)
+        device.disconnect()
+        self._detached.append(device)
+
+        nodes = dict(self._nodes)
+        node = nodes.pop(path)
+        self._nodes = nodes
+        for listener in self._listeners:
+            listener(DETACH, node)
+
+    def open(self, path: str) -> SyntheticInputDevice:
+        """Device factory for the evdev readers"""
+        if path not in self._devices:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", path)
+        return self._devices[path]
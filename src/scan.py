@@ -0,0 +1,100 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from time import monotonic_ns, time_ns
+from typing import Iterable, NamedTuple
+
+from metrics.registry import REGISTRY
+
+STAGE_LATENCY = REGISTRY.histogram(
+    "barcode_relay_scan_stage_seconds",
+    "Time spent by the scans in each stage, from the keystrokes to the target acknowledgement",
+    ["stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+             0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+
+# Stages, in order:
+#  - keystrokes: first to last keystroke of the scan (kernel timestamps)
+#  - read: last keystroke to decoded by the reader
+#  - assemble: decoded to enqueued (pattern matching, dedup)
+#  - queue: waiting in the queue (spool, ring buffer) until taken by the sender
+#  - send: taken by the sender to acknowledged by the target (batching and retries included)
+#  - total: first keystroke to acknowledged by the target
+STAGES = ("keystrokes", "read", "assemble", "queue", "send", "total")
+_STAGE_LATENCY = { stage: STAGE_LATENCY.labels(stage) for stage in STAGES }
+
+class Scan(NamedTuple):
+    """
+    A full scan read from a device.
+    first_us and last_us are the kernel timestamps (µs since the epoch) of the first and
+    last keystroke, the *_ns fields are monotonic clock checkpoints. 0 means not available.
+    """
+    device: str
+    code: str
+    # Wall clock seconds at assembly (the 'ts' field)
+    ts: int
+    first_us: int = 0
+    last_us: int = 0
+    decoded_ns: int = 0
+    enqueued_ns: int = 0
+    dequeued_ns: int = 0
+
+def stage_times(scan: Scan) -> dict[str, int]:
+    """
+    Return the duration (ns) of the stages the scan went through before being sent,
+    skipping the stages with missing checkpoints.
+    Kernel timestamps are moved to the monotonic clock with the current offset between the two.
+    """
+    offset = time_ns() - monotonic_ns()
+    first_ns = scan.first_us * 1000 - offset if scan.first_us else 0
+    last_ns = scan.last_us * 1000 - offset if scan.last_us else 0
+
+    stages = {}
+    if first_ns and last_ns:
+        stages["keystrokes"] = last_ns - first_ns
+    if last_ns and scan.decoded_ns:
+        stages["read"] = scan.decoded_ns - last_ns
+    if scan.decoded_ns and scan.enqueued_ns:
+        stages["assemble"] = scan.enqueued_ns - scan.decoded_ns
+    if scan.enqueued_ns and scan.dequeued_ns:
+        stages["queue"] = scan.dequeued_ns - scan.enqueued_ns
+    return stages
+
+def trace_fields(scan: Scan) -> dict[str, int]:
+    """Optional stream fields: keystroke timestamps and stage latencies (µs)"""
+    fields = {}
+    if scan.first_us:
+        fields['first_us'] = scan.first_us
+        fields['last_us'] = scan.last_us
+    for (stage, duration) in stage_times(scan).items():
+        fields[f"{stage}_us"] = duration // 1000
+    return fields
+
+def observe_sent(scans: Iterable[Scan], acked_ns: int):
+    """Record the stage latencies of the scans acknowledged by the target at acked_ns (monotonic)"""
+    offset = time_ns() - monotonic_ns()
+    for scan in scans:
+        stages = stage_times(scan)
+        if scan.dequeued_ns:
+            stages["send"] = acked_ns - scan.dequeued_ns
+        if scan.first_us:
+            stages["total"] = acked_ns - (scan.first_us * 1000 - offset)
+
+        for (stage, duration) in stages.items():
+            # The kernel timestamps follow the wall clock, which may have been stepped
+            if duration >= 0:
+                _STAGE_LATENCY[stage].observe(duration / 1000000000.0)
@@ -0,0 +1,149 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+from time import monotonic, perf_counter
+from typing import Optional
+from redis.asyncio import Redis
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
+from scan import Scan, trace_fields
+from .async_sender import AsyncSender
+from .redis_stream_sender import XADD_LATENCY, XADD_RETRIES
+from .retry_policy import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RetriesExhausted, RetryPolicy
+
+class AsyncRedisStreamSender(AsyncSender):
+    """
+    Sender for Redis Stream (asyncio runtime).
+    Retries and circuit breaker work as in RedisStreamSender.
+    """
+    _redis: Redis
+    _stream_name: str
+
+    # Add the keystroke timestamps and the stage latencies to the stream entries
+    _trace: bool
+    _retry_policy: RetryPolicy
+    _breaker: Optional[CircuitBreaker]
+
+    def __init__(
+        self,
+        relay_name: str,
+        queue: asyncio.Queue,
+        redis_host: str,
+        redis_port: int,
+        redis_username: str,
+        redis_password: str,
+        redis_stream: str,
+        batch_size: int = 1,
+        batch_linger_ms: int = 0,
+        retry_policy: RetryPolicy = None,
+        breaker: CircuitBreaker = None,
+        trace: bool = False
+    ):
+        super().__init__(relay_name, queue, batch_size, batch_linger_ms)
+        self._redis = Redis(
+            host=redis_host,
+            port=redis_port,
+            username=redis_username,
+            password=redis_password,
+            decode_responses=True,
+            # Retries are up to the retry policy, as with the threaded sender
+            retry=Retry(NoBackoff(), 0)
+        )
+        self._stream_name = redis_stream
+        self._trace = trace
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._breaker = breaker
+
+    async def _send_batch(self, batch: list[Scan]):
+        attempt = 0
+        started = monotonic()
+
+        while True:
+            state = self._breaker.acquire() if self._breaker else CLOSED
+            if state == OPEN:
+                if self._retry_policy.exhausted(attempt, started):
+                    raise RetriesExhausted(f"target still unavailable after {attempt} attempts")
+                await asyncio.sleep(max(self._breaker.retry_in(), 0.001))
+                continue
+            if state == HALF_OPEN and not await self._probe():
+                # A failed probe counts as a failed attempt
+                XADD_RETRIES.inc()
+                attempt += 1
+                if self._retry_policy.exhausted(attempt, started):
+                    raise RetriesExhausted(f"target still unavailable after {attempt} attempts")
+                continue
+
+            try:
+                await self._xadd(batch)
+                if self._breaker:
+                    self._breaker.record_success()
+                return
+            except Exception as e:
+                XADD_RETRIES.inc()
+                attempt += 1
+                if self._breaker:
+                    self._breaker.record_failure()
+                if self._retry_policy.exhausted(attempt, started):
+                    raise RetriesExhausted(f"{attempt} attempts failed, last error: {e}") from e
+                if self._breaker and self._breaker.state != CLOSED:
+                    # From now on the breaker decides when to try again
+                    continue
+
+                seconds = self._retry_policy.delay(attempt)
+                self._logger.info(
+                    "Error while sending message, retry in %.2fs...", seconds,
+                    extra={ 'component': 'SENDER' }
+                )
+                self._logger.info(e)
+                await asyncio.sleep(seconds)
+
+    async def _xadd(self, batch: list[Scan]):
+        # Send the whole batch in a single round trip, the pipeline is not
+        # transactional but keeps the order of the commands
+        start = perf_counter()
+        if len(batch) == 1:
+            await self._redis.xadd(self._stream_name, self._data(batch[0]))
+        else:
+            pipeline = self._redis.pipeline(transaction=False)
+            for scan in batch:
+                pipeline.xadd(self._stream_name, self._data(scan))
+            await pipeline.execute()
+        XADD_LATENCY.observe(perf_counter() - start)
+
+    async def _probe(self) -> bool:
+        """Check if the target is reachable again (cheaper than resending the whole batch)"""
+        try:
+            await self._redis.ping()
+            self._breaker.record_success()
+            return True
+        except Exception:
+            self._breaker.record_failure()
+            return False
+
+    def _data(self, scan: Scan) -> dict:
+        data = {
+            'relay': self._relay_name, 'device': scan.device, 'code': scan.code, 'ts': scan.ts
+        }
+        if self._trace:
+            data.update(trace_fields(scan))
+        return data
+
+    async def stop(self, timeout: float = 0.0):
+        await super().stop(timeout)
+        if self._redis:
+            await self._redis.aclose()
@@ -0,0 +1,160 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+from logging import Logger, getLogger
+from time import monotonic, monotonic_ns, perf_counter, time
+import json
+
+from scan import Scan, observe_sent
+from .retry_policy import RetriesExhausted
+from .sender import BATCH_LATENCY, BATCH_SIZE, DROPPED_SCANS, LAST_SEND, SENT_SCANS, BatchStats
+
+class AsyncSender:
+    """Generic sender (asyncio runtime)"""
+    _logger: Logger
+    _task: asyncio.Task
+
+    _relay_name: str
+    _queue: asyncio.Queue
+
+    # Send up to batch_size scans at once, waiting up to batch_linger_ms
+    # for the batch to fill up
+    _batch_size: int
+    _batch_linger_ms: int
+    _stats: BatchStats
+
+    # Scans taken from the queue and not acknowledged yet
+    _in_flight: int
+
+    def __init__(
+        self,
+        relay_name: str,
+        queue: asyncio.Queue,
+        batch_size: int = 1,
+        batch_linger_ms: int = 0
+    ):
+        self._logger = getLogger()
+        self._task = None
+
+        self._relay_name = relay_name
+        self._queue = queue
+
+        self._batch_size = batch_size
+        self._batch_linger_ms = batch_linger_ms
+        self._stats = BatchStats()
+        self._in_flight = 0
+
+    @property
+    def stats(self) -> BatchStats:
+        """Statistics about the sent batches"""
+        return self._stats
+
+    def start(self):
+        """Start the working task (from the running event loop)"""
+        self._logger.info(
+            "Starting sender",
+            extra={ 'component': 'SENDER' }
+        )
+        self._task = asyncio.create_task(self.run())
+
+    async def run(self):
+        """Actual working coroutine"""
+        while True:
+            batch = await self._next_batch()
+            self._in_flight = len(batch)
+
+            for scan in batch:
+                self._logger.info(
+                    "Sending scan %s", json.dumps({'code': scan.code}),
+                    extra={ 'component': 'SENDER' }
+                )
+
+            start = perf_counter()
+            try:
+                await self._send_batch(batch)
+            except RetriesExhausted as e:
+                DROPPED_SCANS.inc(len(batch))
+                self._logger.error(
+                    "Dropped %s scans: %s", len(batch), e,
+                    extra={ 'component': 'SENDER' }
+                )
+                self._in_flight = 0
+                for _ in batch:
+                    self._queue.task_done()
+                continue
+            latency = perf_counter() - start
+            observe_sent(batch, monotonic_ns())
+            LAST_SEND.set(time())
+            self._stats.record(len(batch), latency)
+            SENT_SCANS.inc(len(batch))
+            BATCH_SIZE.observe(len(batch))
+            BATCH_LATENCY.observe(latency)
+
+            self._in_flight = 0
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _next_batch(self) -> list[Scan]:
+        """
+        Wait for the next scan, then keep draining the queue until the batch is full
+        or the linger time has expired (scans are stamped with the time they were dequeued)
+        """
+        scan = await self._queue.get()
+        batch = [scan._replace(dequeued_ns=monotonic_ns())]
+
+        deadline = monotonic() + self._batch_linger_ms / 1000.0
+        while len(batch) < self._batch_size:
+            try:
+                remaining = deadline - monotonic()
+                if remaining > 0:
+                    scan = await asyncio.wait_for(self._queue.get(), remaining)
+                else:
+                    scan = self._queue.get_nowait()
+                batch.append(scan._replace(dequeued_ns=monotonic_ns()))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+
+        return batch
+
+    async def _send_batch(self, batch: list[Scan]):
+        """
+        Send a batch of scans, in order, raises RetriesExhausted if the batch
+        has to be dropped
+        """
+
+    async def stop(self, timeout: float = 0.0):
+        """
+        Stop the working task. Within timeout seconds, the scans still in the queue
+        are sent first, then the task is cancelled and the scans not sent yet are lost.
+        """
+        self._logger.info(
+            "Stopping sender",
+            extra={ 'component': 'SENDER' }
+        )
+        if self._task:
+            if timeout > 0 and not self._task.done():
+                try:
+                    await asyncio.wait_for(self._queue.join(), timeout)
+                except asyncio.TimeoutError:
+                    self._logger.warning(
+                        "Shutdown timeout expired, dropping %s scans",
+                        self._queue.qsize() + self._in_flight,
+                        extra={ 'component': 'SENDER' }
+                    )
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
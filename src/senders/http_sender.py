@@ -0,0 +1,287 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import gzip
+import http.client
+import json
+from queue import Queue
+from time import monotonic, perf_counter
+from typing import Optional
+from urllib.parse import urlsplit
+
+from metrics.registry import REGISTRY
+from scan import Scan, trace_fields
+from .retry_policy import CLOSED, OPEN, CircuitBreaker, RetriesExhausted, RetryPolicy
+from .sender import DROPPED_SCANS, Sender
+
+HTTP_LATENCY = REGISTRY.histogram(
+    "barcode_relay_http_request_seconds", "Round trip time of a successful webhook request")
+HTTP_RESPONSES = REGISTRY.counter(
+    "barcode_relay_http_responses_total", "Webhook responses, by status code", ["status"])
+HTTP_RETRIES = REGISTRY.counter(
+    "barcode_relay_http_retries_total", "Failed webhook requests (retryable status or error)")
+
+NDJSON = "ndjson"
+JSON = "json"
+
+CONTENT_TYPES = { NDJSON: "application/x-ndjson", JSON: "application/json" }
+
+# Statuses worth retrying (the target is overloaded or temporarily unavailable),
+# any other non 2xx status means the request is rejected and its scans are dropped
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+# Errors of a keep-alive connection closed by the server while idle
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+class HttpSender(Sender):
+    """
+    Sender for HTTP webhooks: every batch is POSTed to the url as NDJSON (a scan per line)
+    or as a JSON array, split in more requests if larger than max_body_bytes, gzipped
+    if larger than gzip_min_bytes (0 = never).
+    The connection is kept alive between requests (a worker holds one connection, more
+    workers send concurrently); a keep-alive connection closed by the server while idle
+    is reopened and the request resent right away.
+    Retryable statuses (and connection errors) are retried with the backoff of the retry
+    policy (or the Retry-After of the response, if longer) while the circuit breaker is
+    closed, then the breaker decides when to try again. Any other status drops the scans
+    of that request only, the rest of the batch is still sent.
+    """
+    _scheme: str
+    _host: str
+    _port: Optional[int]
+    _path: str
+    _headers: dict[str, str]
+    _timeout_s: float
+    _connection: Optional[http.client.HTTPConnection]
+
+    _body_format: str
+    _max_body_bytes: int
+    _gzip_min_bytes: int
+    _retry_statuses: frozenset
+
+    # Add the keystroke timestamps and the stage latencies to the scans
+    _trace: bool
+
+    _retry_policy: RetryPolicy
+    _breaker: Optional[CircuitBreaker]
+
+    def __init__(
+        self,
+        relay_name: str,
+        queue: Queue,
+        url: str,
+        headers: dict[str, str] = None,
+        body_format: str = NDJSON,
+        polling_ms: int = 1000,
+        batch_size: int = 1,
+        batch_linger_ms: int = 0,
+        max_body_bytes: int = 1024 * 1024,
+        gzip_min_bytes: int = 0,
+        timeout_ms: int = 5000,
+        retry_statuses: tuple = RETRY_STATUSES,
+        retry_policy: RetryPolicy = None,
+        breaker: CircuitBreaker = None,
+        trace: bool = False
+    ):
+        super().__init__(relay_name, queue, polling_ms, batch_size, batch_linger_ms)
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"Invalid webhook url {url}")
+        if body_format not in CONTENT_TYPES:
+            raise ValueError(f"Invalid body format {body_format}")
+
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._headers = dict(headers or {})
+        self._headers['Content-Type'] = CONTENT_TYPES[body_format]
+        self._timeout_s = timeout_ms / 1000.0
+        self._connection = None
+
+        self._body_format = body_format
+        self._max_body_bytes = max_body_bytes
+        self._gzip_min_bytes = gzip_min_bytes
+        self._retry_statuses = frozenset(retry_statuses)
+        self._trace = trace
+
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._breaker = breaker
+
+    def _send(self, scan: Scan):
+        self._send_batch([scan])
+
+    def _send_batch(self, batch: list[Scan]) -> bool:
+        # If stopped halfway, the whole batch is given back (the requests already
+        # sent are sent again by the next run: delivery is at least once)
+        for (count, body, headers) in self._requests(batch):
+            status = self._post_with_retries(body, headers)
+            if status is None:
+                return False
+            if not 200 <= status < 300:
+                # The target is up, it just refuses these scans: retrying won't help
+                DROPPED_SCANS.inc(count)
+                self._logger.error(
+                    "Dropped %s scans: target rejected the request with status %s", count, status,
+                    extra={ 'component': 'SENDER' }
+                )
+        return True
+
+    def _requests(self, batch: list[Scan]) -> list[tuple[int, bytes, dict]]:
+        """Encode the batch in one or more request bodies (with their scans count and headers)"""
+        requests = []
+        items = []
+        size = 0
+        for scan in batch:
+            item = json.dumps(self._data(scan), separators=(',', ':')).encode()
+            # Each scan adds a separator (newline or comma) to the body
+            if items and size + len(item) + 1 > self._max_body_bytes:
+                requests.append(self._request(items))
+                items = []
+                size = 0
+            items.append(item)
+            size += len(item) + 1
+        if items:
+            requests.append(self._request(items))
+        return requests
+
+    def _request(self, items: list[bytes]) -> tuple[int, bytes, dict]:
+        if self._body_format == NDJSON:
+            body = b"\n".join(items) + b"\n"
+        else:
+            body = b"[" + b",".join(items) + b"]"
+
+        headers = self._headers
+        if 0 < self._gzip_min_bytes <= len(body):
+            # Fastest level: bodies are small, the latency matters more than the ratio
+            body = gzip.compress(body, compresslevel=1)
+            headers = dict(headers, **{ 'Content-Encoding': 'gzip' })
+        return (len(items), body, headers)
+
+    def _post_with_retries(self, body: bytes, headers: dict) -> Optional[int]:
+        """
+        Send a request until accepted or rejected, returns the final status (None if
+        stopped before), see class docstring
+        """
+        attempt = 0
+        started = monotonic()
+
+        while not self._stop_event.is_set():
+            # There's no cheaper probe than the request itself: when half open, the
+            # worker allowed to try sends the batch and the others keep waiting
+            state = self._breaker.acquire() if self._breaker else CLOSED
+            if state == OPEN:
+                if self._retry_policy.exhausted(attempt, started):
+                    raise RetriesExhausted(f"target still unavailable after {attempt} attempts")
+                self._breaker.wait(self._polling_ms / 1000.0)
+                continue
+
+            retry_after = 0.0
+            try:
+                (status, retry_after) = self._post(body, headers)
+                if 200 <= status < 300 or status not in self._retry_statuses:
+                    # Accepted or rejected, either way the target is up
+                    if self._breaker:
+                        self._breaker.record_success()
+                    return status
+                error = f"status {status}"
+            except (OSError, http.client.HTTPException) as e:
+                error = str(e) or type(e).__name__
+
+            HTTP_RETRIES.inc()
+            attempt += 1
+            if self._breaker:
+                self._breaker.record_failure()
+            if self._retry_policy.exhausted(attempt, started):
+                raise RetriesExhausted(f"{attempt} attempts failed, last error: {error}")
+            if self._breaker and self._breaker.state != CLOSED:
+                # From now on the breaker decides when to try again
+                continue
+
+            delay = max(self._retry_policy.delay(attempt), retry_after)
+            self._logger.info(
+                "Error while sending message (%s), retry in %.2fs...", error, delay,
+                extra={ 'component': 'SENDER' }
+            )
+            self._stop_event.wait(delay)
+
+        return None
+
+    def _post(self, body: bytes, headers: dict) -> tuple[int, float]:
+        """POST the body, returns the response status and Retry-After (seconds, 0 if none)"""
+        start = perf_counter()
+        reused = self._connection is not None
+        try:
+            response = self._request_response(body, headers)
+        except STALE_CONNECTION_ERRORS:
+            if not reused:
+                raise
+            # Closed by the server while idle, the request never made it: resend it
+            response = self._request_response(body, headers)
+
+        if response.will_close:
+            self._close()
+
+        HTTP_RESPONSES.labels(str(response.status)).inc()
+        if 200 <= response.status < 300:
+            HTTP_LATENCY.observe(perf_counter() - start)
+        return (response.status, self._retry_after(response))
+
+    def _request_response(self, body: bytes, headers: dict) -> http.client.HTTPResponse:
+        if self._connection is None:
+            connection_class = (
+                http.client.HTTPSConnection if self._scheme == 'https'
+                else http.client.HTTPConnection)
+            self._connection = connection_class(self._host, self._port, timeout=self._timeout_s)
+
+        try:
+            self._connection.request("POST", self._path, body, headers)
+            response = self._connection.getresponse()
+            # The response must be read entirely before the connection can be reused
+            response.read()
+        except Exception:
+            self._close()
+            raise
+        return response
+
+    def _retry_after(self, response: http.client.HTTPResponse) -> float:
+        """Retry-After in seconds (the HTTP date form is ignored), capped to the max backoff"""
+        value = response.getheader('Retry-After')
+        if not value or not value.strip().isdigit():
+            return 0.0
+        return min(float(value.strip()), self._retry_policy.max_ms / 1000.0)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _data(self, scan: Scan) -> dict:
+        data = {
+            'relay': self._relay_name, 'device': scan.device, 'code': scan.code, 'ts': scan.ts
+        }
+        if self._trace:
+            data.update(trace_fields(scan))
+        return data
+
+    def _wake(self):
+        if self._breaker:
+            self._breaker.wake()
+
+    def stop(self, timeout: float = 0.0):
+        super().stop(timeout)
+        self._close()
@@ -16,15 +16,36 @@
 #
 
 from queue import Queue
-from time import sleep
+from time import monotonic, perf_counter
+from typing import Optional
 from redis import Redis
+from connections.redis_connections import REDIS_CONNECTIONS, RedisConnectionManager
+from metrics.registry import REGISTRY
+from scan import Scan, trace_fields
+from .retry_policy import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, RetriesExhausted, RetryPolicy
 from .sender import Sender
 
+XADD_LATENCY = REGISTRY.histogram(
+    "barcode_relay_xadd_seconds", "Round trip time of a successful XADD (or XADD pipeline)")
+XADD_RETRIES = REGISTRY.counter(
+    "barcode_relay_xadd_retries_total", "Failed XADD (or XADD pipeline) attempts")
+
 class RedisStreamSender(Sender):
-    """Sender for Redis Stream"""
+    """
+    Sender for Redis Stream.
+    Failed batches are retried with the backoff of the retry policy; once the circuit
+    breaker (shared by the workers of the same target) opens, the target is probed
+    with a PING instead and the batch is resent as soon as the probe succeeds.
+    """
     _redis: Redis
     _stream_name: str
 
+    # Add the keystroke timestamps and the stage latencies to the stream entries
+    _trace: bool
+
+    _retry_policy: RetryPolicy
+    _breaker: Optional[CircuitBreaker]
+
     def __init__(
         self,
         relay_name: str,
@@ -34,36 +55,108 @@ class RedisStreamSender(Sender):
         redis_username: str,
         redis_password: str,
         redis_stream: str,
-        polling_ms: int = 1000
+        polling_ms: int = 1000,
+        batch_size: int = 1,
+        batch_linger_ms: int = 0,
+        connections: RedisConnectionManager = None,
+        retry_policy: RetryPolicy = None,
+        breaker: CircuitBreaker = None,
+        trace: bool = False
     ):
-        super().__init__(relay_name, queue, polling_ms)
-        self._redis = Redis(
-            host=redis_host,
-            port=redis_port,
-            username=redis_username,
-            password=redis_password,
-            decode_responses=True
-        )
+        super().__init__(relay_name, queue, polling_ms, batch_size, batch_linger_ms)
+        # Connections are pooled by endpoint and credentials, shared with the other components
+        self._redis = (connections or REDIS_CONNECTIONS).client(
+            redis_host, redis_port, redis_username, redis_password)
         self._stream_name = redis_stream
+        self._trace = trace
+
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._breaker = breaker
+
+    def _send(self, scan: Scan):
+        self._send_batch([scan])
+
+    def _send_batch(self, batch: list[Scan]) -> bool:
+        attempt = 0
+        started = monotonic()
 
-    def _send(self, device: str, code: str, ts):
-        sent = False
-        data = { 'relay': self._relay_name, 'device': device, 'code': code, 'ts': ts }
+        while not self._stop_event.is_set():
+            state = self._breaker.acquire() if self._breaker else CLOSED
+            if state == OPEN:
+                if self._retry_policy.exhausted(attempt, started):
+                    raise RetriesExhausted(f"target still unavailable after {attempt} attempts")
+                self._breaker.wait(self._polling_ms / 1000.0)
+                continue
+            if state == HALF_OPEN and not self._probe():
+                # A failed probe counts as a failed attempt
+                XADD_RETRIES.inc()
+                attempt += 1
+                if self._retry_policy.exhausted(attempt, started):
+                    raise RetriesExhausted(f"target still unavailable after {attempt} attempts")
+                continue
 
-        while self._run and not sent:
             try:
-                self._redis.xadd(self._stream_name, data)
-                sent = True
+                self._xadd(batch)
+                if self._breaker:
+                    self._breaker.record_success()
+                return True
             except Exception as e:
-                seconds = 5
+                XADD_RETRIES.inc()
+                attempt += 1
+                if self._breaker:
+                    self._breaker.record_failure()
+                if self._retry_policy.exhausted(attempt, started):
+                    raise RetriesExhausted(f"{attempt} attempts failed, last error: {e}") from e
+                if self._breaker and self._breaker.state != CLOSED:
+                    # From now on the breaker decides when to try again
+                    continue
+
+                delay = self._retry_policy.delay(attempt)
                 self._logger.info(
-                    "Error while sending message, retry in %ss...", seconds,
+                    "Error while sending message, retry in %.2fs...", delay,
                     extra={ 'component': 'SENDER' }
                 )
                 self._logger.info(e)
-                sleep(seconds)
+                self._stop_event.wait(delay)
+
+        return False
+
+    def _xadd(self, batch: list[Scan]):
+        # Send the whole batch in a single round trip, the pipeline is not
+        # transactional but keeps the order of the commands
+        start = perf_counter()
+        if len(batch) == 1:
+            self._redis.xadd(self._stream_name, self._data(batch[0]))
+        else:
+            pipeline = self._redis.pipeline(transaction=False)
+            for scan in batch:
+                pipeline.xadd(self._stream_name, self._data(scan))
+            pipeline.execute()
+        XADD_LATENCY.observe(perf_counter() - start)
+
+    def _probe(self) -> bool:
+        """Check if the target is reachable again (cheaper than resending the whole batch)"""
+        try:
+            self._redis.ping()
+            self._breaker.record_success()
+            return True
+        except Exception:
+            self._breaker.record_failure()
+            return False
+
+    def _data(self, scan: Scan) -> dict:
+        data = {
+            'relay': self._relay_name, 'device': scan.device, 'code': scan.code, 'ts': scan.ts
+        }
+        if self._trace:
+            data.update(trace_fields(scan))
+        return data
+
+    def _wake(self):
+        if self._breaker:
+            self._breaker.wake()
 
-    def stop(self):
-        super().stop()
+    def stop(self, timeout: float = 0.0):
+        super().stop(timeout)
         if self._redis:
             self._redis.close()
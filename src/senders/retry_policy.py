@@ -0,0 +1,199 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from logging import Logger, getLogger
+from random import random
+from threading import Condition
+from time import monotonic
+from typing import Optional
+
+from metrics.registry import REGISTRY, GaugeValue
+
+CIRCUIT_STATE = REGISTRY.gauge(
+    "barcode_relay_circuit_state",
+    "Target circuit breaker state (0 closed, 1 open, 2 half open), by target", ["target"])
+CIRCUIT_OPENINGS = REGISTRY.counter(
+    "barcode_relay_circuit_openings_total", "Times the target circuit breaker opened, by target",
+    ["target"])
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = { CLOSED: 0, OPEN: 1, HALF_OPEN: 2 }
+
+class RetriesExhausted(Exception):
+    """Raised when a batch could not be sent within the attempts (or the deadline) of the policy"""
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter: the n-th retry waits initial_ms * multiplier^(n-1),
+    capped to max_ms, minus a random fraction (up to jitter) so that workers and relays
+    failing together don't retry in lockstep.
+    max_attempts and deadline_ms (0 = unlimited) bound how long a single batch is retried.
+    """
+    initial_ms: int
+    max_ms: int
+    multiplier: float
+    jitter: float
+    max_attempts: int
+    deadline_ms: int
+
+    def __init__(
+        self,
+        initial_ms: int = 100,
+        max_ms: int = 5000,
+        multiplier: float = 2.0,
+        jitter: float = 0.2,
+        max_attempts: int = 0,
+        deadline_ms: int = 0
+    ) -> None:
+        self.initial_ms = initial_ms
+        self.max_ms = max_ms
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.deadline_ms = deadline_ms
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after the given (1-based) failed attempt"""
+        delay_ms = min(self.max_ms, self.initial_ms * self.multiplier ** (attempt - 1))
+        return delay_ms * (1.0 - self.jitter * random()) / 1000.0
+
+    def exhausted(self, attempt: int, started: float, now: Optional[float] = None) -> bool:
+        """
+        Check if no more attempts are allowed after the given (1-based) failed attempt,
+        started is the monotonic time of the first attempt
+        """
+        if self.max_attempts and attempt >= self.max_attempts:
+            return True
+        if self.deadline_ms:
+            if now is None:
+                now = monotonic()
+            return (now - started) * 1000.0 >= self.deadline_ms
+        return False
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by the workers sending to the same target.
+    After failure_threshold consecutive failures the circuit opens: workers stop sending
+    and wait, while every probe_interval_ms a single worker is allowed through (half open)
+    to probe the target. A successful probe closes the circuit and wakes every waiting
+    worker, so the backlog is flushed as soon as the target is back.
+    """
+    _logger: Logger
+    _name: str
+    _failure_threshold: int
+    _probe_interval_s: float
+
+    _condition: Condition
+    _state: str
+    _failures: int
+    _next_probe: float
+
+    _gauge: GaugeValue
+
+    def __init__(self, name: str, failure_threshold: int = 3, probe_interval_ms: int = 500) -> None:
+        self._logger = getLogger()
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._probe_interval_s = probe_interval_ms / 1000.0
+
+        self._condition = Condition()
+        self._state = CLOSED
+        self._failures = 0
+        self._next_probe = 0.0
+
+        self._gauge = CIRCUIT_STATE.labels(name)
+        self._gauge.set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        """Current state: closed, open or half_open"""
+        return self._state
+
+    def acquire(self) -> str:
+        """
+        Return the state the caller has to act in:
+         - closed: send normally
+         - half_open: the caller owns the probe, report the outcome with record_success/failure
+         - open: wait (see wait) and try again
+        """
+        with self._condition:
+            if self._state == OPEN and monotonic() >= self._next_probe:
+                self._set_state(HALF_OPEN)
+                return HALF_OPEN
+            if self._state == HALF_OPEN:
+                # Somebody else is probing
+                return OPEN
+            return self._state
+
+    def wait(self, timeout: Optional[float] = None):
+        """Wait until the next probe is due, the state changes or wake is called"""
+        with self._condition:
+            if self._state == CLOSED:
+                return
+            remaining = max(0.0, self._next_probe - monotonic())
+            if self._state == OPEN and remaining == 0.0:
+                return
+            if self._state == OPEN:
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            self._condition.wait(timeout)
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe is due (0 if not open), for callers that can't wait()"""
+        with self._condition:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._next_probe - monotonic())
+
+    def wake(self):
+        """Wake up every waiting worker (e.g. when stopping)"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def record_success(self):
+        """Report a successful request (or probe), closing the circuit"""
+        with self._condition:
+            self._failures = 0
+            if self._state != CLOSED:
+                self._set_state(CLOSED)
+                self._logger.info(
+                    "Target %s is back, circuit closed", self._name,
+                    extra={ 'component': 'SENDER' }
+                )
+
+    def record_failure(self):
+        """Report a failed request (or probe), opening the circuit if needed"""
+        with self._condition:
+            self._failures += 1
+            if self._state == HALF_OPEN or (
+                    self._state == CLOSED and self._failures >= self._failure_threshold):
+                if self._state == CLOSED:
+                    CIRCUIT_OPENINGS.labels(self._name).inc()
+                    self._logger.warning(
+                        "Target %s is failing, circuit opened (probing every %sms)",
+                        self._name, int(self._probe_interval_s * 1000),
+                        extra={ 'component': 'SENDER' }
+                    )
+                self._next_probe = monotonic() + self._probe_interval_s
+                self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        self._state = state
+        self._gauge.set(STATE_VALUES[state])
+        self._condition.notify_all()
@@ -15,30 +15,140 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-from threading import Thread
+from threading import Event, Lock, Thread
 from queue import Queue, Empty
 from logging import Logger, getLogger
+from time import monotonic, monotonic_ns, perf_counter, time
 import json
 
+from metrics.registry import REGISTRY
+from scan import Scan, observe_sent
+from .retry_policy import RetriesExhausted
+
+# Longest wait on the queue before checking for stop (bounds the shutdown latency)
+STOP_CHECK_S = 0.05
+
+SENT_SCANS = REGISTRY.counter("barcode_relay_sent_scans_total", "Scans sent to the target")
+BATCH_SIZE = REGISTRY.histogram(
+    "barcode_relay_send_batch_size", "Scans sent in a single batch",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+BATCH_LATENCY = REGISTRY.histogram(
+    "barcode_relay_send_batch_seconds", "Time needed to send a batch (retries included)")
+LAST_SEND = REGISTRY.gauge(
+    "barcode_relay_last_send_timestamp_seconds", "Time of the last batch acknowledged by the target")
+DROPPED_SCANS = REGISTRY.counter(
+    "barcode_relay_dropped_scans_total", "Scans dropped after the retry policy was exhausted")
+
+class BatchStats:
+    """Statistics about the batches sent by a sender"""
+    batches: int
+    scans: int
+    max_size: int
+    total_latency: float
+    max_latency: float
+    # Time of the last batch sent (0 if none)
+    last_send: float
+
+    def __init__(self):
+        self._lock = Lock()
+        self.batches = 0
+        self.scans = 0
+        self.max_size = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_send = 0.0
+
+    def record(self, size: int, latency: float):
+        """Record a batch of the given size, sent in latency seconds"""
+        with self._lock:
+            self.batches += 1
+            self.scans += size
+            self.max_size = max(self.max_size, size)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.last_send = time()
+
+    def snapshot(self) -> dict:
+        """Return the current statistics (average and max batch size and latency in ms)"""
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'scans': self.scans,
+                'avg_size': self.scans / self.batches if self.batches else 0.0,
+                'max_size': self.max_size,
+                'avg_latency_ms': self.total_latency * 1000.0 / self.batches if self.batches else 0.0,
+                'max_latency_ms': self.max_latency * 1000.0,
+                'last_send': self.last_send,
+            }
+
 class Sender:
     """Generic sender"""
     _logger: Logger
+    # Cleared on stop, the thread keeps sending until the queue is empty
+    # (draining) or the stop event is set
     _run: bool
     _thread: Thread
 
+    # Set when stopping, waits between retries use it to wake up immediately
+    _stop_event: Event
+
     _relay_name: str
     _queue: Queue = None
     _polling_ms: int
 
-    def __init__(self, relay_name: str, queue: Queue, polling_ms: int = 1000):
+    # Send up to batch_size scans at once, waiting up to batch_linger_ms
+    # for the batch to fill up
+    _batch_size: int
+    _batch_linger_ms: int
+    _stats: BatchStats
+
+    # Scans taken from the queue that couldn't be sent before stopping (not acknowledged)
+    _unsent: list[Scan]
+    # Scans of the batch being sent
+    _in_flight: int
+
+    def __init__(
+        self,
+        relay_name: str,
+        queue: Queue,
+        polling_ms: int = 1000,
+        batch_size: int = 1,
+        batch_linger_ms: int = 0
+    ):
         self._logger = getLogger()
         self._run = False
         self._thread = None
+        self._stop_event = Event()
 
         self._relay_name = relay_name
         self._queue = queue
         self._polling_ms = polling_ms
 
+        self._batch_size = batch_size
+        self._batch_linger_ms = batch_linger_ms
+        self._stats = BatchStats()
+        self._unsent = []
+        self._in_flight = 0
+
+    @property
+    def stats(self) -> BatchStats:
+        """Statistics about the sent batches"""
+        return self._stats
+
+    def qsize(self) -> int:
+        """Scans taken from the queue and not sent yet"""
+        return self._in_flight + len(self._unsent)
+
+    def take_unsent(self) -> list[Scan]:
+        """
+        Return the scans taken from the queue and not sent before stopping, acknowledging
+        them: the caller takes care of them (e.g. persisting them for the next run)
+        """
+        unsent, self._unsent = self._unsent, []
+        for _ in unsent:
+            self._queue.task_done()
+        return unsent
+
     def start(self):
         """Start the working thread"""
         self._logger.info(
@@ -46,31 +156,129 @@ class Sender:
             extra={ 'component': 'SENDER' }
         )
         self._run = True
+        self._stop_event.clear()
         self._thread = Thread(target=self.run)
         self._thread.start()
 
     def run(self):
         """Actual working function"""
-        while self._run:
-            try:
-                (device, code, ts) = self._queue.get(True, self._polling_ms / 1000.0)
+        while not self._stop_event.is_set():
+            batch = self._next_batch()
+            if not batch:
+                if not self._run:
+                    # Stopping and the queue has been drained
+                    break
+                continue
+
+            for scan in batch:
                 self._logger.info(
-                    "Sending scan %s", json.dumps({'code': code}),
+                    "Sending scan %s", json.dumps({'code': scan.code}),
                     extra={ 'component': 'SENDER' }
                 )
-                self._send(device, code, ts)
+
+            start = perf_counter()
+            self._in_flight = len(batch)
+            try:
+                if not self._send_batch(batch):
+                    # Stopped before the batch could be sent
+                    self._unsent.extend(batch)
+                    continue
+            except RetriesExhausted as e:
+                DROPPED_SCANS.inc(len(batch))
+                self._logger.error(
+                    "Dropped %s scans: %s", len(batch), e,
+                    extra={ 'component': 'SENDER' }
+                )
+                for _ in batch:
+                    self._queue.task_done()
+                continue
+            finally:
+                self._in_flight = 0
+            latency = perf_counter() - start
+            observe_sent(batch, monotonic_ns())
+            LAST_SEND.set(time())
+            self._stats.record(len(batch), latency)
+            SENT_SCANS.inc(len(batch))
+            BATCH_SIZE.observe(len(batch))
+            BATCH_LATENCY.observe(latency)
+
+            # Acknowledge the sent scans (needed by persistent queues)
+            for _ in batch:
+                self._queue.task_done()
+
+            if self._batch_size > 1:
+                self._logger.debug(
+                    "Sent batch of %s scans in %.2fms", len(batch), latency * 1000.0,
+                    extra={ 'component': 'SENDER' }
+                )
+
+    def _next_batch(self) -> list[Scan]:
+        """
+        Wait for the next scan, then keep draining the queue until the batch is full
+        or the linger time has expired. Returns an empty list if no scan is available.
+        Every scan is stamped with the time it was taken from the queue.
+        While draining (stopping) the queue is not waited for.
+        """
+        try:
+            scan = self._queue.get(self._run, min(self._polling_ms / 1000.0, STOP_CHECK_S))
+            batch = [scan._replace(dequeued_ns=monotonic_ns())]
+        except Empty:
+            return []
+
+        deadline = monotonic() + self._batch_linger_ms / 1000.0
+        while len(batch) < self._batch_size:
+            try:
+                remaining = deadline - monotonic()
+                if remaining > 0:
+                    scan = self._queue.get(True, remaining)
+                else:
+                    scan = self._queue.get_nowait()
+                batch.append(scan._replace(dequeued_ns=monotonic_ns()))
             except Empty:
-                pass
+                break
+
+        return batch
+
+    def _send_batch(self, batch: list[Scan]) -> bool:
+        """
+        Send a batch of scans, in order. Returns True if the batch has been sent,
+        False if stopped before, raises RetriesExhausted if the batch has to be dropped.
+        """
+        for scan in batch:
+            self._send(scan)
+        return True
 
-    def _send(self, device, code, ts):
+    def _send(self, scan: Scan):
         pass
 
-    def stop(self):
-        """Stop the working thread"""
+    def _wake(self):
+        """Wake up the working thread, if waiting for something other than the stop event"""
+
+    def drain(self):
+        """Stop waiting for new scans: the thread exits as soon as the queue is empty"""
+        self._run = False
+
+    def stop(self, timeout: float = 0.0):
+        """
+        Stop the working thread. Within timeout seconds, the scans still in the queue
+        are sent first (see drain), then the scans being sent are given up (see take_unsent).
+        """
         self._logger.info(
             "Stopping sender",
             extra={ 'component': 'SENDER' }
         )
         self._run = False
+        if self._thread and timeout > 0:
+            self._thread.join(timeout)
+        self._stop_event.set()
+        self._wake()
         if self._thread:
             self._thread.join()
+
+        if self._stats.batches > 0:
+            self._logger.info(
+                "Sent %(scans)s scans in %(batches)s batches "
+                "(avg size %(avg_size).1f, avg latency %(avg_latency_ms).2fms, "
+                "max latency %(max_latency_ms).2fms)", self._stats.snapshot(),
+                extra={ 'component': 'SENDER' }
+            )
@@ -0,0 +1,222 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from collections import deque
+from logging import Logger, getLogger
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable
+import zlib
+
+from .sender import STOP_CHECK_S, BatchStats, Sender
+
+# Max scans waiting in each partition, a partition that falls behind stops the
+# dispatching (instead of taking every scan out of a bounded / persistent queue)
+PARTITION_CAPACITY = 1000
+
+def partition_of(device: str, partitions: int) -> int:
+    """Partition of the device (stable across restarts)"""
+    return zlib.crc32(device.encode()) % partitions
+
+class PartitionQueue(Queue):
+    """
+    Queue of a single partition. Remembers the sequence number of every scan returned by get(),
+    so that task_done() acknowledges the right scan of the input queue.
+    """
+    _pending: deque
+
+    def __init__(self, maxsize: int, on_done: Callable[[int], None]):
+        super().__init__(maxsize)
+        self._pending = deque()
+        self._on_done = on_done
+
+    def _get(self):
+        (seq, item) = self.queue.popleft()
+        self._pending.append(seq)
+        return item
+
+    def task_done(self):
+        self._on_done(self._pending.popleft())
+        super().task_done()
+
+class SenderPool:
+    """
+    Pool of K senders, each one with its own connection, retry state and thread.
+    Scans are partitioned by device, so the order of every device is preserved, and
+    a slow or failing partition doesn't stall the others (until its queue is full).
+    Scans are acknowledged to the input queue in order, once all the previous ones have been sent.
+    """
+    _logger: Logger
+    # Cleared on stop, the dispatcher keeps going until the input queue is empty
+    # (draining) or the stop event is set
+    _run: bool
+    _stop_event: Event
+    _thread: Thread
+    _queue: Queue
+    _polling_ms: int
+
+    _partitions: list[PartitionQueue]
+    _senders: list[Sender]
+
+    # (seq, scan) taken from the input queue and not dispatched before stopping
+    _unsent: list[tuple]
+
+    # Next sequence number to dispatch / to acknowledge, and the ones sent out of order
+    _next_seq: int
+    _next_ack: int
+    _done: set[int]
+    _lock: Lock
+
+    def __init__(
+        self,
+        queue: Queue,
+        workers: int,
+        sender_factory: Callable[[Queue], Sender],
+        polling_ms: int = 1000,
+        partition_capacity: int = PARTITION_CAPACITY
+    ):
+        self._logger = getLogger()
+        self._run = False
+        self._stop_event = Event()
+        self._thread = None
+        self._queue = queue
+        self._polling_ms = polling_ms
+        self._unsent = []
+
+        self._next_seq = 0
+        self._next_ack = 0
+        self._done = set()
+        self._lock = Lock()
+
+        self._partitions = [PartitionQueue(partition_capacity, self._ack) for _ in range(workers)]
+        self._senders = [sender_factory(partition) for partition in self._partitions]
+
+    @property
+    def stats(self) -> BatchStats:
+        """Statistics about the batches sent by all the workers"""
+        stats = BatchStats()
+        for sender in self._senders:
+            snapshot = sender.stats.snapshot()
+            stats.batches += snapshot['batches']
+            stats.scans += snapshot['scans']
+            stats.max_size = max(stats.max_size, snapshot['max_size'])
+            stats.total_latency += snapshot['avg_latency_ms'] * snapshot['batches'] / 1000.0
+            stats.max_latency = max(stats.max_latency, snapshot['max_latency_ms'] / 1000.0)
+            stats.last_send = max(stats.last_send, snapshot['last_send'])
+        return stats
+
+    def qsize(self) -> int:
+        """Scans taken from the input queue and not sent yet (waiting in a partition or being sent)"""
+        return len(self._unsent) + sum(
+            partition.qsize() + sender.qsize()
+            for (partition, sender) in zip(self._partitions, self._senders))
+
+    def start(self):
+        """Start the workers and the dispatching thread"""
+        self._logger.info(
+            "Starting sender pool (%s workers)", len(self._senders),
+            extra={ 'component': 'SENDER' }
+        )
+        for sender in self._senders:
+            sender.start()
+        self._run = True
+        self._stop_event.clear()
+        self._thread = Thread(target=self.run)
+        self._thread.start()
+
+    def run(self):
+        """Move the scans from the input queue to the partition of their device"""
+        while not self._stop_event.is_set():
+            try:
+                item = self._queue.get(self._run, min(self._polling_ms / 1000.0, STOP_CHECK_S))
+            except Empty:
+                if not self._run:
+                    # Stopping and the input queue has been drained
+                    break
+                continue
+
+            partition = self._partitions[partition_of(item[0], len(self._partitions))]
+            with self._lock:
+                seq = self._next_seq
+                self._next_seq += 1
+            self._put(partition, (seq, item))
+
+    def _put(self, partition: PartitionQueue, entry: tuple):
+        """Put in the partition, waiting while it's full (unless stopped)"""
+        while True:
+            try:
+                partition.put(entry, True, min(self._polling_ms / 1000.0, STOP_CHECK_S))
+                return
+            except Full:
+                if self._stop_event.is_set():
+                    # Not acknowledged, a persistent queue replays it
+                    self._unsent.append(entry)
+                    return
+
+    def _ack(self, seq: int):
+        """A worker has sent the scan, acknowledge it and the following ones (if sent)"""
+        with self._lock:
+            self._done.add(seq)
+            while self._next_ack in self._done:
+                self._done.remove(self._next_ack)
+                self._next_ack += 1
+                self._queue.task_done()
+
+    def take_unsent(self) -> list:
+        """
+        Return the scans taken from the input queue and not sent before stopping,
+        acknowledging them: the caller takes care of them (e.g. persisting them for the next run)
+        """
+        unsent = []
+        for (sender, partition) in zip(self._senders, self._partitions):
+            unsent.extend(sender.take_unsent())
+            while True:
+                try:
+                    unsent.append(partition.get_nowait())
+                except Empty:
+                    break
+                partition.task_done()
+
+        for (seq, item) in self._unsent:
+            self._ack(seq)
+            unsent.append(item)
+        self._unsent = []
+        return unsent
+
+    def stop(self, timeout: float = 0.0):
+        """
+        Stop dispatching, then stop the workers. Within timeout seconds, the scans still
+        in the input queue are dispatched and sent first.
+        """
+        self._logger.info(
+            "Stopping sender pool",
+            extra={ 'component': 'SENDER' }
+        )
+        deadline = monotonic() + timeout
+        self._run = False
+        if self._thread and timeout > 0:
+            self._thread.join(timeout)
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+        # Let every worker drain its partition in parallel, within what's left of the timeout
+        for sender in self._senders:
+            sender.drain()
+        for sender in self._senders:
+            sender.stop(max(0.0, deadline - monotonic()))
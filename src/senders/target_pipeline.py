@@ -0,0 +1,87 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+from time import monotonic, time
+
+from metrics.registry import REGISTRY
+from .retry_policy import CircuitBreaker
+from .sender import Sender
+
+TARGET_LAG = REGISTRY.gauge(
+    "barcode_relay_target_lag_scans", "Scans not sent to the target yet, by target", ["target"])
+TARGET_LAST_SEND = REGISTRY.gauge(
+    "barcode_relay_target_last_send_timestamp_seconds",
+    "Time of the last batch acknowledged by the target, by target", ["target"])
+
+class TargetPipeline:
+    """
+    Everything a target needs to be sent to independently of the other targets:
+    its own queue, sender (or sender pool) and circuit breaker, and the path where
+    the scans left in its queue are saved on shutdown.
+    """
+    name: str
+    queue = None
+    sender: Sender
+    breaker: CircuitBreaker
+    shutdown_path: str
+
+    # Scans sent and time of the previous status
+    _last_scans: int
+    _last_time: float
+
+    def __init__(
+        self,
+        name: str,
+        queue,
+        sender: Sender,
+        breaker: CircuitBreaker,
+        shutdown_path: str
+    ) -> None:
+        self.name = name
+        self.queue = queue
+        self.sender = sender
+        self.breaker = breaker
+        self.shutdown_path = shutdown_path
+
+        self._last_scans = 0
+        self._last_time = monotonic()
+
+        TARGET_LAG.labels(name).set_function(self.lag)
+        TARGET_LAST_SEND.labels(name).set_function(lambda: sender.stats.last_send)
+
+    def lag(self) -> int:
+        """Scans not sent to the target yet, waiting in its queue or taken by its sender(s)"""
+        return self.queue.qsize() + self.sender.qsize()
+
+    def status(self) -> dict:
+        """
+        How far behind the target is: scans not sent yet, scans sent per second since the
+        previous status, age of the last send, breaker state
+        """
+        stats = self.sender.stats
+        now = monotonic()
+        elapsed = now - self._last_time
+        rate = (stats.scans - self._last_scans) / elapsed if elapsed > 0 else 0.0
+        self._last_scans = stats.scans
+        self._last_time = now
+
+        return {
+            'queue_depth': self.lag(),
+            'scans_per_s': round(rate, 2),
+            'last_send_age_s': round(time() - stats.last_send, 3) if stats.last_send else None,
+            'state': self.breaker.state,
+        }
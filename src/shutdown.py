@@ -0,0 +1,167 @@
+#
+# This file is part of the BarcodeRelay distribution (https://github.com/SirAfino/barcode-relay).
+# Copyright (c) 2024 Gabriele Serafino.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+from logging import Logger, getLogger
+from queue import Empty
+import signal
+from threading import Event
+from time import monotonic
+
+from metrics.registry import REGISTRY
+from queues.bounded_queue import SPILL
+from queues.segment_spool import SegmentSpool
+
+SHUTDOWN_SCANS = REGISTRY.counter(
+    "barcode_relay_shutdown_scans_total",
+    "Scans handled while shutting down, by outcome (flushed, persisted, replayed)", ["outcome"])
+
+def _has_room(queue) -> bool:
+    """False if putting a scan would trigger the overflow policy of a bounded queue (other than spill)"""
+    if getattr(queue, 'policy', SPILL) == SPILL:
+        return True
+    return not queue.full()
+
+class ShutdownCoordinator:
+    """
+    Coordinate the shutdown of the relay: SIGTERM / SIGINT set the shutdown event, then
+    (once the readers have been stopped) every target drains its queue within timeout_ms.
+    Scans left in a non persistent queue are saved in a spool at the target shutdown path,
+    and put back in its queue on the next start, so that a restart doesn't lose any scan.
+    """
+    _logger: Logger
+    _event: Event
+    _timeout_ms: int
+
+    def __init__(self, timeout_ms: int = 5000) -> None:
+        self._logger = getLogger()
+        self._event = Event()
+        self._timeout_ms = timeout_ms
+
+    @property
+    def requested(self) -> bool:
+        """True once the shutdown has been requested"""
+        return self._event.is_set()
+
+    def install(self):
+        """Request the shutdown on SIGTERM and SIGINT (must be called from the main thread)"""
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self._on_signal)
+
+    def _on_signal(self, signum, _frame):
+        self._logger.info("Received %s, shutting down", signal.Signals(signum).name)
+        self.request()
+
+    def request(self):
+        """Request the shutdown"""
+        self._event.set()
+
+    def wait(self):
+        """Block until the shutdown is requested"""
+        # Waiting on a lock can't be interrupted by signals on Windows
+        timeout = 1.0 if os.name == 'nt' else None
+        while not self._event.wait(timeout):
+            pass
+
+    def replay(self, queue, spool_path: str) -> int:
+        """
+        Put the scans saved by the previous shutdown at spool_path back in the queue,
+        returns their number. The senders are not running yet: scans that don't fit in
+        a bounded queue are left in the spool (and replayed on the next start) instead
+        of blocking the startup or being dropped by the overflow policy.
+        """
+        if not os.path.isdir(spool_path):
+            return 0
+
+        spool = SegmentSpool(spool_path)
+        count = 0
+        try:
+            while _has_room(queue):
+                try:
+                    (scan, position) = spool.read(False)
+                except Empty:
+                    break
+                queue.put(scan, False)
+                spool.ack(position)
+                count += 1
+            left = spool.pending
+        finally:
+            spool.close()
+
+        if count:
+            SHUTDOWN_SCANS.labels("replayed").inc(count)
+            self._logger.info("Replaying %s scans saved on shutdown from %s", count, spool_path)
+        if left:
+            self._logger.warning(
+                "Queue full, %s scans saved on shutdown left in %s for the next start",
+                left, spool_path)
+        return count
+
+    def drain(self, targets: list):
+        """
+        Stop the sender of every target, letting them send the queued scans within the
+        timeout, then save what's left (unless the queue is persistent).
+        Targets still running keep sending while the previous ones are stopped,
+        so they share the same deadline.
+        """
+        start = monotonic()
+        deadline = start + self._timeout_ms / 1000.0
+        flushed = 0
+        persisted = 0
+        for target in targets:
+            (target_flushed, target_persisted) = self._drain(target, deadline)
+            flushed += target_flushed
+            persisted += target_persisted
+
+        self._logger.info(
+            "Shutdown in %.0fms: %s scans flushed, %s persisted",
+            (monotonic() - start) * 1000.0, flushed, persisted)
+
+    def _drain(self, target, deadline: float) -> tuple[int, int]:
+        """Drain a single target, returns the number of flushed and persisted scans"""
+        sender = target.sender
+        queue = target.queue
+        sent = sender.stats.scans
+        sender.stop(max(0.0, deadline - monotonic()))
+        flushed = sender.stats.scans - sent
+        SHUTDOWN_SCANS.labels("flushed").inc(flushed)
+
+        if getattr(queue, 'persistent', False):
+            self._logger.info(
+                "Target %s: %s scans flushed, %s left in the spool",
+                target.name, flushed, queue.qsize())
+            return (flushed, 0)
+
+        # Scans being sent first, then the ones still in the queue (per device order is kept)
+        scans = sender.take_unsent()
+        while True:
+            try:
+                scans.append(queue.get_nowait())
+            except Empty:
+                break
+            queue.task_done()
+
+        if scans:
+            spool = SegmentSpool(target.shutdown_path)
+            for scan in scans:
+                spool.append(scan)
+            spool.close()
+
+        SHUTDOWN_SCANS.labels("persisted").inc(len(scans))
+        self._logger.info(
+            "Target %s: %s scans flushed, %s persisted", target.name, flushed, len(scans))
+        return (flushed, len(scans))